@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""
+Rows per second for iterating a mixed polymorphic queryset, comparing the
+old approach of digging through attrgetters (catching ObjectDoesNotExist
+for every missing child) with resolving the type from the row itself, and
+with building only the deepest instance via skip_parents().
+
+    python -m benchmarks.iteration --rows 100000
+"""
+from __future__ import absolute_import, print_function
+import argparse
+from benchmarks.utils import setup_django, insert_rows, best_of
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    setup_django()
+    from django.db.models.query import ModelIterable
+    from inheritrix import dig_for_obj
+    from test_app.models import (Jeff, JeffSon, JeffDaughter, JeffGrandSon,
+                                 JeffGrandDaughter, JeffGreatGrandSon1,
+                                 JeffGreatGrandSon2, JeffGreatGrandDaughter)
+
+    class DiggingModelIterable(ModelIterable):
+        def __iter__(self):
+            attrgetters = self.queryset._our_plan.attrgetters
+            for obj in super(DiggingModelIterable, self).__iter__():
+                yield dig_for_obj(obj=obj, attrgetters=attrgetters)
+
+    models = (Jeff, JeffSon, JeffDaughter, JeffGrandSon, JeffGrandDaughter,
+              JeffGreatGrandSon1, JeffGreatGrandSon2, JeffGreatGrandDaughter)
+    insert_rows(models=models, total=args.rows)
+    queryset = Jeff.polymorphs.select_subclasses()
+
+    def digging():
+        qs = queryset.all()
+        qs._iterable_class = DiggingModelIterable
+        return sum(1 for _ in qs.iterator())
+
+    def from_row():
+        return sum(1 for _ in queryset.iterator())
+
+    def skipping_parents():
+        return sum(1 for _ in queryset.skip_parents().iterator())
+
+    for name, function in (('dig_for_obj', digging), ('from row', from_row),
+                           ('skip parents', skipping_parents)):
+        taken, count = best_of(function, repeat=args.repeat)
+        print("%-12s %8d rows in %.3fs: %10.0f rows/sec" % (
+            name, count, taken, count / taken))
+
+
+if __name__ == '__main__':
+    main()
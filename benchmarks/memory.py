@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+Peak memory used while streaming a polymorphic queryset with iterator(),
+for each strategy and increasing numbers of rows, compared with list().
+Streaming should stay roughly flat however many rows there are; what
+growth remains is parents and children referring to each other through
+their caches, which only the cycle collector reclaims, and comes back down
+when it runs. Python 3 only, as it uses tracemalloc.
+
+    python -m benchmarks.memory --rows 10000 50000 100000
+"""
+from __future__ import absolute_import, print_function
+import argparse
+import gc
+import tracemalloc
+from benchmarks.utils import setup_django, insert_rows
+
+
+def peak_memory(function):
+    """
+    Run the function, returning the peak number of bytes traced while it
+    ran, and its result.
+    """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak, result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+',
+                        default=[10000, 50000, 100000])
+    args = parser.parse_args(argv)
+
+    connection = setup_django()
+    from inheritrix import JOIN, SPLIT, TWO_PHASE
+    from test_app.models import (Jeff, JeffSon, JeffDaughter, JeffGrandSon,
+                                 JeffGrandDaughter, JeffGreatGrandSon1,
+                                 JeffGreatGrandSon2, JeffGreatGrandDaughter)
+
+    models = (Jeff, JeffSon, JeffDaughter, JeffGrandSon, JeffGrandDaughter,
+              JeffGreatGrandSon1, JeffGreatGrandSon2, JeffGreatGrandDaughter)
+    inserted = 0
+    for total in sorted(args.rows):
+        # top the tables up to the next size.
+        with connection.cursor() as cursor:
+            for model in reversed(models):
+                cursor.execute("DELETE FROM %s" % connection.ops.quote_name(
+                    model._meta.db_table))
+        insert_rows(models=models, total=total)
+        inserted = total
+        queryset = Jeff.polymorphs.select_subclasses().order_by('pk')
+        for strategy in (JOIN, SPLIT, TWO_PHASE):
+            qs = queryset.strategy(strategy)
+
+            def streamed():
+                count = 0
+                for _ in qs.iterator():
+                    count += 1
+                return count
+
+            def listed():
+                return len(list(qs.all()))
+
+            for name, function in (('iterator', streamed), ('list', listed)):
+                peak, count = peak_memory(function)
+                print("%7d rows %-9s %-8s peak %8.1f KiB" % (
+                    count, strategy, name, peak / 1024.0))
+    return inserted
+
+
+if __name__ == '__main__':
+    main()
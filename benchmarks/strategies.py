@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""
+Compare the JOIN, SPLIT and TWO_PHASE strategies for fetching polymorphic
+results, for a full scan and for a page, across a few selections of subclasses.
+
+    python -m benchmarks.strategies --rows 50000
+"""
+from __future__ import absolute_import, print_function
+import argparse
+from benchmarks.utils import setup_django, insert_rows, best_of
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=50000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    setup_django()
+    from inheritrix import JOIN, SPLIT, TWO_PHASE
+    from test_app.models import (Jeff, JeffSon, JeffDaughter, JeffGrandSon,
+                                 JeffGrandDaughter, JeffGreatGrandSon1,
+                                 JeffGreatGrandSon2, JeffGreatGrandDaughter)
+
+    models = (Jeff, JeffSon, JeffDaughter, JeffGrandSon, JeffGrandDaughter,
+              JeffGreatGrandSon1, JeffGreatGrandSon2, JeffGreatGrandDaughter)
+    insert_rows(models=models, total=args.rows)
+    selections = (
+        ('everything', Jeff.polymorphs.select_subclasses()),
+        ('two leaves', Jeff.polymorphs.models(JeffGreatGrandSon1,
+                                              JeffGreatGrandDaughter)),
+        ('one branch', Jeff.polymorphs.models(JeffSon, JeffGrandSon,
+                                              JeffGreatGrandSon2,
+                                              include_self=True)),
+    )
+    for name, queryset in selections:
+        for shape, sliced in (('scan', queryset.order_by('pk')),
+                              ('page', queryset.order_by('-pk')[1000:1050])):
+            for strategy in (JOIN, SPLIT, TWO_PHASE):
+                qs = sliced.strategy(strategy)
+                taken, count = best_of(lambda: len(list(qs.all())),
+                                       repeat=args.repeat)
+                print("%-10s %-4s %-9s %6d rows in %.4fs" % (
+                    name, shape, strategy, count, taken))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""
+Measure models() across hierarchy shapes, saving or comparing against a
+baseline.
+
+For the Jeff hierarchy from test_app and some generated ones (deep, wide
+and bushy), with every subclass selected and with just one leaf selected,
+it measures:
+
+  build_cold_us  building the queryset with models(), with no cached plans
+  build_warm_us  the same, once the plan is cached
+  sql_ms         executing the SQL and fetching the rows, without any models
+  row_us         the time per row spent building instances, on top of that
+  peak_kib       peak memory while list()ing the results (Python 3 only)
+
+    python -m benchmarks.suite --rows 20000 --save benchmarks/baseline.json
+    python -m benchmarks.suite --rows 20000 --compare benchmarks/baseline.json
+
+Comparing reports each measurement as a ratio of the baseline, and exits
+with status 1 if any is more than --threshold times slower (or bigger).
+Timings only compare well against a baseline made on the same machine.
+"""
+from __future__ import absolute_import, print_function
+import argparse
+import json
+import sys
+from collections import OrderedDict
+from benchmarks.utils import setup_django, insert_rows, best_of
+try:
+    from benchmarks.memory import peak_memory
+except ImportError:
+    # no tracemalloc before Python 3.4
+    peak_memory = None
+
+
+# the fastest of this many runs is taken for every timing, to cut the noise.
+REPEAT = 5
+SHAPES = OrderedDict((
+    ('deep', {'depth': 6, 'breadth': 1}),
+    ('wide', {'depth': 1, 'breadth': 12}),
+    ('bushy', {'depth': 3, 'breadth': 3}),
+))
+
+
+def per_call(function, number):
+    """
+    The fastest time for one call to the function, in microseconds, when
+    called number times in a row.
+    """
+    def calls():
+        for _ in range(number):
+            function()
+    taken, _ = best_of(calls, repeat=REPEAT)
+    return taken * 1e6 / number
+
+
+def measure(queryset, build, rows):
+    """
+    Returns OrderedDict of {measurement: value} for the queryset (whose
+    build() returns it afresh), which should give the given number of rows.
+    """
+    from django.db import connections
+    from inheritrix import query_plans
+
+    def cold():
+        query_plans.clear()
+        return build()
+    results = OrderedDict()
+    results['build_cold_us'] = per_call(cold, number=200)
+    results['build_warm_us'] = per_call(build, number=2000)
+
+    connection = connections[queryset.db]
+    sql, params = queryset.query.get_compiler(using=queryset.db).as_sql()
+
+    def execute():
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return len(cursor.fetchall())
+    sql_taken, count = best_of(execute, repeat=REPEAT)
+    assert count == rows, (count, rows)
+    results['sql_ms'] = sql_taken * 1e3
+    list_taken, _ = best_of(lambda: list(queryset.all()), repeat=REPEAT)
+    results['row_us'] = max(list_taken - sql_taken, 0) * 1e6 / rows
+    if peak_memory is not None:
+        peak, _ = peak_memory(lambda: list(queryset.all()))
+        results['peak_kib'] = peak / 1024.0
+    return results
+
+
+def run(rows):
+    """
+    Returns an OrderedDict of {'shape/selection': {measurement: value}}
+    """
+    connection = setup_django()
+    from benchmarks.synthetic import make_hierarchy, leaves
+    from test_app.models import (Jeff, JeffSon, JeffDaughter, JeffGrandSon,
+                                 JeffGrandDaughter, JeffGreatGrandSon1,
+                                 JeffGreatGrandSon2, JeffGreatGrandDaughter)
+
+    hierarchies = OrderedDict()
+    hierarchies['jeff'] = [Jeff, JeffSon, JeffDaughter, JeffGrandSon,
+                           JeffGrandDaughter, JeffGreatGrandSon1,
+                           JeffGreatGrandSon2, JeffGreatGrandDaughter]
+    for name, shape in SHAPES.items():
+        hierarchies[name] = make_hierarchy(name='Bench%s' % name.title(),
+                                           **shape)
+
+    results = OrderedDict()
+    for name, hierarchy in hierarchies.items():
+        root = hierarchy[0]
+        counts = insert_rows(models=hierarchy, total=rows)
+        leaf = leaves(hierarchy)[-1]
+        selections = (
+            ('all', lambda: root.polymorphs.select_subclasses(), rows),
+            ('one leaf', lambda: root.polymorphs.models(leaf), counts[leaf]),
+        )
+        for selection, build, expected in selections:
+            key = '%s/%s' % (name, selection)
+            results[key] = measure(queryset=build(), build=build, rows=expected)
+            print(format_results(key, results[key]))
+            sys.stdout.flush()
+        with connection.cursor() as cursor:
+            for model in reversed(hierarchy):
+                cursor.execute("DELETE FROM %s" % connection.ops.quote_name(
+                    model._meta.db_table))
+    return results
+
+
+def format_results(key, values, baseline=None):
+    parts = []
+    for measurement, value in values.items():
+        part = '%s %9.2f' % (measurement, value)
+        if baseline is not None and baseline.get(measurement):
+            part += ' (%4.2fx)' % (value / baseline[measurement])
+        parts.append(part)
+    return '%-15s %s' % (key, '  '.join(parts))
+
+
+def regressions(results, baseline, threshold):
+    """
+    Yield (key, measurement, ratio) for everything more than threshold times
+    the baseline.
+    """
+    for key, values in results.items():
+        for measurement, value in values.items():
+            before = baseline.get(key, {}).get(measurement)
+            if before and value / before > threshold:
+                yield key, measurement, value / before
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--save', metavar='PATH',
+                        help='write the results as JSON, for use as a baseline')
+    parser.add_argument('--compare', metavar='PATH',
+                        help='a baseline written by --save to compare against')
+    parser.add_argument('--threshold', type=float, default=1.5)
+    args = parser.parse_args(argv)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get('rows') != args.rows:
+            parser.error("the baseline was made with --rows %s" %
+                         baseline.get('rows'))
+    results = run(rows=args.rows)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'rows': args.rows, 'results': results}, f, indent=2)
+            f.write('\n')
+    if baseline is None:
+        return 0
+    print('\nCompared with %s:' % args.compare)
+    for key, values in results.items():
+        print(format_results(key, values,
+                             baseline=baseline['results'].get(key)))
+    slower = list(regressions(results, baseline['results'], args.threshold))
+    for key, measurement, ratio in slower:
+        print('REGRESSION %s %s is %.2fx the baseline' %
+              (key, measurement, ratio))
+    return 1 if slower else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
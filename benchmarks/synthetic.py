@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""
+Generate multi-table inheritance hierarchies of a given depth and breadth
+at runtime, so that the benchmarks aren't limited to the shape of Jeff.
+"""
+from __future__ import absolute_import
+from django.db import connection, models
+
+from inheritrix import InheritingManager
+
+
+def make_model(name, bases, attrs=None):
+    attrs = dict(attrs or {})
+    attrs.update({
+        '__module__': __name__,
+        'Meta': type(str('Meta'), (), {'app_label': 'test_app'}),
+    })
+    return type(str(name), bases, attrs)
+
+
+def make_hierarchy(name, depth, breadth):
+    """
+    Create a root model called name, with breadth children, each of which
+    has breadth children of its own, and so on depth levels down, each model
+    adding one field. Their tables are created too.
+    Returns every model, root first, then depth first.
+    """
+    root = make_model(name, (models.Model,), {
+        'v': models.IntegerField(default=0),
+        'polymorphs': InheritingManager(),
+    })
+    created = [root]
+
+    def add_children(parent, level):
+        if level > depth:
+            return
+        for index in range(breadth):
+            child = make_model('%s_%d' % (parent.__name__, index), (parent,), {
+                'v%d' % level: models.IntegerField(default=level),
+            })
+            created.append(child)
+            add_children(child, level + 1)
+    add_children(root, 1)
+    with connection.schema_editor() as editor:
+        for model in created:
+            editor.create_model(model)
+    return created
+
+
+def leaves(hierarchy):
+    """
+    The models in the hierarchy which have no subclasses of their own.
+    """
+    return [model for model in hierarchy
+            if not any(other is not model and issubclass(other, model)
+                       for other in hierarchy)]
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, print_function
+import os
+import sys
+from collections import defaultdict
+from timeit import default_timer
+
+
+HERE = os.path.realpath(os.path.dirname(__file__))
+ROOT = os.path.dirname(HERE)
+
+
+def setup_django():
+    """
+    Configure Django from test_settings, and create the tables in an
+    in-memory SQLite database, exactly as the test runner would.
+    """
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "test_settings")
+    # with DEBUG on, every query is kept in connection.queries, which skews
+    # both timings and memory use.
+    os.environ.setdefault("DEBUG", "off")
+    import django
+    django.setup()
+    from django.db import connection
+    connection.creation.create_test_db(verbosity=0)
+    return connection
+
+
+def table_chain(model):
+    """
+    The model and its concrete parents, root first.
+    """
+    parents = model._meta.get_parent_list()
+    models = sorted(parents, key=lambda m: len(m._meta.get_parent_list()))
+    models.append(model)
+    return models
+
+
+def insert_rows(models, total, connection=None):
+    """
+    Insert `total` objects, cycling through `models` for their types,
+    straight into each table in their chains with executemany(), as going
+    through save() for every one would take minutes.
+    Returns the number of rows inserted for each model.
+    """
+    from django.db import connection as default_connection
+    connection = connection or default_connection
+    rows = defaultdict(list)
+    counts = defaultdict(int)
+    for pk in range(1, total + 1):
+        model = models[pk % len(models)]
+        counts[model] += 1
+        for table_model in table_chain(model):
+            values = []
+            for field in table_model._meta.local_concrete_fields:
+                if field.primary_key or getattr(field.remote_field,
+                                                'parent_link', False):
+                    values.append(pk)
+                else:
+                    values.append(field.get_db_prep_save(field.get_default(),
+                                                         connection=connection))
+            rows[table_model].append(values)
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        for table_model, values in rows.items():
+            fields = table_model._meta.local_concrete_fields
+            sql = "INSERT INTO %s (%s) VALUES (%s)" % (
+                quote(table_model._meta.db_table),
+                ", ".join(quote(f.column) for f in fields),
+                ", ".join(["%s"] * len(fields)),
+            )
+            cursor.executemany(sql, values)
+    return dict(counts)
+
+
+def best_of(function, repeat=3):
+    """
+    Run the function `repeat` times, returning the fastest time taken,
+    and the last result.
+    """
+    timings = []
+    result = None
+    for _ in range(repeat):
+        start = default_timer()
+        result = function()
+        timings.append(default_timer() - start)
+    return min(timings), result
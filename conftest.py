@@ -2,7 +2,17 @@
 from __future__ import absolute_import
 import django
 from django.conf import settings
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 import os
+import pytest
+
+from inheritrix import JOIN
+# pytest-django has set Django up by the time this is imported.
+from test_app.models import (Jeff, JeffSon, JeffDaughter, JeffGrandSon,
+                             JeffGrandDaughter, JeffGreatGrandSon1,
+                             JeffGreatGrandSon2, JeffGreatGrandDaughter,
+                             RelatesToJeff)
 
 
 HERE = os.path.realpath(os.path.dirname(__file__))
@@ -13,3 +23,34 @@ def pytest_configure():
     os.environ.setdefault("DJANGO_SETTINGS_MODULE", "test_settings")
     if settings.configured and hasattr(django, 'setup'):
         django.setup()
+
+
+ALL_MODELS = (Jeff, JeffSon, JeffDaughter, JeffGrandSon, JeffGrandDaughter,
+              JeffGreatGrandSon1, JeffGreatGrandSon2, JeffGreatGrandDaughter)
+
+
+@pytest.fixture
+def jeffs():
+    """
+    Two of every model in the Jeff hierarchy, with repeating values of v,
+    and every other one having an fk.
+    """
+    fk = RelatesToJeff._default_manager.create()
+    created = []
+    for v, model in enumerate(ALL_MODELS * 2):
+        created.append(model._default_manager.create(
+            v=v % 5, fk=fk if v % 2 else None))
+    return created
+
+
+def assert_same(queryset, strategy):
+    """
+    Check the queryset gives the same instances, of the same classes, with
+    the given strategy as with JOIN, and return the strategy's queries.
+    """
+    joined = list(queryset.strategy(JOIN))
+    with CaptureQueriesContext(connection) as queries:
+        results = list(queryset.strategy(strategy))
+    assert results == joined
+    assert [type(x) for x in results] == [type(x) for x in joined]
+    return queries
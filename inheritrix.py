@@ -1,14 +1,36 @@
-from collections import namedtuple, defaultdict
+from abc import ABCMeta, abstractmethod
+from collections import namedtuple, defaultdict, OrderedDict
+from copy import deepcopy
 from functools import partial
-from itertools import chain, product
-from operator import attrgetter, or_, and_
-from django.core.exceptions import ObjectDoesNotExist
-from django.db.models import QuerySet, Manager, Q
-from django.db.models.query import prefetch_related_objects, ModelIterable
+from heapq import merge
+from itertools import chain, islice
+from operator import attrgetter, itemgetter, or_, and_
+from threading import Lock
+from django.apps import apps
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.exceptions import (ObjectDoesNotExist, FieldDoesNotExist,
+                                    FieldError, ValidationError)
+from django.db import connections, transaction
+from django.db.models import (QuerySet, Manager, Q, Prefetch, Case, When, Value,
+                              CharField, TextField, IntegerField, Count, F,
+                              AutoField)
+from django.db.models.deletion import (CASCADE, DO_NOTHING,
+                                       get_candidate_relations_to_delete)
+from django.db.models.signals import (class_prepared, pre_save, post_save,
+                                      pre_delete, post_delete, m2m_changed)
+from django.db.models.query import (prefetch_related_objects, ModelIterable,
+                                    RelatedPopulator, get_related_populators)
 from django.db.models.constants import LOOKUP_SEP
+from django.db.models.sql import DeleteQuery
+from django.db.models.sql.constants import GET_ITERATOR_CHUNK_SIZE
+from django.db.models.sql.where import AND
+from django.utils.encoding import force_text
 try:
+    from six import string_types, add_metaclass
     from six.moves import range, reduce
 except ImportError:
+    from django.utils.six import string_types, add_metaclass
     from django.utils.six.moves import range, reduce
 
 
@@ -57,23 +79,46 @@ def generate_relation_combinations(lookup_parts):
     return tuple(lookup_parts[0:n] for n in range(1, length))
 
 
-def _generate_q_filters(lookups, isnull, operator):
-    def yielder(_lookups):
-        for lookupset in _lookups:
-            if lookupset:
-                q_objs = tuple(Q(**{'%s__isnull' % LOOKUP_SEP.join(part): isnull})
-                               for part in lookupset)
-                q_objs2 = reduce(and_, q_objs)
-                yield q_objs2
-    out = reduce(operator, yielder(_lookups=lookups))
-    return out
+def minimal_lookups(lookups):
+    """
+    Given lookups like (('a',), ('a', 'b'), ('c', 'd')) drop any which go
+    through another one, because a child can only exist if its parents do,
+    leaving (('a',), ('c', 'd'))
+    """
+    lookups = set(tuple(lookup) for lookup in lookups if lookup)
+    return tuple(sorted(lookup for lookup in lookups
+                        if not any(lookup[0:len(other)] == other
+                                   for other in lookups
+                                   if len(other) < len(lookup))))
+
+
+def isnull_q(lookups, isnull, operator):
+    return reduce(operator, (
+        Q(**{'%s__isnull' % LOOKUP_SEP.join(lookup): isnull})
+        for lookup in lookups))
+
 
 def generate_q_filters(lookups):
-    return _generate_q_filters(lookups, isnull=False, operator=or_)
+    """
+    Given the combinations for each lookup, eg:
+    ((('a',), ('a', 'b')), (('a',), ('a', 'c'), ('a', 'c', 'd')))
+    match rows which have any of them, which only needs the deepest of each
+    checking, and only the shallowest where one goes through another.
+    """
+    leaves = minimal_lookups(lookupset[-1] for lookupset in lookups
+                             if lookupset)
+    return isnull_q(leaves, isnull=False, operator=or_)
 
 
 def generate_basemodel_q_filters(lookups):
-    return _generate_q_filters(lookups, isnull=True, operator=and_)
+    """
+    Given the combinations for each lookup, match rows which have none of
+    them, which only needs the first level of children checking.
+    """
+    first_levels = minimal_lookups(lookupset[0] for lookupset in lookups
+                                   if lookupset)
+    return isnull_q(first_levels, isnull=True, operator=and_)
+
 
 def lookups_to_text(lookups):
     """
@@ -93,11 +138,169 @@ def relation_string_for_model(root_model, target_model):
     Given the classes A, B(A), C(B), and D(C) passing in the root_model A and the
     target_model C, 'b__c__d'
     """
-    lookups = discovery_lookup_from_model(root_model=root_model, target_model=target_model)
+    graph = get_inheritance_graph(root_model=root_model)
+    lookups = graph.lookup_for_model(target_model=target_model)
     lookups_as_strings = lookups_to_text([lookups])
     return lookups_as_strings[0]
 
 
+def model_for_name(root_model, model_name):
+    """
+    Find the root_model or one of its descendants given its class name
+    (case-insensitively) or its 'app_label.ModelName' label.
+    """
+    if '.' in model_name:
+        model = apps.get_model(model_name)
+        # make sure it's actually a subclass.
+        discovery_lookup_from_model(root_model=root_model, target_model=model)
+        return model
+    graph = get_inheritance_graph(root_model=root_model)
+    for model in graph.models:
+        if model._meta.model_name == model_name.lower():
+            return model
+    raise InvalidModel("%(name)r is not %(root)r or a subclass of it" % {
+        'name': model_name,
+        'root': root_model,
+    })
+
+
+def qualified_lookup(root_model, name):
+    """
+    Given a name qualified by the model it belongs to, like 'JeffGrandSon.v2'
+    or 'test_app.JeffGrandSon.fk4__pk', return the lookup to it from the
+    root_model, like 'jeffson__jeffgrandson__v2', going only as far down as
+    the model which actually has the field, so 'JeffGrandSon.v' is just 'v'.
+    Anything else is returned untouched.
+    """
+    if not isinstance(name, string_types) or '.' not in name:
+        return name
+    model_name, _, lookup = name.rpartition('.')
+    model = model_for_name(root_model=root_model, model_name=model_name)
+    field_name = lookup.split(LOOKUP_SEP, 1)[0]
+    if field_name == 'pk':
+        owner = model
+    else:
+        owner = model._meta.get_field(field_name).model._meta.concrete_model
+    relation = relation_string_for_model(root_model=root_model,
+                                         target_model=owner)
+    return LOOKUP_SEP.join(x for x in (relation, lookup) if x)
+
+
+def qualified_q(root_model, q, model=None):
+    """
+    As qualified_lookup(), for every lookup in the Q object and those within
+    it. Given a model, the lookups are all taken to be qualified by it, so
+    model JeffGrandSon and v2=2 means 'JeffGrandSon.v2'.
+    Returns the Q object itself if nothing needed changing.
+    """
+    children = []
+    for child in q.children:
+        if isinstance(child, Q):
+            child = qualified_q(root_model=root_model, q=child, model=model)
+        else:
+            name, value = child
+            if model is not None:
+                name = '%s.%s' % (model._meta.label, name)
+            child = (qualified_lookup(root_model=root_model, name=name), value)
+        children.append(child)
+    if children == q.children:
+        return q
+    return q._new_instance(children=children, connector=q.connector,
+                           negated=q.negated)
+
+
+def qualified_ordering(root_model, name):
+    """
+    As qualified_lookup(), for an order_by() name, which may start with '-'.
+    Django takes anything else with a '.' in it as 'table.column' (from
+    extra()), so names which aren't qualified by a model are left as they are.
+    """
+    if not isinstance(name, string_types) or '.' not in name:
+        return name
+    prefix = '-' if name.startswith('-') else ''
+    try:
+        return prefix + qualified_lookup(root_model=root_model,
+                                         name=name[len(prefix):])
+    except (InvalidModel, LookupError):
+        return name
+
+
+def get_concrete_descendants(root_model):
+    """
+    Given the classes A, B(A), C(B), D(A) and a proxy P(B), passing in A
+    yields B, C, D - walking depth first, skipping proxy & abstract classes.
+    """
+    for subclass in root_model.__subclasses__():
+        opts = getattr(subclass, '_meta', None)
+        if opts is not None and not opts.proxy and not opts.abstract:
+            yield subclass
+        for subsubclass in get_concrete_descendants(subclass):
+            yield subsubclass
+
+
+class InheritanceGraph(object):
+    """
+    The multi-table inheritance tree below a root model, worked out once:
+    the lookup path from the root to every concrete descendant, and the
+    descendants themselves in depth first order.
+    models is the root followed by the descendants, and a model's position
+    in it is the type index which annotate_type_index() gives its rows.
+    """
+    __slots__ = ('root_model', 'lookups', 'descendants', 'models',
+                 'type_indexes')
+
+    def __init__(self, root_model):
+        self.root_model = root_model
+        self.descendants = tuple(get_concrete_descendants(root_model))
+        self.models = (root_model,) + self.descendants
+        self.type_indexes = dict((model, index)
+                                 for index, model in enumerate(self.models))
+        lookups = {root_model: ()}
+        for model in self.descendants:
+            lookups[model] = discovery_lookup_from_model(root_model=root_model,
+                                                         target_model=model)
+        self.lookups = lookups
+
+    def lookup_for_model(self, target_model):
+        try:
+            return self.lookups[target_model]
+        except KeyError:
+            # proxies, or things which aren't subclasses at all, which will
+            # raise InvalidModel.
+            return discovery_lookup_from_model(root_model=self.root_model,
+                                               target_model=target_model)
+
+
+_inheritance_graphs = {}
+
+
+def get_inheritance_graph(root_model):
+    """
+    Returns the InheritanceGraph for the given root_model, which is built
+    once and then kept until another model class is prepared.
+    Before the app registry is ready, the graph may be incomplete, so it is
+    built fresh each time and not kept.
+    """
+    try:
+        return _inheritance_graphs[root_model]
+    except KeyError:
+        graph = InheritanceGraph(root_model=root_model)
+        if apps.ready:
+            _inheritance_graphs[root_model] = graph
+        return graph
+
+
+def clear_inheritance_graphs(**kwargs):
+    _inheritance_graphs.clear()
+    # plans are built from the graphs, so are equally stale.
+    query_plans.clear()
+    split_plans.clear()
+
+
+class_prepared.connect(clear_inheritance_graphs,
+                       dispatch_uid='inheritrix_clear_inheritance_graphs')
+
+
 def calculate_paths(lookups):
     # expects tuples like: ('a', 'b', 'c')
 
@@ -113,25 +316,452 @@ def calculate_paths(lookups):
     return returndata
 
 
-def get_startswiths(relations, prefetches):
+QueryPlan = namedtuple('QueryPlan', 'joins select_related attrgetters q_filter')
+PlanCacheInfo = namedtuple('PlanCacheInfo', 'hits misses maxsize currsize')
+
+
+def build_query_plan(root_model, subclasses):
+    """
+    Work out everything models() needs to apply to a queryset for the given
+    root_model and set of subclasses (which includes the root_model itself
+    if include_self was given):
+    - the joins, longest first,
+    - the select_related() strings,
+    - an attrgetter for each join, to dig the children out of the root,
+    - the Q object to filter out rows which aren't any of the subclasses,
+      or None if no filtering is needed.
+    """
+    graph = get_inheritance_graph(root_model=root_model)
+    # generate tuples like: ('a', 'b', 'c')
+    lookups = tuple(set(graph.lookup_for_model(target_model=model)
+                        for model in subclasses))
+    # the decision maker
+    our_joins, joins_as_strings, all_combinations = calculate_paths(
+        lookups=lookups)
+    # To avoid returning instances without children, we need to do a filter,
+    # ensuring the children are isnull=False
+    q_filter = None
+    if any(len(combo) > 0 for combo in all_combinations):
+        leaves = minimal_lookups(combo[-1] for combo in all_combinations
+                                 if combo)
+        if root_model not in subclasses:
+            q_filter = generate_q_filters(lookups=all_combinations)
+        elif any(len(leaf) > 1 for leaf in leaves):
+            q_filter = (generate_q_filters(lookups=all_combinations) |
+                        generate_basemodel_q_filters(lookups=all_combinations))
+        # otherwise every row either has one of the children, or none of
+        # them and is the root_model, so there's nothing to filter out.
+    return plan_for_joins(joins=our_joins, q_filter=q_filter)
+
+
+def plan_for_joins(joins, q_filter):
+    joins = sorted(joins, key=len, reverse=True)
+    relations_for_attrgetter = (x.replace(LOOKUP_SEP, '.')
+                                for x in lookups_to_text(joins))
+    attrgetters = tuple(attrgetter(x) for x in relations_for_attrgetter)
+    return QueryPlan(joins=tuple(joins), select_related=lookups_to_text(joins),
+                     attrgetters=attrgetters, q_filter=q_filter)
+
+
+def build_split_plans(root_model, subclasses):
+    """
+    Instead of one query which LEFT JOINs every table on the way to every one
+    of the subclasses, work out one QueryPlan per selected model, whose
+    q_filter only matches the rows which would've been returned as that
+    model (or an unselected child between it and the next selected ones)
+    and whose joins only go down that model's own chain.
+    The root_model, if selected, gets a plan matching the rows which have
+    none of the selected children, and which needs no joins.
+    """
+    graph = get_inheritance_graph(root_model=root_model)
+    selected = set(graph.lookup_for_model(target_model=model)
+                   for model in subclasses)
+    selected.discard(())
+    all_joins = set(chain.from_iterable(generate_relation_combinations(lookup)
+                                        for lookup in selected))
+    plans = []
+    if root_model in subclasses and selected:
+        first_levels = sorted(set(lookup[0:1] for lookup in selected))
+        q_filter = isnull_q(first_levels, isnull=True, operator=and_)
+        plans.append(plan_for_joins(joins=(), q_filter=q_filter))
+    for lookup in sorted(selected):
+        depth = len(lookup)
+        below = tuple(other for other in selected
+                      if len(other) > depth and other[0:depth] == lookup)
+        # only the nearest selected children need excluding, as anything
+        # under them can only exist if they do.
+        nearest = tuple(other for other in below
+                        if not any(len(other) > len(x) and other[0:len(x)] == x
+                                   for x in below))
+        q_filter = Q(**{'%s__isnull' % LOOKUP_SEP.join(lookup): False})
+        for other in nearest:
+            q_filter &= Q(**{'%s__isnull' % LOOKUP_SEP.join(other): True})
+        joins = tuple(join for join in all_joins
+                      if (join == lookup[0:len(join)] or
+                          join[0:depth] == lookup) and
+                      not any(join[0:len(other)] == other
+                              for other in nearest))
+        plans.append(plan_for_joins(joins=joins, q_filter=q_filter))
+    return tuple(plans)
+
+
+class PlanCache(object):
+    """
+    A bounded, least-recently-used mapping of
+    (root_model, frozenset(subclasses)) to the QueryPlan the builder
+    returns for it.
+    Whether or not the root_model was asked for is part of the subclasses,
+    so include_self doesn't need to be part of the key.
+    """
+    def __init__(self, builder=build_query_plan, maxsize=128):
+        self.builder = builder
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._plans = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, root_model, subclasses):
+        key = (root_model, frozenset(subclasses))
+        with self._lock:
+            try:
+                plan = self._plans.pop(key)
+            except KeyError:
+                self.misses += 1
+            else:
+                self.hits += 1
+                # re-inserting marks it as the most recently used.
+                self._plans[key] = plan
+                return plan
+        plan = self.builder(root_model=root_model, subclasses=key[1])
+        with self._lock:
+            self._plans[key] = plan
+            while len(self._plans) > self.maxsize:
+                self._plans.popitem(last=False)
+        return plan
+
+    def info(self):
+        return PlanCacheInfo(hits=self.hits, misses=self.misses,
+                             maxsize=self.maxsize, currsize=len(self._plans))
+
+    def clear(self):
+        with self._lock:
+            self._plans.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+query_plans = PlanCache(builder=build_query_plan)
+split_plans = PlanCache(builder=build_split_plans)
+
+
+@add_metaclass(ABCMeta)
+class TypeCache(object):
+    """
+    Remembers the concrete model of primary keys of a root model, so that
+    get() and in_bulk() can go straight to the right tables.
+    Subclasses decide where {(database alias, root model, pk): model} lives.
+    Once connected to a root model, the type of a primary key is recorded
+    when any model in the hierarchy is created with it, and forgotten when
+    one is saved or deleted with it, via post_save and post_delete.
+    Anything which doesn't send those signals (eg: raw SQL) isn't noticed.
+    """
+    def __init__(self):
+        self._connected = set()
+        self._lock = Lock()
+
+    def __getstate__(self):
+        # a copy made by unpickling connects its own receivers when a
+        # queryset using it is unpickled.
+        state = self.__dict__.copy()
+        del state['_lock']
+        state['_connected'] = set()
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = Lock()
+
+    @abstractmethod
+    def get_many(self, keys):
+        """
+        Returns {key: model} for those of the keys whose type is known.
+        """
+
+    @abstractmethod
+    def set_many(self, models_by_key):
+        """
+        Remember {key: model}.
+        """
+
+    @abstractmethod
+    def delete_many(self, keys):
+        """
+        Forget the keys, whether or not they're known.
+        """
+
+    def disconnect(self, root_model):
+        with self._lock:
+            for model in get_inheritance_graph(root_model=root_model).models:
+                uid = ('inheritrix_type_cache', self, root_model, model)
+                post_save.disconnect(sender=model, dispatch_uid=uid)
+                post_delete.disconnect(sender=model, dispatch_uid=uid)
+            self._connected.discard(root_model)
+
+    def connect(self, root_model):
+        if root_model in self._connected:
+            return
+        with self._lock:
+            for model in get_inheritance_graph(root_model=root_model).models:
+                uid = ('inheritrix_type_cache', self, root_model, model)
+                post_save.connect(partial(self.saved, root_model),
+                                  sender=model, weak=False, dispatch_uid=uid)
+                post_delete.connect(partial(self.deleted, root_model),
+                                    sender=model, weak=False, dispatch_uid=uid)
+            # until then, there may be subclasses still to come.
+            if apps.ready:
+                self._connected.add(root_model)
+
+    def saved(self, root_model, sender, instance, created=False, raw=False,
+              using=None, **kwargs):
+        key = (using, root_model, instance.pk)
+        if created and not raw:
+            self.set_many({key: sender._meta.concrete_model})
+        else:
+            self.delete_many([key])
+
+    def deleted(self, root_model, sender, instance, using=None, **kwargs):
+        self.delete_many([(using, root_model, instance.pk)])
+
+
+def type_cache_receivers(signal, sender):
+    """
+    Returns {(TypeCache, root model), ...} connected to the signal for the
+    sender by TypeCache.connect(), or None if it has any other receivers.
+    """
+    connected = set()
+    for receiver in signal._live_receivers(sender):
+        func = getattr(receiver, 'func', None)
+        if not (isinstance(getattr(func, '__self__', None), TypeCache) and
+                func.__name__ == 'deleted'):
+            return None
+        connected.add((func.__self__,) + tuple(receiver.args))
+    return connected
+
+
+class LocalTypeCache(TypeCache):
+    """
+    A bounded, least-recently-used TypeCache in the memory of this process.
+    """
+    def __init__(self, maxsize=10000):
+        super(LocalTypeCache, self).__init__()
+        self.maxsize = maxsize
+        self._models = OrderedDict()
+
+    def get_many(self, keys):
+        found = {}
+        with self._lock:
+            for key in keys:
+                try:
+                    # re-inserting marks it as the most recently used.
+                    found[key] = self._models[key] = self._models.pop(key)
+                except KeyError:
+                    pass
+        return found
+
+    def set_many(self, models_by_key):
+        with self._lock:
+            for key, model in models_by_key.items():
+                self._models.pop(key, None)
+                self._models[key] = model
+            while len(self._models) > self.maxsize:
+                self._models.popitem(last=False)
+
+    def delete_many(self, keys):
+        with self._lock:
+            for key in keys:
+                self._models.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._models.clear()
+
+    def __getstate__(self):
+        # nothing would have kept a copy's types up to date.
+        state = super(LocalTypeCache, self).__getstate__()
+        state['_models'] = OrderedDict()
+        return state
+
+
+class DjangoTypeCache(TypeCache):
+    """
+    A TypeCache kept in one of the CACHES, so it can be shared between
+    processes, storing each model's label.
+    """
+    def __init__(self, alias='default', timeout=DEFAULT_TIMEOUT,
+                 key_prefix='inheritrix'):
+        super(DjangoTypeCache, self).__init__()
+        self.alias = alias
+        self.timeout = timeout
+        self.key_prefix = key_prefix
+
+    def __getstate__(self):
+        state = super(DjangoTypeCache, self).__getstate__()
+        if self.timeout is DEFAULT_TIMEOUT:
+            # the sentinel wouldn't be itself once unpickled.
+            del state['timeout']
+        return state
+
+    def __setstate__(self, state):
+        state.setdefault('timeout', DEFAULT_TIMEOUT)
+        super(DjangoTypeCache, self).__setstate__(state)
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def make_key(self, key):
+        using, root_model, pk = key
+        return ':'.join((self.key_prefix, using, root_model._meta.label_lower,
+                         force_text(pk)))
+
+    def get_many(self, keys):
+        keys_by_cache_key = dict((self.make_key(key), key) for key in keys)
+        labels = self.cache.get_many(list(keys_by_cache_key))
+        return dict((keys_by_cache_key[cache_key], apps.get_model(label))
+                    for cache_key, label in labels.items())
+
+    def set_many(self, models_by_key):
+        self.cache.set_many(dict((self.make_key(key), model._meta.label_lower)
+                                 for key, model in models_by_key.items()),
+                            timeout=self.timeout)
+
+    def delete_many(self, keys):
+        self.cache.delete_many([self.make_key(key) for key in keys])
+
+
+def strip_relation(lookup, relations):
     """
     given relations [u'ab__bb__cc', u'ab__bb', u'ab']
-    and prefetches [u'ab__bb__cc__fk5', u'ab__bb__cc__fk8', u'ab__bb__cc__fk3', u'ab__bb__cc__fk']
-    take the prefetches that start with any of the relations BUT substitute
-    the prefix entirely.
-    """
-    prefetches = sorted(prefetches)
-    potentials = set()
-    data = product(relations, prefetches)
-    for relation, prefetch in data:
+    and a lookup u'ab__bb__cc__fk5'
+    return the longest relation the lookup goes through, and the rest of
+    the lookup after it, eg: (u'ab__bb__cc', u'fk5')
+    or (None, lookup) if it doesn't go through any of them.
+    """
+    for relation in sorted(relations, key=len, reverse=True):
         fullrel = '%s%s' % (relation, LOOKUP_SEP)
-        if prefetch.startswith(relation):
-            rel_length = len(fullrel)
-            sliced_prefetch = prefetch[rel_length:]
-            if sliced_prefetch not in potentials:
-                potentials.add(sliced_prefetch)
-    result = sorted(potentials)
-    return result
+        if lookup.startswith(fullrel):
+            return relation, lookup[len(fullrel):]
+    return None, lookup
+
+
+def rewrite_lookup(lookup, joins, relations):
+    """
+    Given a prefetch_related() lookup (a string or Prefetch) made against
+    the root model, all of the joins a queryset makes as strings, and the
+    subset of those joins which lead to a particular subclass, return the
+    lookup as it would apply to instances of that subclass.
+    eg: with joins ['ab', 'ab__bb', 'ac'] and relations ['ab', 'ab__bb']
+    u'ab__bb__fk' becomes u'fk', u'ab__fk2' becomes u'fk2', u'fk3' is left
+    as-is, and u'ac__fk4' is None because it doesn't apply.
+    """
+    through = getattr(lookup, 'prefetch_through', lookup)
+    relation, rest = strip_relation(through, joins)
+    if relation is None:
+        return lookup
+    if relation not in relations:
+        return None
+    if isinstance(lookup, Prefetch):
+        return Prefetch(rest, queryset=lookup.queryset, to_attr=lookup.to_attr)
+    return rest
+
+
+def models_for_joins(root_model, joins):
+    """
+    Given joins like (('a', 'b'), ('a',)) return the model each one leads to.
+    """
+    graph = get_inheritance_graph(root_model=root_model)
+    models_by_join = dict((lookup, model)
+                          for model, lookup in graph.lookups.items())
+    return tuple(models_by_join[tuple(join)] for join in joins)
+
+
+def model_label(model):
+    return model._meta.label
+
+
+def type_case(root_model, joins, label=model_label, output_field=None):
+    """
+    An expression giving the label of the deepest of the joins (which are
+    longest first) each row has, or the root_model's if it has none of them,
+    exactly as InheritingModelIterable would decide which class to yield.
+    """
+    if output_field is None:
+        output_field = CharField()
+    default = Value(label(root_model), output_field=output_field)
+    if not joins:
+        return default
+    whens = (When(Q(**{'%s__isnull' % LOOKUP_SEP.join(join): False}),
+                  then=Value(label(model), output_field=output_field))
+             for join, model in zip(joins, models_for_joins(root_model, joins)))
+    return Case(*whens, default=default, output_field=output_field)
+
+
+TypeColumn = namedtuple('TypeColumn',
+                        'field values_by_model models_by_value untyped_rows')
+
+
+def type_value_for_model(field, model, type_values=None):
+    """
+    The value a type field should hold for rows of the given model: the
+    one given in type_values if there are any, the ContentType's primary
+    key if the field is a ForeignKey to it, or else the model's label.
+    """
+    model = model._meta.concrete_model
+    if type_values is not None:
+        return type_values[model]
+    if field.is_relation:
+        # a ContentType, or something with the same manager API.
+        related_model = field.related_model
+        return related_model._default_manager.get_for_model(model).pk
+    return model._meta.label_lower
+
+
+def get_type_column(root_model, field_name, type_values=None,
+                    untyped_rows=False):
+    """
+    Look up the field holding each row's concrete class on the root_model,
+    along with the value for every model below it and the other way round.
+    untyped_rows is whether there may be rows whose field is still NULL.
+    """
+    field = root_model._meta.get_field(field_name)
+    graph = get_inheritance_graph(root_model=root_model)
+    values_by_model = OrderedDict(
+        (model, type_value_for_model(field, model, type_values=type_values))
+        for model in graph.models)
+    models_by_value = dict((value, model)
+                           for model, value in values_by_model.items())
+    return TypeColumn(field=field, values_by_model=values_by_model,
+                      models_by_value=models_by_value,
+                      untyped_rows=untyped_rows)
+
+
+def matching_models(root_model, subclasses):
+    """
+    Every concrete model whose rows the filter from build_query_plan()
+    would let through: the selected models and their subclasses, and if
+    the root_model is selected, anything without one of the selected
+    models' first level of children.
+    """
+    graph = get_inheritance_graph(root_model=root_model)
+    selected = tuple(set(model._meta.concrete_model for model in subclasses
+                         if model is not root_model))
+    first_levels = models_for_joins(root_model=root_model, joins=set(
+        graph.lookup_for_model(target_model=model)[0:1] for model in selected))
+    return tuple(model for model in graph.models
+                 if any(issubclass(model, other) for other in selected) or
+                 (root_model in subclasses and
+                  not any(issubclass(model, other) for other in first_levels)))
 
 
 def dig_for_obj(obj, attrgetters):
@@ -143,59 +773,1202 @@ def dig_for_obj(obj, attrgetters):
     return obj
 
 
+def is_parent_link(field):
+    """
+    Whether the field is the OneToOneField a child model uses to point at
+    its multi-table parent.
+    """
+    # >= 1.9
+    rel = getattr(field, 'remote_field', None)
+    if rel is None:
+        rel = getattr(field, 'rel', None)
+    return rel is not None and getattr(rel, 'parent_link', False)
+
+
+def parent_count(model):
+    """
+    How many multi-table parents the model has, so that sorting by it puts
+    parents before their children.
+    """
+    return len(model._meta.get_parent_list())
+
+
+def is_cached(field, instance):
+    # >= 2.0
+    is_cached_ = getattr(field, 'is_cached', None)
+    if is_cached_ is not None:
+        return is_cached_(instance)
+    return hasattr(instance, field.get_cache_name())
+
+
+def copy_cached_value(field, source, target):
+    """
+    Copy whatever select_related() cached for the field (or reverse
+    relation) on the source instance over to the target instance, unless
+    the target already has one.
+    """
+    if not is_cached(field, source) or is_cached(field, target):
+        return
+    # >= 2.0
+    if hasattr(field, 'get_cached_value'):
+        field.set_cached_value(target, field.get_cached_value(source))
+    else:
+        cache_name = field.get_cache_name()
+        setattr(target, cache_name, getattr(source, cache_name))
+
+
+def cache_holder(klass_info):
+    """
+    The field (or for reverse relations, the relation) whose cache
+    select_related() fills for the klass_info.
+    """
+    field = klass_info['field']
+    if klass_info['reverse']:
+        # >= 1.9
+        rel = getattr(field, 'remote_field', None)
+        if rel is None:
+            rel = field.rel
+        return rel
+    return field
+
+
+def is_child_klass_info(klass_info):
+    return klass_info['reverse'] and is_parent_link(klass_info['field'])
+
+
+def iter_child_klass_infos(klass_info, path=()):
+    """
+    Given the klass_info structure a compiler builds for select_related(),
+    yield (path, klass_info) pairs for every child model reached by
+    descending through parent links, where path is something like
+    ('a', 'b', 'c') to match the joins from calculate_paths()
+    """
+    for related_klass_info in klass_info.get('related_klass_infos', ()):
+        if is_child_klass_info(related_klass_info):
+            field = related_klass_info['field']
+            related_path = path + (field.related_query_name(),)
+            yield related_path, related_klass_info
+            for subpath in iter_child_klass_infos(related_klass_info,
+                                                  path=related_path):
+                yield subpath
+
+
+def field_column(klass_info, select, attname):
+    """
+    Find the index in a compiler's select of the given field for the model
+    the klass_info refers to.
+    """
+    for index in klass_info['select_fields']:
+        if select[index][0].target.attname == attname:
+            return index
+    return None
+
+
+def pk_column(klass_info, select):
+    return field_column(klass_info, select,
+                        klass_info['model']._meta.pk.attname)
+
+
+def calculate_type_columns(klass_info, select, joins, attrgetters):
+    """
+    For each of the joins (longest first) find the column in the select
+    holding that child's primary key, which will be non-null if the row
+    has that child.
+    Returns ((column, attrgetter), ...) or None if any of the joins isn't
+    being selected, in which case the columns can't tell what each row is.
+    """
+    columns = {path: pk_column(child_klass_info, select)
+               for path, child_klass_info in iter_child_klass_infos(klass_info)}
+    type_columns = []
+    for join, attrgetter_ in zip(joins, attrgetters):
+        column = columns.get(tuple(join))
+        if column is None:
+            return None
+        type_columns.append((column, attrgetter_))
+    return tuple(type_columns)
+
+
+def resolve_from_row(row, type_columns):
+    """
+    Given the type_columns from calculate_type_columns, find the deepest
+    child which exists in the row, without having to touch any model
+    instances.
+    """
+    for column, attrgetter_ in type_columns:
+        if row[column] is not None:
+            return attrgetter_
+    return None
+
+
+def yielded_models(root_model, joins):
+    """
+    For each of get_inheritance_graph(root_model).models, the class its rows
+    come back as given the joins (longest first): the deepest of them the
+    row has, including those only joined on the way to a selected model,
+    or else the root_model.
+    """
+    graph = get_inheritance_graph(root_model=root_model)
+    join_models = models_for_joins(root_model=root_model, joins=joins)
+    return tuple(next((join_model for join_model in join_models
+                       if issubclass(model, join_model)), root_model)
+                 for model in graph.models)
+
+
+def child_pk_lookups(joins):
+    """
+    The lookups for the primary key of each of the joins' children.
+    """
+    return tuple(LOOKUP_SEP.join(tuple(join) + ('pk',)) for join in joins)
+
+
+def model_from_children(root_model, join_models, child_pks):
+    """
+    Given the models for the joins (longest first) and a row's primary key
+    for each of them, the deepest model the row has, or else the root_model.
+    """
+    for join_model, child_pk in zip(join_models, child_pks):
+        if child_pk is not None:
+            return join_model
+    return root_model
+
+
+def type_index_resolver(root_model, column, joins, attrgetters):
+    """
+    Given the column holding the annotate_type_index() of each row, return
+    a callable which picks the attrgetter for the deepest of the joins
+    each row has, or None for the root, without checking any other columns.
+    """
+    join_models = models_for_joins(root_model=root_model, joins=joins)
+    getters_by_model = dict(zip(join_models, attrgetters))
+    getters = tuple(getters_by_model.get(model)
+                    for model in yielded_models(root_model=root_model,
+                                                joins=joins))
+
+    def resolve(row):
+        return getters[row[column]]
+    return resolve
+
+
+def type_value_resolver(root_model, column, type_column, joins, attrgetters,
+                        fallback):
+    """
+    As type_index_resolver() but for the value of a type field, falling
+    back to the given resolver for any rows whose value isn't known, eg:
+    those saved before maintain_type_field() was connected.
+    """
+    join_models = models_for_joins(root_model=root_model, joins=joins)
+    getters_by_model = dict(zip(join_models, attrgetters))
+    yielded = yielded_models(root_model=root_model, joins=joins)
+    getters = dict((value, getters_by_model.get(model))
+                   for value, model in zip(type_column.values_by_model.values(),
+                                           yielded))
+    unknown = object()
+
+    def resolve(row):
+        attrgetter_ = getters.get(row[column], unknown)
+        if attrgetter_ is unknown:
+            return fallback(row)
+        return attrgetter_
+    return resolve
+
+
+def iterable_options(iterable):
+    options = {}
+    # >= 1.11 and >= 2.0 respectively
+    for option in ('chunked_fetch', 'chunk_size'):
+        if hasattr(iterable, option):
+            options[option] = getattr(iterable, option)
+    return options
+
+
+def execute_for_iterable(iterable, compiler):
+    return compiler.execute_sql(**iterable_options(iterable))
+
+
+def filter_pk_in(queryset, pks):
+    """
+    Yield the results of filtering the queryset to the given primary keys,
+    a batch at a time so as to stay within the database's parameter limit.
+    """
+    ops = connections[queryset.db].ops
+    batch_size = ops.bulk_batch_size(['pk'], pks) or len(pks)
+    for start in range(0, len(pks), batch_size):
+        for result in queryset.filter(pk__in=pks[start:start + batch_size]):
+            yield result
+
+
+JOIN = 'join'
+SPLIT = 'split'
+TWO_PHASE = 'two_phase'
+LAZY = 'lazy'
+STRATEGIES = (JOIN, SPLIT, TWO_PHASE, LAZY)
+TYPE_ALIAS = 'model'
+TYPE_INDEX_ALIAS = 'type_index'
+COUNT_TYPE_INDEX_ALIAS = 'inheritrix_type_index'
+
+
+def prune_select_related(select_related, joins):
+    """
+    Given a select_related() structure like {'a': {'b': {}, 'fk': {}}}
+    and joins like [('a',), ('a', 'b')], remove the joins, leaving anything
+    else that was asked for, eg: {'a': {'fk': {}}}
+    """
+    if not isinstance(select_related, dict):
+        return select_related
+    joins = set(tuple(join) for join in joins)
+
+    def prune(tree, path):
+        pruned = {}
+        for name, subtree in tree.items():
+            subpath = path + (name,)
+            subtree = prune(subtree, subpath)
+            if subtree or subpath not in joins:
+                pruned[name] = subtree
+        return pruned
+    return prune(select_related, ()) or False
+
+
+def flatten_select_related(select_related, path=()):
+    """
+    Given a select_related() structure like {'a': {'b': {}}, 'fk': {}}
+    yield the lookups which would've built it, eg: 'a__b', 'fk'
+    """
+    for name, subtree in select_related.items():
+        subpath = path + (name,)
+        if subtree:
+            for lookup in flatten_select_related(subtree, path=subpath):
+                yield lookup
+        else:
+            yield LOOKUP_SEP.join(subpath)
+
+
+def two_phase_supported(queryset):
+    """
+    Whether the queryset can be fetched as (pk, type) first and then each
+    model separately, which means nothing may be selected beyond the
+    models' own fields.
+    """
+    query = queryset.query
+    return (queryset._our_plan is not None and
+            not query.annotation_select and not query.extra_select and
+            not query.deferred_loading[0] and query.group_by is None and
+            not getattr(query, 'combinator', None))
+
+
+# ordering on these is left to the database, see ordering_key_getter()
+TEXT_FIELDS = (CharField, TextField)
+
+
+class OrderingKey(object):
+    """
+    Sorts like the database would for the values of an instance's
+    order_by() fields, so results from several queries can be merged.
+    """
+    __slots__ = ('values', 'descending', 'nulls_largest')
+
+    def __init__(self, values, descending, nulls_largest):
+        self.values = values
+        self.descending = descending
+        self.nulls_largest = nulls_largest
+
+    def compare(self, other):
+        for value, other_value, descending in zip(self.values, other.values,
+                                                  self.descending):
+            if value == other_value:
+                continue
+            if value is None:
+                result = 1 if self.nulls_largest else -1
+            elif other_value is None:
+                result = -1 if self.nulls_largest else 1
+            else:
+                result = -1 if value < other_value else 1
+            return -result if descending else result
+        return 0
+
+    def __lt__(self, other):
+        return self.compare(other) < 0
+
+    def __eq__(self, other):
+        return self.compare(other) == 0
+
+    def __ne__(self, other):
+        return self.compare(other) != 0
+
+    __hash__ = None
+
+
+def ordering_key_getter(queryset):
+    """
+    Returns a callable which gives the OrderingKey for an instance from the
+    queryset, None if the queryset isn't ordered, or False if the ordering
+    is anything more than fields on the model itself or annotations,
+    which can't be reproduced in Python. That includes anything holding
+    text, as the database's collation needn't sort it as Python does.
+    """
+    query = queryset.query
+    if query.extra_order_by:
+        return False
+    ordering = query.order_by
+    if not ordering and query.default_ordering:
+        ordering = queryset.model._meta.ordering
+    if not ordering:
+        return None
+    opts = queryset.model._meta
+    attnames = []
+    descending = []
+    for item in ordering:
+        if not isinstance(item, string_types) or item == '?':
+            return False
+        name = item.lstrip('-')
+        if name == 'pk':
+            attname = opts.pk.attname
+        elif name in query.annotation_select:
+            try:
+                field = query.annotation_select[name].output_field
+            except FieldError:
+                return False
+            if isinstance(field, TEXT_FIELDS):
+                return False
+            attname = name
+        else:
+            try:
+                field = opts.get_field(name)
+            except FieldDoesNotExist:
+                return False
+            if (field.is_relation or not getattr(field, 'concrete', False) or
+                    isinstance(field, TEXT_FIELDS)):
+                return False
+            attname = field.attname
+        attnames.append(attname)
+        descending.append(item.startswith('-'))
+    get_values = attrgetter(*attnames)
+    if len(attnames) == 1:
+        get_value = get_values
+
+        def get_values(obj):
+            return (get_value(obj),)
+    descending = tuple(descending)
+    nulls_largest = connections[queryset.db].features.nulls_order_largest
+
+    def ordering_key(obj):
+        return OrderingKey(values=get_values(obj), descending=descending,
+                           nulls_largest=nulls_largest)
+    return ordering_key
+
+
+def split_querysets(queryset):
+    """
+    Turn a queryset from models() into one queryset per plan from
+    build_split_plans(), each with the original filtering from models()
+    taken back out and the plan's own applied instead.
+    Returns None if the queryset can't be split up.
+    """
+    query = queryset.query
+    where = query.where
+    # each models() call filters on its own, so together they may select
+    # less than the plan for all of their subclasses.
+    if (queryset._our_plan is None or len(queryset._our_filters) > 1 or
+            query.distinct or query.group_by is not None or
+            getattr(query, 'combinator', None) or
+            where.connector != AND or where.negated):
+        return None
+    plans = split_plans.get(root_model=queryset.model,
+                            subclasses=queryset._subclasses)
+    if len(plans) < 2:
+        return None
+    base_query = query.clone()
+    for before, after, alias_refs in reversed(queryset._our_filters):
+        del base_query.where.children[before:after]
+        for alias, count in alias_refs.items():
+            base_query.alias_refcount[alias] -= count
+    base_query.select_related = prune_select_related(base_query.select_related,
+                                                     queryset._our_joins)
+    high_mark = query.high_mark
+    base_query.clear_limits()
+    if high_mark is not None:
+        base_query.set_limits(high=high_mark)
+    parts = []
+    for plan in plans:
+        part = queryset._clone()
+        part.query = base_query.clone()
+        if plan.select_related:
+            part.query.add_select_related(plan.select_related)
+        part.query.add_q(deepcopy(plan.q_filter))
+        part._our_state = part._our_state._replace(plan=plan, strategy=JOIN)
+        parts.append(part)
+    return parts
+
+
+def columns_getter(positions):
+    """
+    Return a callable which picks the given positions out of a row, in order.
+    """
+    if len(positions) == 1:
+        position = positions[0]
+        return lambda row: (row[position],)
+    return itemgetter(*positions)
+
+
+SAVED_VALUES_ATTR = '_inheritrix_saved_values'
+
+
+def tracked_fields(model):
+    """
+    The fields whose changes track_changes() looks for: every concrete
+    field but the primary key and the links to the parents.
+    """
+    return [field for field in model._meta.concrete_fields
+            if not field.primary_key and not is_parent_link(field)]
+
+
+def track_changes(instance):
+    """
+    Remember the instance's primary key and field values as they are now, so
+    that its save() only writes the fields which have changed since (see
+    changed_fields()), and so only UPDATEs the tables they belong to.
+    Only the snapshot is kept on the instance, so copies of it have their
+    own changes saved, not the original's.
+    Only instances of models with install_instance_hooks() save this way,
+    others save every field as usual.
+    """
+    values = dict((field.attname, instance.__dict__[field.attname])
+                  for field in tracked_fields(instance.__class__)
+                  if field.attname in instance.__dict__)
+    instance.__dict__[SAVED_VALUES_ATTR] = (instance.pk, values)
+    return instance
+
+
+def changed_fields(instance):
+    """
+    The names of the fields on an instance given to track_changes() whose
+    values have changed since. Fields which weren't loaded then (eg: they
+    were deferred) count as changed if they're loaded now, as it can't be
+    known whether they were assigned to. Values are compared with ==, so
+    changing a mutable value in place isn't noticed.
+    Returns None for instances not being tracked.
+    """
+    try:
+        _, saved = instance.__dict__[SAVED_VALUES_ATTR]
+    except KeyError:
+        return None
+    current = instance.__dict__
+    missing = object()
+    return [field.name for field in tracked_fields(instance.__class__)
+            if field.attname in current and
+            saved.get(field.attname, missing) != current[field.attname]]
+
+
+def fields_to_save(instance):
+    """
+    The changed_fields() of a tracked instance, and those whose pre_save()
+    gives another value than the one loaded (eg: auto_now), which a save()
+    of every field would have written too.
+    """
+    _, saved = instance.__dict__[SAVED_VALUES_ATTR]
+    changed = set(changed_fields(instance))
+    missing = object()
+    return [field.name for field in tracked_fields(instance.__class__)
+            if field.name in changed or
+            (field.attname in instance.__dict__ and
+             field.pre_save(instance, False) != saved.get(field.attname,
+                                                          missing))]
+
+
+def install_save_changed(model):
+    """
+    Wrap the model's save() so that, for instances given to track_changes(),
+    it works out update_fields from fields_to_save() when none are given, so
+    Django only UPDATEs the tables owning them, and nothing at all if nothing
+    changed. Saving one to another database, under another primary key, or
+    with arguments given by position, saves every field as usual. Anything
+    else a custom save() accepts is passed on.
+    """
+    if getattr(model.__dict__.get('save'), 'inheritrix_tracked', False):
+        return
+    original = model.save
+
+    def save(self, *args, **kwargs):
+        snapshot = self.__dict__.get(SAVED_VALUES_ATTR)
+        # a subclass's instances go through its own wrapper.
+        if snapshot is None or type(self) is not model:
+            return original(self, *args, **kwargs)
+        using = kwargs.get('using')
+        if (not args and kwargs.get('update_fields') is None and
+                not kwargs.get('force_insert') and not self._state.adding and
+                using in (None, self._state.db) and snapshot[0] == self.pk):
+            kwargs['update_fields'] = fields_to_save(self)
+        result = original(self, *args, **kwargs)
+        update_fields = None if args else kwargs.get('update_fields')
+        if update_fields is None:
+            track_changes(self)
+            return result
+        # anything else changed is still unsaved. The values are replaced,
+        # not updated, as copies of the instance share them.
+        saved = dict(snapshot[1])
+        for name in update_fields:
+            attname = self._meta.get_field(name).attname
+            saved[attname] = getattr(self, attname)
+        self.__dict__[SAVED_VALUES_ATTR] = (snapshot[0], saved)
+        return result
+    save.inheritrix_tracked = True
+    model.save = save
+
+
+LAZY_FIELDS_ATTR = '_inheritrix_lazy_fields'
+
+
+def install_lazy_refresh(model):
+    """
+    Wrap the model's refresh_from_db() so that, for instances from the LAZY
+    strategy, asking for a deferred field loads it (and the rest of the
+    model's deferred fields) for every instance from the same results, see
+    LazySubclassFields. Anything else goes to the original as usual.
+    """
+    if getattr(model.__dict__.get('refresh_from_db'), 'inheritrix_lazy',
+               False):
+        return
+    original = model.refresh_from_db
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        lazy_fields = self.__dict__.pop(LAZY_FIELDS_ATTR, None)
+        if lazy_fields is not None:
+            if not kwargs and lazy_fields.load_for(instance=self, using=using,
+                                                   fields=fields):
+                return
+            lazy_fields.discard(self)
+        return original(self, using=using, fields=fields, **kwargs)
+    refresh_from_db.inheritrix_lazy = True
+    model.refresh_from_db = refresh_from_db
+
+
+class LazySubclassFields(object):
+    """
+    The fields the LAZY strategy left out of the instances of one model, which
+    are loaded for every one of those instances at once, the first time any of
+    them needs one.
+    Django asks for a deferred field by calling refresh_from_db(fields=[...])
+    on the instance, which install_lazy_refresh() points here for as long as
+    the instance has this in its __dict__.
+    """
+    __slots__ = ('model', 'attnames', 'db', 'instances')
+
+    def __init__(self, model, attnames, db):
+        self.model = model
+        self.attnames = attnames
+        self.db = db
+        self.instances = defaultdict(list)
+
+    def add(self, instance):
+        self.instances[instance.pk].append(instance)
+        instance.__dict__[LAZY_FIELDS_ATTR] = self
+
+    def discard(self, instance):
+        others = self.instances.get(instance.pk)
+        if others:
+            self.instances[instance.pk] = [other for other in others
+                                           if other is not instance]
+
+    def load_for(self, instance, using, fields):
+        """
+        Load the fields for every instance if the instance is one of them
+        (and not, say, a copy of one) and it asked for nothing else.
+        Returns whether the instance now has the fields.
+        """
+        others = self.instances.get(instance.pk, ())
+        if (not fields or using not in (None, self.db) or
+                not set(fields) <= set(self.attnames) or
+                not any(other is instance for other in others)):
+            return False
+        self.load()
+        return all(attname in instance.__dict__ for attname in fields)
+
+    def load(self):
+        instances, self.instances = self.instances, defaultdict(list)
+        pks = list(instances)
+        queryset = (self.model._base_manager.db_manager(self.db)
+                    .values_list('pk', *self.attnames))
+        for row in filter_pk_in(queryset, pks):
+            values = dict(zip(self.attnames, row[1:]))
+            for instance in instances[row[0]]:
+                # never overwrite what's been assigned since.
+                loaded = dict((attname, value)
+                              for attname, value in values.items()
+                              if attname not in instance.__dict__)
+                instance.__dict__.update(loaded)
+                if SAVED_VALUES_ATTR in instance.__dict__:
+                    # loading them isn't changing them.
+                    saved_pk, saved = instance.__dict__[SAVED_VALUES_ATTR]
+                    saved = dict(saved)
+                    saved.update(loaded)
+                    instance.__dict__[SAVED_VALUES_ATTR] = (saved_pk, saved)
+        # anything deleted in the meantime goes back to Django's own
+        # refresh_from_db(), which will complain about it.
+        for instance in chain.from_iterable(instances.values()):
+            instance.__dict__.pop(LAZY_FIELDS_ATTR, None)
+
+
 class InheritingModelIterable(ModelIterable):
+    """
+    Yields the deepest selected subclass for each row, working out which one
+    that is by checking which of the joined children's primary keys are
+    present in the row.
+    With the SPLIT strategy, it instead runs one query per selected model and
+    merges the results, and with TWO_PHASE it fetches just the primary keys
+    and types first, then each model's rows by primary key. With LAZY it
+    fetches only the root's fields, and the rest when they're first used.
+    """
     def __iter__(self):
+        results = self.iter_strategy()
+        if self.queryset._our_track_changes:
+            return (track_changes(obj) for obj in results)
+        return results
+
+    def iter_strategy(self):
+        queryset = self.queryset  # type: django.db.models.query.QuerySet
+        if (queryset._our_strategy == TWO_PHASE and
+                two_phase_supported(queryset)):
+            return self.iter_two_phase()
+        if (queryset._our_strategy == LAZY and two_phase_supported(queryset) and
+                queryset._our_plan.joins):
+            return self.iter_lazy()
+        if queryset._our_strategy == SPLIT:
+            ordering_key = ordering_key_getter(queryset)
+            query = queryset.query
+            sliced = query.low_mark or query.high_mark is not None
+            if ordering_key is not False and (ordering_key is not None or
+                                              not sliced):
+                parts = split_querysets(queryset)
+                if parts is not None:
+                    return self.iter_split(parts=parts,
+                                           ordering_key=ordering_key)
+        return self.iter_join()
+
+    def iter_split(self, parts, ordering_key):
+        options = iterable_options(self)
+        iterables = [self.__class__(part, **options).iter_strategy()
+                     for part in parts]
+        if ordering_key is None:
+            results = chain.from_iterable(iterables)
+        else:
+            # the part index and position keep heapq.merge from ever
+            # comparing instances which sort the same.
+            decorated = (((ordering_key(obj), index, position, obj)
+                          for position, obj in enumerate(iterable))
+                         for index, iterable in enumerate(iterables))
+            results = (item[3] for item in merge(*decorated))
+        query = self.queryset.query
+        return islice(results, query.low_mark, query.high_mark)
+
+    def iter_two_phase(self):
+        queryset = self.queryset  # type: django.db.models.query.QuerySet
+        db = queryset.db
+        plan = queryset._our_plan
+        graph = get_inheritance_graph(root_model=queryset.model)
+        # the filtering, ordering and slicing all happen in this query,
+        # which only needs the root's pk and the children's pks to work out
+        # what each row is.
+        keys = queryset.prefetch_related(None)
+        keys._our_state = keys._our_state._replace(prefetches={})
+        type_column = queryset._our_type_column
+        if type_column is not None:
+            # or just the type field, and then nothing needs joining at all
+            # (unless models() joined the children for untyped_rows).
+            keys = keys.values_list('pk', type_column.field.attname)
+        else:
+            keys = keys.values_list('pk', *child_pk_lookups(plan.joins))
+        type_rows = self.get_row_typer(get_pk=itemgetter(0),
+                                       get_child_pks=itemgetter(slice(1, None)),
+                                       get_type_value=itemgetter(1))
+        select_related = prune_select_related(queryset.query.select_related,
+                                              queryset._our_joins)
+        if isinstance(select_related, dict):
+            select_related = tuple(flatten_select_related(select_related))
+        joins = lookups_to_text(plan.joins)
+        known_related_objects = tuple(queryset._known_related_objects.items())
+        # not keys.iterator(), as on 1.11 that never streams the rows.
+        compiler = keys.query.get_compiler(using=db)
+        rows = compiler.results_iter(
+            execute_for_iterable(iterable=self, compiler=compiler))
+        for batch in self.iter_batches(rows):
+            typed = [(model, row[0]) for model, row in type_rows(batch)]
+            pks_by_model = OrderedDict()
+            for model, pk in typed:
+                pks_by_model.setdefault(model, []).append(pk)
+            instances = {}
+            for model, pks in pks_by_model.items():
+                relations = lookups_to_text(
+                    generate_relation_combinations(graph.lookups[model]))
+                instances[model] = self.get_in_bulk(
+                    db=db, model=model, pks=pks, select_related=select_related,
+                    joins=joins, relations=relations)
+            for model, pk in typed:
+                try:
+                    obj = instances[model][pk]
+                except KeyError:
+                    continue  # deleted in between the two queries.
+                if known_related_objects:
+                    self.set_known_related_objects(obj, known_related_objects)
+                yield obj
+
+    def iter_lazy(self):
+        queryset = self.queryset  # type: django.db.models.query.QuerySet
+        db = queryset.db
+        plan = queryset._our_plan
+        root_model = queryset.model
+        child_pks = child_pk_lookups(plan.joins)
+        # only the root's own table is selected (plus anything else asked
+        # for with select_related()), along with whatever tells each row's
+        # model apart: the type field, or else the children's primary keys.
+        lazy = queryset.prefetch_related(None)
+        children = set(join[0] for join in queryset._our_joins)
+        select_related = prune_select_related(queryset.query.select_related,
+                                              queryset._our_joins)
+        if isinstance(select_related, dict):
+            select_related = dict((name, subtree)
+                                  for name, subtree in select_related.items()
+                                  if name not in children) or False
+        lazy.query.select_related = select_related
+        type_column = queryset._our_type_column
+        aliases = ()
+        if type_column is None:
+            aliases = tuple('inheritrix_child_%d' % index
+                            for index in range(len(child_pks)))
+            lazy = lazy.annotate(**dict(
+                (alias, F(child_pk))
+                for alias, child_pk in zip(aliases, child_pks)))
+        compiler = lazy.query.get_compiler(using=db)
+        results = execute_for_iterable(iterable=self, compiler=compiler)
+        select, klass_info = compiler.select, compiler.klass_info
+        columns = dict((select[index][0].target.attname, index)
+                       for index in klass_info['select_fields'])
+        pk_position = columns[root_model._meta.pk.attname]
+        get_child_pks = get_type_value = None
+        if type_column is None:
+            get_child_pks = columns_getter([compiler.annotation_col_map[alias]
+                                            for alias in aliases])
+        else:
+            get_type_value = itemgetter(columns[type_column.field.attname])
+        type_rows = self.get_row_typer(get_pk=itemgetter(pk_position),
+                                       get_child_pks=get_child_pks,
+                                       get_type_value=get_type_value)
+        related_populators = get_related_populators(klass_info, select, db)
+        known_related_objects = tuple(queryset._known_related_objects.items())
+        builders = {}
+        for batch in self.iter_batches(compiler.results_iter(results)):
+            deferred = {}
+            objs = []
+            for model, row in type_rows(batch):
+                if model not in builders:
+                    builders[model] = self.get_lazy_builder(
+                        db=db, model=model, columns=columns,
+                        pk_position=pk_position)
+                build, attnames = builders[model]
+                obj = build(row)
+                for rel_populator in related_populators:
+                    rel_populator.populate(row, obj)
+                if known_related_objects:
+                    self.set_known_related_objects(obj, known_related_objects)
+                if attnames:
+                    if model not in deferred:
+                        deferred[model] = LazySubclassFields(
+                            model=model, attnames=attnames, db=db)
+                    deferred[model].add(obj)
+                objs.append(obj)
+            for obj in objs:
+                yield obj
+
+    def iter_batches(self, rows):
+        """
+        Yield lists of the rows: a chunk at a time when streaming with
+        iterator(), or else all of them at once.
+        """
+        options = iterable_options(self)
+        batch_size = None
+        if options.get('chunked_fetch'):
+            batch_size = options.get('chunk_size') or GET_ITERATOR_CHUNK_SIZE
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                return
+            yield batch
+
+    def get_row_typer(self, get_pk, get_child_pks, get_type_value):
+        """
+        For TWO_PHASE and LAZY, returns type_rows, which turns a batch of
+        rows into [(model, row), ...]: by the type field's value, from
+        get_type_value, if the queryset uses one, falling back to querying
+        the children's primary keys for values which aren't known, or else
+        by the children's primary keys in the row, from get_child_pks.
+        """
+        queryset = self.queryset
+        root_model = queryset.model
+        plan = queryset._our_plan
+        join_models = models_for_joins(root_model=root_model,
+                                       joins=plan.joins)
+        from_children = partial(model_from_children, root_model, join_models)
+        type_column = queryset._our_type_column
+        if type_column is None:
+            def type_rows(batch):
+                return [(from_children(get_child_pks(row)), row)
+                        for row in batch]
+            return type_rows
+        graph = get_inheritance_graph(root_model=root_model)
+        yielded = dict(zip(graph.models, yielded_models(
+            root_model=root_model, joins=plan.joins)))
+        models_by_value = dict(
+            (value, yielded[model])
+            for value, model in type_column.models_by_value.items())
+        child_pks = child_pk_lookups(plan.joins)
+
+        def type_rows(batch):
+            typed = [(models_by_value.get(get_type_value(row)), row)
+                     for row in batch]
+            unknown = [get_pk(row) for model, row in typed if model is None]
+            if unknown:
+                found = self.get_types_from_children(
+                    db=queryset.db, pks=unknown, child_pks=child_pks,
+                    model_from_children=from_children)
+                typed = [(found.get(get_pk(row), root_model)
+                          if model is None else model, row)
+                         for model, row in typed]
+            return typed
+        return type_rows
+
+    def get_lazy_builder(self, db, model, columns, pk_position):
+        """
+        Returns (build, attnames) where build turns a row selecting only the
+        root model's fields (given as {attname: column}) into an instance of
+        the model, and attnames are that model's fields it leaves deferred.
+        """
+        init_list = []
+        positions = []
+        attnames = []
+        for field in model._meta.concrete_fields:
+            if field.attname in columns:
+                position = columns[field.attname]
+            elif is_parent_link(field):
+                # every parent link is the same value as the root's pk.
+                position = pk_position
+            else:
+                attnames.append(field.attname)
+                continue
+            init_list.append(field.attname)
+            positions.append(position)
+        get_values = columns_getter(positions)
+
+        def build(row):
+            return model.from_db(db, init_list, get_values(row))
+        return build, tuple(attnames)
+
+    def get_types_from_children(self, db, pks, child_pks, model_from_children):
+        """
+        For rows whose type field doesn't hold a known value, work out
+        {pk: model} from the children's primary keys instead.
+        """
+        manager = self.queryset.model._base_manager.db_manager(db)
+        queryset = manager.values_list('pk', *child_pks)
+        return dict((row[0], model_from_children(row[1:]))
+                    for row in filter_pk_in(queryset, pks))
+
+    def get_in_bulk(self, db, model, pks, select_related, joins, relations):
+        """
+        Load the given primary keys for exactly the given model, with any
+        select_related() lookups which apply to it, as {pk: instance}
+        """
+        queryset = model._base_manager.db_manager(db).all()
+        if select_related is True:
+            queryset = queryset.select_related()
+        elif select_related:
+            lookups = (rewrite_lookup(lookup, joins=joins, relations=relations)
+                       for lookup in select_related)
+            lookups = tuple(lookup for lookup in lookups if lookup is not None)
+            if lookups:
+                queryset = queryset.select_related(*lookups)
+        return dict((obj.pk, obj) for obj in filter_pk_in(queryset, pks))
+
+    def set_known_related_objects(self, obj, known_related_objects):
+        for field, rel_objs in known_related_objects:
+            # Avoid overwriting objects loaded e.g. by select_related
+            if is_cached(field, obj):
+                continue
+            pk = getattr(obj, field.get_attname())
+            try:
+                rel_obj = rel_objs[pk]
+            except KeyError:
+                pass  # may happen in qs1 | qs2 scenarios
+            else:
+                setattr(obj, field.name, rel_obj)
+
+    def iter_join(self):
         queryset = self.queryset  # type: django.db.models.query.QuerySet
-        query = queryset.query  # type: django.db.models.sql.query.Query
-        relations_for_attrgetter = tuple(x.replace(LOOKUP_SEP, '.') for x in lookups_to_text(queryset._our_joins))
-        attrgetters = tuple(attrgetter(x) for x in relations_for_attrgetter)
-        for obj in super(InheritingModelIterable, self).__iter__():
-            subobj = dig_for_obj(obj=obj, attrgetters=attrgetters)
-            # having got the deepest object, apply any annotations which were
-            # on the root version of the object.
-            if query.annotations:
-                for k in query.annotations.keys():
-                    rootval = getattr(obj, k)
-                    setattr(subobj, k, rootval)
-            if query.extra_select:
-                for k in query.extra_select.keys():
-                    rootval = getattr(obj, k)
-                    setattr(subobj, k, rootval)
-            # if query.select_related:
-            #     import pdb; pdb.set_trace()
-            #     for k in query.select_related.keys():
-            #         if k not in set(chain(queryset._our_joins)):
-            #             print(k)
-            #             rootval = getattr(obj, k)
-            #             setattr(subobj, k, rootval)
+        db = queryset.db
+        compiler = queryset.query.get_compiler(using=db)
+        # Execute the query. This will also fill compiler.select, klass_info,
+        # and annotations.
+        results = execute_for_iterable(iterable=self, compiler=compiler)
+        select, klass_info, annotation_col_map = (
+            compiler.select, compiler.klass_info, compiler.annotation_col_map)
+        plan = queryset._our_plan
+        resolve = None
+        if plan is not None and plan.attrgetters:
+            resolve = self.get_resolver(klass_info=klass_info, select=select,
+                                        annotation_col_map=annotation_col_map,
+                                        plan=plan)
+        build = self.get_builder(db=db, select=select, klass_info=klass_info,
+                                 plan=plan, resolve=resolve)
+        annotations = tuple(annotation_col_map.items())
+        known_related_objects = tuple(queryset._known_related_objects.items())
+        if not annotations and not known_related_objects:
+            for row in compiler.results_iter(results):
+                yield build(row)
+            return
+        for row in compiler.results_iter(results):
+            subobj = build(row)
+            # having got the deepest object, apply any annotations (and
+            # extra selects) directly to it.
+            for attr_name, col_pos in annotations:
+                setattr(subobj, attr_name, row[col_pos])
+
+            # Add the known related objects to the model, if there are any
+            if known_related_objects:
+                self.set_known_related_objects(subobj, known_related_objects)
             yield subobj
 
+    def get_resolver(self, klass_info, select, annotation_col_map, plan):
+        """
+        Returns a callable which gives the attrgetter for the deepest child
+        a row has (or None for the root) from the annotate_type_index()
+        column if there is one which knows about all of the joins, or else
+        from the children's primary key columns.
+        Returns None if the children aren't being selected at all.
+        """
+        type_columns = calculate_type_columns(klass_info=klass_info,
+                                              select=select, joins=plan.joins,
+                                              attrgetters=plan.attrgetters)
+        if type_columns is None:
+            return None
+        queryset = self.queryset
+        type_index = queryset._our_type_index
+        if type_index is not None:
+            alias, joins = type_index
+            if alias in annotation_col_map and set(plan.joins) <= set(joins):
+                return type_index_resolver(root_model=queryset.model,
+                                           column=annotation_col_map[alias],
+                                           joins=plan.joins,
+                                           attrgetters=plan.attrgetters)
+        resolve = partial(resolve_from_row, type_columns=type_columns)
+        type_column = queryset._our_type_column
+        if type_column is not None:
+            column = field_column(klass_info, select, type_column.field.attname)
+            if column is not None:
+                return type_value_resolver(root_model=queryset.model,
+                                           column=column,
+                                           type_column=type_column,
+                                           joins=plan.joins,
+                                           attrgetters=plan.attrgetters,
+                                           fallback=resolve)
+        return resolve
+
+    def get_builder(self, db, select, klass_info, plan, resolve):
+        """
+        Returns a callable which turns a row into the instance to yield.
+        The root instance is built, select_related() populates all of the
+        children below it, and then the deepest one present is dug out.
+        """
+        model_cls = klass_info['model']
+        select_fields = klass_info['select_fields']
+        model_fields_start = select_fields[0]
+        model_fields_end = select_fields[-1] + 1
+        init_list = [f[0].target.attname
+                     for f in select[model_fields_start:model_fields_end]]
+        related_populators = get_related_populators(klass_info, select, db)
+        attrgetters = plan.attrgetters if plan is not None else ()
+        inherited_relations = {}
+        if resolve is not None:
+            inherited_relations = self.get_inherited_relations(
+                klass_info=klass_info, plan=plan)
+
+        def build_root(row):
+            obj = model_cls.from_db(
+                db, init_list, row[model_fields_start:model_fields_end])
+            for rel_populator in related_populators:
+                rel_populator.populate(row, obj)
+            return obj
+
+        if resolve is None:
+            # the joins were taken out of select_related(), so the only
+            # way left to find the children is to go and look.
+            def build(row):
+                return dig_for_obj(obj=build_root(row), attrgetters=attrgetters)
+            return build
+
+        def build(row):
+            obj = build_root(row)
+            attrgetter_ = resolve(row)
+            if attrgetter_ is None:
+                return obj
+            subobj = attrgetter_(obj)
+            for get_ancestor, fields in inherited_relations[attrgetter_]:
+                ancestor = obj if get_ancestor is None else get_ancestor(obj)
+                for field in fields:
+                    copy_cached_value(field, source=ancestor, target=subobj)
+            return subobj
+        return build
+
+    def get_inherited_relations(self, klass_info, plan):
+        """
+        Anything select_related() fetched for a parent is only cached on
+        that parent's instance, not on the child which will be yielded.
+        For each join's attrgetter, work out the
+        ((parent attrgetter, (fields, ...)), ...) to copy over, where the
+        parent attrgetter is None for the root.
+        """
+        klass_infos = {(): klass_info}
+        for path, child_klass_info in iter_child_klass_infos(klass_info):
+            klass_infos[path] = child_klass_info
+        getters = dict(zip(map(tuple, plan.joins), plan.attrgetters))
+        inherited_relations = {}
+        for join, attrgetter_ in zip(plan.joins, plan.attrgetters):
+            ancestors = []
+            for n in range(len(join)):
+                path = tuple(join[0:n])
+                related = klass_infos[path].get('related_klass_infos', ())
+                fields = tuple(cache_holder(related_klass_info)
+                               for related_klass_info in related
+                               if not is_child_klass_info(related_klass_info))
+                if fields:
+                    ancestors.append((getters.get(path), fields))
+            inherited_relations[attrgetter_] = tuple(ancestors)
+        return inherited_relations
+
+
+class LeafModelIterable(InheritingModelIterable):
+    """
+    Yields the same instances as InheritingModelIterable, but builds each
+    one directly from the columns selected for it and every parent table,
+    rather than building the root and every intermediate parent and then
+    discarding them.
+    """
+    def get_builder(self, db, select, klass_info, plan, resolve):
+        if resolve is None:
+            return super(LeafModelIterable, self).get_builder(
+                db=db, select=select, klass_info=klass_info, plan=plan,
+                resolve=resolve)
+        klass_infos = {(): klass_info}
+        for path, child_klass_info in iter_child_klass_infos(klass_info):
+            klass_infos[path] = child_klass_info
+        builders = {}
+        for join, attrgetter_ in zip(plan.joins, plan.attrgetters):
+            chain_ = tuple(klass_infos[tuple(join[0:n])]
+                           for n in range(len(join) + 1))
+            builders[attrgetter_] = self.get_leaf_builder(db=db, select=select,
+                                                          klass_infos=chain_)
+        root_build = self.get_leaf_builder(db=db, select=select,
+                                           klass_infos=(klass_info,))
+
+        def build(row):
+            attrgetter_ = resolve(row)
+            if attrgetter_ is None:
+                return root_build(row)
+            return builders[attrgetter_](row)
+        return build
+
+    def get_leaf_builder(self, db, select, klass_infos):
+        """
+        Given the klass_infos from the root down to a child, return a
+        callable which turns a row into an instance of that child, including
+        anything else select_related() asked for along the way.
+        """
+        leaf_klass_info = klass_infos[-1]
+        model_cls = leaf_klass_info['model']
+        # as with RelatedPopulator, a child's select_fields also include all
+        # of its parents' columns, but not necessarily in the order
+        # Model.__init__ wants them in.
+        model_init_attnames = [f.attname
+                               for f in model_cls._meta.concrete_fields]
+        reorder_map = sorted(
+            (model_init_attnames.index(select[idx][0].target.attname),
+             select[idx][0].target.attname, idx)
+            for idx in leaf_klass_info['select_fields'])
+        init_list = [attname for _, attname, _ in reorder_map]
+        get_values = columns_getter([idx for _, _, idx in reorder_map])
+        related_populators = tuple(
+            RelatedPopulator(related_klass_info, select, db)
+            for ancestor_klass_info in klass_infos
+            for related_klass_info in ancestor_klass_info.get(
+                'related_klass_infos', ())
+            if not is_child_klass_info(related_klass_info))
+
+        def build(row):
+            obj = model_cls.from_db(db, init_list, get_values(row))
+            for rel_populator in related_populators:
+                rel_populator.populate(row, obj)
+            return obj
+        return build
+
+
+QuerySetState = namedtuple('QuerySetState',
+                           'subclasses plan filters prefetches strategy '
+                           'type_index type_column type_cache track_changes')
+# nothing in a state is ever changed in place, only _replace()d, so every
+# clone of a queryset can share its state.
+EMPTY_STATE = QuerySetState(subclasses=frozenset(), plan=None, filters=(),
+                            prefetches={}, strategy=None, type_index=None,
+                            type_column=None, type_cache=None,
+                            track_changes=False)
+
+
+def state_property(name):
+    return property(attrgetter(name), doc="The QuerySetState's {}".format(name))
 
 
 class InheritingQuerySet(QuerySet):
 
     def __init__(self, *args, **kwargs):
         super(InheritingQuerySet, self).__init__(*args, **kwargs)
-        self._our_joins = []
-        self._subclasses = set()
-        self._our_prefetches = {}
+        self._our_state = EMPTY_STATE
         self._iterable_class = InheritingModelIterable
 
     def _clone(self, *args, **kwargs):
         clone = super(InheritingQuerySet, self)._clone(*args, **kwargs)
-        clone._our_joins = self._our_joins[:]
-        clone._subclasses = set(self._subclasses)
-        clone._our_prefetches = self._our_prefetches
+        clone._our_state = self._our_state
         return clone
 
+    def __setstate__(self, state):
+        super(InheritingQuerySet, self).__setstate__(state)
+        if self._our_type_cache is not None:
+            self._our_type_cache.connect(root_model=self.model)
+
+    _subclasses = state_property('_our_state.subclasses')
+    _our_plan = state_property('_our_state.plan')
+    _our_filters = state_property('_our_state.filters')
+    _our_prefetches = state_property('_our_state.prefetches')
+
+    @property
+    def _our_strategy(self):
+        """
+        The strategy() chosen, or else TWO_PHASE with a type field and JOIN
+        without one.
+        """
+        strategy = self._our_state.strategy
+        if strategy is not None:
+            return strategy
+        return TWO_PHASE if self._our_type_column is not None else JOIN
+
+    _our_type_index = state_property('_our_state.type_index')
+    _our_type_column = state_property('_our_state.type_column')
+    _our_type_cache = state_property('_our_state.type_cache')
+    _our_track_changes = state_property('_our_state.track_changes')
+
+    @property
+    def _our_joins(self):
+        plan = self._our_state.plan
+        return plan.joins if plan is not None else ()
+
     def select_subclasses(self, *subclasses):
         if subclasses == ():
-            def get_subclasses(cls):
-                for subclass in cls.__subclasses__():
-                    yield subclass
-                    for subsubclass in get_subclasses(subclass):
-                        yield subsubclass
-            subclasses = set(get_subclasses(self.model))
+            graph = get_inheritance_graph(root_model=self.model)
+            subclasses = graph.descendants
         # Support the single API call equivalent from model-utils
         return self.models(*subclasses, include_self=True)
 
@@ -209,55 +1982,980 @@ class InheritingQuerySet(QuerySet):
         if (overlap and not allow_overlap):
             overlaps = ", ".join(repr(x) for x in overlap)
             raise InvalidModel("The following models have already been selected, {!s}".format(overlaps))
-        clone._subclasses |= models
-
-        function = partial(discovery_lookup_from_model, root_model=clone.model)
-        # generate tuples like: ('a', 'b', 'c')
-        lookups = tuple(set(function(target_model=model) for model in clone._subclasses))
-        # the decision maker
-        our_joins, joins_as_strings, all_combinations = calculate_paths(lookups=lookups)
-        clone._our_joins = our_joins
+        subclasses = clone._subclasses | models
+        plan = query_plans.get(root_model=clone.model, subclasses=subclasses)
+        clone._our_state = clone._our_state._replace(subclasses=subclasses,
+                                                     plan=plan)
         # we're already in a clone, so play about with it directly.
-        clone.query.add_select_related(joins_as_strings)
-        # To avoid returning instances without children, we need to do a filter,
-        # ensuring the children are isnull=False
-        if any(len(combo) > 0 for combo in all_combinations):
-            x = generate_q_filters(lookups=all_combinations)
-            if self.model in clone._subclasses:
-                x = x | generate_basemodel_q_filters(lookups=all_combinations)
-            clone.query.add_q(x)
+        clone.query.add_select_related(plan.select_related)
+        if plan.q_filter is not None:
+            # the plan is shared, so never hand the cached Q to the query.
+            q_filter = deepcopy(plan.q_filter)
+            type_column = clone._our_type_column
+            if type_column is not None:
+                # which is the same as an indexed equality on the type field,
+                # without joining the children; only with untyped_rows do
+                # rows whose field is NULL still go by them.
+                matching = matching_models(root_model=clone.model,
+                                           subclasses=clone._subclasses)
+                values = sorted(type_column.values_by_model[model]
+                                for model in matching)
+                attname = type_column.field.attname
+                type_filter = Q(**{'%s__in' % attname: values})
+                if type_column.untyped_rows:
+                    type_filter |= (Q(**{'%s__isnull' % attname: True}) &
+                                    q_filter)
+                q_filter = type_filter
+            # remember exactly what the filter added, so that the SPLIT
+            # strategy can take it back out again.
+            query = clone.query
+            before = len(query.where.children)
+            refcounts = dict(query.alias_refcount)
+            query.add_q(q_filter)
+            alias_refs = dict((alias, count - refcounts.get(alias, 0))
+                              for alias, count in query.alias_refcount.items()
+                              if count != refcounts.get(alias, 0))
+            span = (before, len(query.where.children), alias_refs)
+            clone._our_state = clone._our_state._replace(
+                filters=clone._our_filters + (span,))
+        return clone
+
+    def strategy(self, name):
+        """
+        How to fetch the subclasses:
+        JOIN (the default) makes one query which LEFT JOINs every table on
+        the way to every selected subclass.
+        SPLIT makes one query per selected model, each only joining down
+        its own chain, and merges the results in Python according to the
+        order_by(). Querysets which can't be split up (eg: those using
+        distinct(), aggregates, or ordering on anything but the root
+        model's own fields) quietly use JOIN instead.
+        TWO_PHASE makes one narrow query selecting only primary keys, to
+        filter, order and slice by and to work out each row's model, then
+        loads each model's rows by primary key, keeping the original order.
+        Querysets with annotations, extra selects or only()/defer() use
+        JOIN instead.
+        LAZY makes one query selecting only the root model's fields (and
+        each row's model, from the type field or the children's primary
+        keys) and yields each row as its subclass, with the subclasses'
+        fields deferred. The first time any of them is needed, they're
+        loaded for every instance of that model in the results at once, in
+        one query per model. It falls back to JOIN as TWO_PHASE does.
+        """
+        if name not in STRATEGIES:
+            raise ValueError(
+                "Unknown strategy {!r}, expected one of {!r}".format(
+                    name, STRATEGIES))
+        clone = self._clone()
+        clone._our_state = clone._our_state._replace(strategy=name)
+        return clone
+
+    def values(self, *fields, **expressions):
+        """
+        As values(), but given with_type='name' (or True, for 'model') also
+        includes the label of each row's concrete class, as worked out by
+        the database from the models() joins, without building any instances.
+        """
+        with_type = expressions.pop('with_type', None)
+        if with_type:
+            alias = TYPE_ALIAS if with_type is True else with_type
+            fields = self._fields_or_defaults(fields, expressions)
+            expressions[alias] = self._type_expression()
+        return super(InheritingQuerySet, self).values(*fields, **expressions)
+
+    def values_list(self, *fields, **kwargs):
+        """
+        As values_list(), but given with_type=True, the label of each row's
+        concrete class comes last in each tuple.
+        """
+        with_type = kwargs.pop('with_type', None)
+        if with_type:
+            fields = (self._fields_or_defaults(fields, {}) +
+                      (self._type_expression(),))
+        return super(InheritingQuerySet, self).values_list(*fields, **kwargs)
+
+    def annotate_type_index(self, alias=TYPE_INDEX_ALIAS):
+        """
+        Annotate each row with the index into
+        get_inheritance_graph(root_model).models of its concrete class, as
+        worked out by the database, so that it can be used in filter(),
+        order_by() and aggregates, and so each row's class can be looked up
+        rather than found by checking the children's columns.
+        Call it after models() so that it knows about all of the joins.
+        """
+        graph = get_inheritance_graph(root_model=self.model)
+        expression = self._type_expression(label=graph.type_indexes.__getitem__,
+                                           output_field=IntegerField())
+        clone = self.annotate(**{alias: expression})
+        type_index = (alias, self._type_plan().joins)
+        clone._our_state = clone._our_state._replace(type_index=type_index)
+        return clone
+
+    def use_type_field(self, field_name, type_values=None,
+                       untyped_rows=False):
+        """
+        Use the given field on the root model, which holds each row's
+        concrete class (see maintain_type_field()), to filter models() with
+        an equality on it rather than checking the children exist, and to
+        find out each row's class; type_values is {Model: value} if the
+        values aren't the default from type_value_for_model().
+        models() leaves out rows whose field is NULL, unless untyped_rows
+        is given, for rows from before maintain_type_field() which haven't
+        been backfill_type_field()ed: they're then filtered by their
+        children, which joins them again.
+        Rows with a value which isn't known are typed by their children.
+        The TWO_PHASE strategy then needs no joins to find the keys, so it
+        becomes the default unless strategy() has chosen another.
+        """
+        type_column = get_type_column(root_model=self.model,
+                                      field_name=field_name,
+                                      type_values=type_values,
+                                      untyped_rows=untyped_rows)
+        return self._use_type_column(type_column)
+
+    def _use_type_column(self, type_column):
+        clone = self._clone()
+        clone._our_state = clone._our_state._replace(type_column=type_column)
+        return clone
+
+    def use_type_cache(self, cache):
+        """
+        Remember the concrete model of everything get() and in_bulk() find,
+        in the given TypeCache, so that next time (as long as nothing but
+        models() has filtered the queryset) they can query just that model's
+        tables, by primary key.
+        """
+        cache.connect(root_model=self.model)
+        clone = self._clone()
+        clone._our_state = clone._our_state._replace(type_cache=cache)
+        return clone
+
+    def track_changes(self, track=True):
+        """
+        Have the instances remember their field values as loaded, so that
+        save() (without update_fields) only writes the fields which have
+        changed since, and so only UPDATEs the tables which own them; see
+        the module's track_changes().
+        """
+        clone = self._clone()
+        clone._our_state = clone._our_state._replace(track_changes=track)
+        return clone
+
+    def get(self, *args, **kwargs):
+        cache = self._our_type_cache
+        pk = None
+        if (cache is not None and not args and len(kwargs) == 1 and
+                self._by_pk_only()):
+            pk = self._cache_pk(*kwargs.items())
+        if pk is None:
+            obj = super(InheritingQuerySet, self).get(*args, **kwargs)
+            if cache is not None:
+                self._remember_types(objs=(obj,))
+            return obj
+        db = self.db
+        key = (db, self.model, pk)
+        model = self._cached_models().get(cache.get_many([key]).get(key))
+        if model is not None:
+            try:
+                manager = model._base_manager.db_manager(db)
+                return self._tracked(manager.get(pk=pk))
+            except model.DoesNotExist:
+                cache.delete_many([key])
+        obj = super(InheritingQuerySet, self).get(*args, **kwargs)
+        self._remember_types(objs=(obj,))
+        return obj
+
+    def in_bulk(self, id_list=None, **kwargs):
+        cache = self._our_type_cache
+        if (cache is None or not id_list or
+                kwargs.get('field_name', 'pk') != 'pk' or
+                not self._by_pk_only()):
+            found = super(InheritingQuerySet, self).in_bulk(id_list, **kwargs)
+            if cache is not None and self._by_pk_only():
+                self._remember_types(objs=found.values())
+            return found
+        db = self.db
+        pks = OrderedDict()
+        for value in id_list:
+            pk = self._cache_pk(('pk', value))
+            if pk is None:
+                return super(InheritingQuerySet, self).in_bulk(id_list,
+                                                               **kwargs)
+            pks[pk] = None
+        cached = cache.get_many([(db, self.model, pk) for pk in pks])
+        models = self._cached_models()
+        pks_by_model = OrderedDict()
+        rest = []
+        for pk in pks:
+            model = models.get(cached.get((db, self.model, pk)))
+            if model is None:
+                rest.append(pk)
+            else:
+                pks_by_model.setdefault(model, []).append(pk)
+        found = {}
+        for model, model_pks in pks_by_model.items():
+            queryset = model._base_manager.db_manager(db).all()
+            found.update((obj.pk, self._tracked(obj))
+                         for obj in filter_pk_in(queryset, model_pks))
+            stale = [pk for pk in model_pks if pk not in found]
+            cache.delete_many([(db, self.model, pk) for pk in stale])
+            rest.extend(stale)
+        if rest:
+            more = super(InheritingQuerySet, self).in_bulk(rest)
+            self._remember_types(objs=more.values())
+            found.update(more)
+        return found
+
+    def _tracked(self, obj):
+        """
+        For instances fetched other than by iterating, so that they're
+        tracked just the same.
+        """
+        return track_changes(obj) if self._our_track_changes else obj
+
+    def _by_pk_only(self):
+        """
+        Whether nothing but models() has filtered the queryset, or changed
+        what it selects beyond the subclasses, such that fetching a row by
+        primary key from the right model gives exactly the same instance.
+        """
+        query = self.query
+        ours = sum(end - start for start, end, alias_refs in self._our_filters)
+        return (self._our_plan is not None and
+                len(query.where.children) == ours and
+                not query.where.negated and
+                query.can_filter() and not query.select_for_update and
+                not query.annotation_select and not query.extra_select and
+                not query.deferred_loading[0] and
+                not self._known_related_objects and
+                not self._prefetch_related_lookups and
+                not prune_select_related(query.select_related, self._our_joins))
+
+    def _cache_pk(self, item):
+        name, value = item
+        pk = self.model._meta.pk
+        if name not in ('pk', 'pk__exact', pk.name, pk.attname,
+                        pk.name + '__exact', pk.attname + '__exact'):
+            return None
+        try:
+            return pk.to_python(value)
+        except ValidationError:
+            return None
+
+    def _cached_models(self):
+        """
+        Returns {concrete model: model to fetch it as} for every concrete
+        model models() lets through.
+        """
+        plan = self._our_plan
+        graph = get_inheritance_graph(root_model=self.model)
+        yielded = dict(zip(graph.models, yielded_models(root_model=self.model,
+                                                        joins=plan.joins)))
+        return dict((model, yielded[model])
+                    for model in matching_models(root_model=self.model,
+                                                 subclasses=self._subclasses))
+
+    def _remember_types(self, objs):
+        """
+        Store the type of each of the objs which is certainly its concrete
+        class, because every subclass it could have had was joined.
+        """
+        plan = self._our_plan
+        if plan is None:
+            return
+        graph = get_inheritance_graph(root_model=self.model)
+        joined = set(models_for_joins(root_model=self.model, joins=plan.joins))
+        certain = set(model for model in graph.models
+                      if all(descendant in joined
+                             for descendant in graph.descendants
+                             if issubclass(descendant, model)))
+        db = self.db
+        models_by_key = dict(((db, self.model, obj.pk), type(obj))
+                             for obj in objs if type(obj) in certain)
+        if models_by_key:
+            self._our_type_cache.set_many(models_by_key)
+
+    def bulk_create_models(self, objs, batch_size=None):
+        """
+        As bulk_create(), but for instances of any mix of the model and its
+        multi-table subclasses: the rows for each table are inserted
+        together, one INSERT per table per batch, from the root table down,
+        with the parent rows' primary keys copied into their children.
+        Where the database can't return the primary keys from a bulk INSERT
+        (eg: SQLite, MySQL), root rows without one are inserted one by one.
+        Like bulk_create(), it doesn't call save() or send any signals, but
+        does set the use_type_field() field and the use_type_cache() types.
+        """
+        assert batch_size is None or batch_size > 0
+        objs = list(objs)
+        if not objs:
+            return objs
+        self._for_write = True
+        db = self.db
+        root_model = self.model._meta.concrete_model
+        type_column = self._our_type_column
+        objs_by_table = defaultdict(list)
+        for obj in objs:
+            model = obj._meta.concrete_model
+            if not issubclass(model, root_model):
+                raise ValueError("Can't bulk create {!r} as {!r}".format(
+                    obj, self.model))
+            if (type_column is not None and
+                    getattr(obj, type_column.field.attname) is None):
+                setattr(obj, type_column.field.attname,
+                        type_column.values_by_model[model])
+            chain_ = sorted(model._meta.get_parent_list() + [model],
+                            key=parent_count)
+            # as save() would, take a primary key given for a child up to
+            # the parents.
+            for table_model in reversed(chain_):
+                for parent, field in table_model._meta.parents.items():
+                    parent_pk = parent._meta.pk.attname
+                    if field is not None and getattr(obj, parent_pk) is None:
+                        setattr(obj, parent_pk, getattr(obj, field.attname))
+            for table_model in chain_:
+                objs_by_table[table_model].append(obj)
+        tables = sorted(objs_by_table, key=parent_count)
+        with transaction.atomic(using=db, savepoint=False):
+            for table_model in tables:
+                table_objs = objs_by_table[table_model]
+                for parent, field in table_model._meta.parents.items():
+                    if field is not None:
+                        for obj in table_objs:
+                            setattr(obj, field.attname,
+                                    getattr(obj, parent._meta.pk.attname))
+                self._insert_table(model=table_model, objs=table_objs,
+                                   batch_size=batch_size)
+        for obj in objs:
+            obj._state.adding = False
+            obj._state.db = db
+        cache = self._our_type_cache
+        if cache is not None:
+            cache.set_many(dict(((db, self.model, obj.pk),
+                                 obj._meta.concrete_model) for obj in objs))
+        return objs
+
+    def _insert_table(self, model, objs, batch_size):
+        """
+        Insert the rows of the model's own table for the objs, a batch at a
+        time, setting the primary keys of any which didn't have one.
+        """
+        db = self.db
+        connection = connections[db]
+        manager = model._base_manager
+        pk = model._meta.pk
+        fields = model._meta.local_concrete_fields
+        with_pk, without_pk = [], []
+        for obj in objs:
+            if getattr(obj, pk.attname) is None:
+                setattr(obj, pk.attname, pk.get_pk_value_on_save(obj))
+            if getattr(obj, pk.attname) is None:
+                without_pk.append(obj)
+            else:
+                with_pk.append(obj)
+        batch_size = batch_size or max(
+            connection.ops.bulk_batch_size(fields, objs), 1)
+        for start in range(0, len(with_pk), batch_size):
+            manager._insert(with_pk[start:start + batch_size], fields=fields,
+                            using=db)
+        if not without_pk:
+            return
+        fields = [field for field in fields if not isinstance(field, AutoField)]
+        # < 3.0
+        if connection.features.can_return_ids_from_bulk_insert:
+            for start in range(0, len(without_pk), batch_size):
+                batch = without_pk[start:start + batch_size]
+                ids = manager._insert(batch, fields=fields, using=db,
+                                      return_id=True)
+                if not isinstance(ids, list):
+                    ids = [ids]
+                for obj, id_ in zip(batch, ids):
+                    setattr(obj, pk.attname, id_)
+        else:
+            for obj in without_pk:
+                setattr(obj, pk.attname,
+                        manager._insert([obj], fields=fields, using=db,
+                                        return_id=True))
+
+    def bulk_update_models(self, objs, fields, batch_size=None):
+        """
+        Save the given fields of instances of any mix of the model and its
+        subclasses, with one UPDATE (per batch) for each table owning any of
+        the fields, setting each row's value with a CASE on its primary key.
+        A field may be qualified by a model, eg: 'JeffSon.v1', to update it
+        only for instances of that model, otherwise it's updated for every
+        instance which has it.
+        Returns {Model: rows updated} for the models whose tables own any of
+        the fields; no other table is touched.
+        """
+        assert batch_size is None or batch_size > 0
+        if not fields:
+            raise ValueError(
+                "Field names must be given to bulk_update_models().")
+        objs = list(objs)
+        if any(obj.pk is None for obj in objs):
+            raise ValueError("All bulk_update_models() objects must have a "
+                             "primary key set.")
+        graph = get_inheritance_graph(root_model=self.model)
+        # {owning model: {field: {pk: obj}}}
+        updates = OrderedDict()
+        for name in fields:
+            model = None
+            field_name = name
+            if '.' in name:
+                model_name, _, field_name = name.rpartition('.')
+                model = model_for_name(root_model=self.model,
+                                       model_name=model_name)
+            owners = set()
+            for candidate in graph.models if model is None else (model,):
+                try:
+                    field = candidate._meta.get_field(field_name)
+                except FieldDoesNotExist:
+                    continue
+                if (not field.concrete or field.many_to_many or
+                        field.primary_key):
+                    raise ValueError(
+                        "bulk_update_models() can only update concrete, "
+                        "non primary key fields, not {!r}".format(name))
+                owners.add(field.model._meta.concrete_model)
+            if not owners:
+                raise FieldDoesNotExist(
+                    "{!r} isn't a field of {!r} or any subclass of it".format(
+                        name, self.model))
+            for obj in objs:
+                if model is not None and not isinstance(obj, model):
+                    continue
+                owner = next((owner for owner in owners
+                              if isinstance(obj, owner)), None)
+                if owner is not None:
+                    field = owner._meta.get_field(field_name)
+                    updates.setdefault(owner, OrderedDict()).setdefault(
+                        field, OrderedDict())[obj.pk] = obj
+        self._for_write = True
+        db = self.db
+        connection = connections[db]
+        updated = OrderedDict()
+        with transaction.atomic(using=db, savepoint=False):
+            for owner, objs_by_field in updates.items():
+                pks = list(OrderedDict.fromkeys(
+                    chain.from_iterable(objs_by_field.values())))
+                size = batch_size or max(connection.ops.bulk_batch_size(
+                    ['pk', 'pk'] + list(objs_by_field), pks), 1)
+                manager = owner._base_manager.db_manager(db)
+                updated[owner] = 0
+                for start in range(0, len(pks), size):
+                    batch = pks[start:start + size]
+                    values = {}
+                    for field, field_objs in objs_by_field.items():
+                        whens = [When(pk=pk,
+                                      then=self._update_value(field,
+                                                              field_objs[pk]))
+                                 for pk in batch if pk in field_objs]
+                        if whens:
+                            values[field.attname] = Case(
+                                *whens, default=F(field.attname),
+                                output_field=field)
+                    rows = manager.filter(pk__in=batch)
+                    updated[owner] += rows.update(**values)
+        return updated
+
+    def _update_value(self, field, obj):
+        value = getattr(obj, field.attname)
+        if hasattr(value, 'resolve_expression'):
+            return value
+        return Value(value, output_field=field)
+
+    def fast_delete_models(self):
+        """
+        Delete the results as delete() would, but without the Collector
+        fetching them and cascading a table (or an object) at a time: the
+        primary keys are selected once, then each table in the hierarchy
+        (and any automatic many to many table) has one DELETE per batch,
+        from the deepest up.
+        If anything needs the Collector, because there are delete signal
+        receivers, or relations pointing into the hierarchy which need
+        cascading, setting null or protecting, it just calls delete().
+        A TypeCache's own receivers don't: the keys are deleted from it
+        in one go instead.
+        Returns (total, {model label: count}) like delete() does.
+        """
+        assert self.query.can_filter(), \
+            "Cannot use 'limit' or 'offset' with delete."
+        if self._fields is not None:
+            raise TypeError(
+                "Cannot call delete() after .values() or .values_list()")
+        plan = self._fast_delete_plan()
+        if plan is None:
+            return self.delete()
+        tables, throughs, type_caches = plan
+        self._for_write = True
+        db = self.db
+        # the models() filter checks the children exist, so which rows it
+        # gives would change as they're deleted; get the keys up front.
+        keys = self.prefetch_related(None).order_by().distinct()
+        pks = list(keys.values_list('pk', flat=True))
+        deleted = OrderedDict()
+        if not pks:
+            return 0, deleted
+        with transaction.atomic(using=db, savepoint=False):
+            for through, field in throughs:
+                query = DeleteQuery(through)
+                count = 0
+                for start in range(0, len(pks), GET_ITERATOR_CHUNK_SIZE):
+                    query.where = query.where_class()
+                    batch = pks[start:start + GET_ITERATOR_CHUNK_SIZE]
+                    query.add_q(Q(**{'%s__in' % field.name: batch}))
+                    count += query.do_query(through._meta.db_table,
+                                            query.where, using=db)
+                deleted[through._meta.label] = count
+            for model in tables:
+                count = DeleteQuery(model).delete_batch(pks, db)
+                # as delete() does, only the models which had rows are given.
+                if count:
+                    deleted[model._meta.label] = count
+            for type_cache, root_model in type_caches:
+                type_cache.delete_many([(db, root_model, pk) for pk in pks])
+        return sum(deleted.values()), deleted
+
+    fast_delete_models.alters_data = True
+    fast_delete_models.queryset_only = True
+
+    def _fast_delete_plan(self):
+        """
+        For fast_delete_models(), returns (tables, throughs, type_caches)
+        where tables are the models whose tables the results may have rows
+        in, deepest first, throughs are ((automatic many to many model, its
+        field pointing at one of them), ...) and type_caches are the
+        {(TypeCache, root model), ...} to forget the keys in, or None if the
+        Collector is needed.
+        """
+        graph = get_inheritance_graph(root_model=self.model)
+        models = set(self.model._meta.get_parent_list()) | set(graph.models)
+        throughs = OrderedDict()
+        type_caches = set()
+        for model in models:
+            if (pre_delete.has_listeners(model) or
+                    m2m_changed.has_listeners(model)):
+                return None
+            receivers = type_cache_receivers(post_delete, model)
+            if receivers is None:
+                return None
+            type_caches |= receivers
+            # eg: GenericRelation
+            if any(hasattr(field, 'bulk_related_objects')
+                   for field in model._meta.private_fields):
+                return None
+            for related in get_candidate_relations_to_delete(model._meta):
+                field = related.field
+                related_model = related.related_model
+                on_delete = field.remote_field.on_delete
+                if ((related_model in models and is_parent_link(field)) or
+                        on_delete is DO_NOTHING):
+                    continue
+                if (related_model._meta.auto_created and
+                        on_delete is CASCADE and
+                        not pre_delete.has_listeners(related_model) and
+                        not post_delete.has_listeners(related_model)):
+                    # subclasses have their parents' relations too.
+                    throughs[related_model, field] = None
+                    continue
+                return None
+        tables = sorted(models, key=parent_count, reverse=True)
+        return tables, tuple(throughs), type_caches
+
+    def count_by_model(self):
+        """
+        Returns an OrderedDict of {Model: count} for each of the models()
+        selected, and any other class the results would include instances
+        of, counted by one query grouped by the type of each row rather than
+        one per model.
+        """
+        assert self.query.can_filter(), \
+            "Cannot count_by_model() once a slice has been taken."
+        plan = self._our_plan
+        if plan is None:
+            return OrderedDict([(self.model, self.count())])
+        graph = get_inheritance_graph(root_model=self.model)
+        models = yielded_models(root_model=self.model, joins=plan.joins)
+        counts = OrderedDict((model, 0) for model in graph.models
+                             if model in self._subclasses)
+        type_column = self._our_type_column
+        if type_column is not None:
+            # group by the type field, without joining anything (unless
+            # models() joined the children for untyped_rows).
+            grouped = self._clone()
+            grouped._our_state = grouped._our_state._replace(prefetches={})
+            grouped = (grouped.prefetch_related(None).order_by()
+                       .values_list(type_column.field.attname)
+                       .annotate(Count('pk', distinct=self.query.distinct)))
+            yielded = dict(zip(graph.models, models))
+            grouped = tuple(grouped)
+            if all(value in type_column.models_by_value
+                   for value, _ in grouped):
+                for value, count in grouped:
+                    model = yielded[type_column.models_by_value[value]]
+                    counts[model] = counts.get(model, 0) + count
+                return counts
+        grouped = self.annotate_type_index(alias=COUNT_TYPE_INDEX_ALIAS)
+        grouped._our_state = grouped._our_state._replace(prefetches={})
+        grouped = (grouped.prefetch_related(None).order_by()
+                   .values_list(COUNT_TYPE_INDEX_ALIAS)
+                   .annotate(Count('pk', distinct=self.query.distinct)))
+        for type_index, count in grouped:
+            model = models[type_index]
+            counts[model] = counts.get(model, 0) + count
+        return counts
+
+    def _fields_or_defaults(self, fields, expressions):
+        # adding the type as an expression would otherwise stop values()
+        # from selecting everything else when given no fields.
+        if fields or expressions:
+            return fields
+        query = self.query
+        return (tuple(query.extra_select) +
+                tuple(f.attname for f in self.model._meta.concrete_fields) +
+                tuple(query.annotation_select))
+
+    def _type_plan(self):
+        if self._our_plan is not None:
+            return self._our_plan
+        # without models(), find out about every subclass.
+        graph = get_inheritance_graph(root_model=self.model)
+        return query_plans.get(root_model=self.model,
+                               subclasses=graph.models)
+
+    def _type_expression(self, **kwargs):
+        return type_case(root_model=self.model,
+                         joins=self._type_plan().joins, **kwargs)
+
+    def only(self, *fields):
+        """
+        As only(), but fields may also be qualified by the model they
+        belong to, eg: 'JeffGrandSon.v2', see qualified_lookup()
+        """
+        fields = tuple(qualified_lookup(root_model=self.model, name=field)
+                       for field in fields)
+        return super(InheritingQuerySet, self).only(*fields)
+
+    def defer(self, *fields):
+        """
+        As defer(), but fields may also be qualified by the model they
+        belong to, eg: 'JeffGrandSon.v2', see qualified_lookup()
+        Django (as of 1.11) loads every field of a model's parents once
+        anything on it is deferred, so defer from the deepest models.
+        """
+        fields = tuple(qualified_lookup(root_model=self.model, name=field)
+                       for field in fields)
+        return super(InheritingQuerySet, self).defer(*fields)
+
+    def _filter_or_exclude(self, negate, *args, **kwargs):
+        """
+        filter(), exclude() and get() take lookups qualified by the model
+        they belong to, eg: filter(**{'JeffGrandDaughter.v2': 2}), including
+        within Q objects, see qualified_lookup(). They go through the same
+        joins as models() does, which Django reuses rather than adding more.
+        """
+        args = tuple(qualified_q(root_model=self.model, q=arg)
+                     if isinstance(arg, Q) else arg
+                     for arg in args)
+        kwargs = dict((qualified_lookup(root_model=self.model, name=name),
+                       value)
+                      for name, value in kwargs.items())
+        return super(InheritingQuerySet, self)._filter_or_exclude(
+            negate, *args, **kwargs)
+
+    def filter_model(self, model, *args, **kwargs):
+        """
+        filter() by the lookups, each qualified by the given model, eg:
+        filter_model(JeffGrandDaughter, v2=2) rather than having to know
+        that it's jeffdaughter__jeffgranddaughter__v2=2.
+        Fields the model inherits are looked up where they're declared, so
+        this doesn't in itself limit the results to the model, models() does.
+        """
+        q_filter = qualified_q(root_model=self.model, q=Q(*args, **kwargs),
+                               model=model)
+        return self.filter(q_filter)
+
+    def order_by(self, *field_names):
+        """
+        As order_by(), but fields may also be qualified by the model they
+        belong to, eg: '-JeffGrandSon.v2', see qualified_lookup()
+        """
+        field_names = tuple(qualified_ordering(root_model=self.model, name=name)
+                            for name in field_names)
+        return super(InheritingQuerySet, self).order_by(*field_names)
+
+    def select_related_models(self, related_dict):
+        """
+        Given a dictionary of {Model: [fields]}, select_related() the fields
+        for only that Model (and its subclasses) as part of the same query,
+        without having to know the join path from the root to it.
+        """
+        lookups = []
+        for model, fields in related_dict.items():
+            relation = relation_string_for_model(root_model=self.model,
+                                                 target_model=model)
+            for field in fields:
+                lookups.append(LOOKUP_SEP.join(x for x in (relation, field)
+                                               if x))
+        return self.select_related(*lookups)
+
+    def skip_parents(self):
+        """
+        Build each row straight into an instance of its deepest subclass,
+        without instantiating every parent model on the way down to it.
+        """
+        clone = self._clone()
+        clone._iterable_class = LeafModelIterable
         return clone
 
     def prefetch_models(self, prefetch_dict):
+        """
+        Given a dictionary of {Model: [lookups]}, prefetch those lookups
+        for only the results which are instances of that Model (or a
+        subclass of it), in one batch per concrete class.
+        """
         clone = self._clone()
-        # apply extras grouped by models...
+        # apply extras grouped by models, into a new dict as the old one is
+        # shared with the queryset this was cloned from.
+        prefetches = dict(clone._our_prefetches)
         for key, value in prefetch_dict.items():
-            if key not in clone._our_prefetches:
-                clone._our_prefetches[key] = []
-            clone._our_prefetches[key].extend(value)
+            prefetches[key] = tuple(prefetches.get(key, ())) + tuple(value)
+        clone._our_state = clone._our_state._replace(prefetches=prefetches)
         return clone
-    #
-    # def _fetch_all(self):
-    #     if self._result_cache is None:
-    #         self._result_cache = list(self.iterator())
-    #     has_prefetch_relateds = len(self._prefetch_related_lookups) > 0
-    #     has_prefetch_models = len(self._our_prefetches) > 0
-    #     needs_prefetches = has_prefetch_relateds or has_prefetch_models
-    #     if needs_prefetches and not self._prefetch_done:
-    #         self._prefetch_related_objects()
-
-    # def _prefetch_related_objects(self):
-    #     things = defaultdict(list)
-    #     for index, thing in enumerate(self._result_cache, start=0):
-    #         things[thing.__class__].append(thing)
-    #
-    #     for klass, instances in things.items():
-    #         prefetches = list(self._prefetch_related_lookups[:])
-    #         if klass in self._our_prefetches:
-    #             prefetches.extend(self._our_prefetches[klass])
-    #         prefetches = tuple(prefetches)
-    #         prefetch_related_objects(instances, prefetches)
-    #     return None
-
-
-InheritingManager = Manager.from_queryset(InheritingQuerySet)
+
+    def _fetch_all(self):
+        super(InheritingQuerySet, self)._fetch_all()
+        if self._our_prefetches and not self._prefetch_done:
+            self._prefetch_related_objects()
+
+    def _prefetch_related_objects(self):
+        if not self._our_prefetches:
+            return super(InheritingQuerySet, self)._prefetch_related_objects()
+        things = OrderedDict()
+        for thing in self._result_cache:
+            things.setdefault(thing.__class__, []).append(thing)
+
+        for klass, instances in things.items():
+            prefetches = self._prefetch_lookups_for_model(klass)
+            if prefetches:
+                prefetch_related_objects(instances, *prefetches)
+        self._prefetch_done = True
+
+    def _prefetch_lookups_for_model(self, klass):
+        """
+        Everything to prefetch for instances of klass: those given to
+        prefetch_models() for it or its parents, most specific first, then
+        any prefetch_related() lookups which apply to it, rewritten to be
+        relative to it.
+        """
+        prefetches = []
+        for model in klass.__mro__:
+            prefetches.extend(self._our_prefetches.get(model, ()))
+        joins = lookups_to_text(self._our_joins)
+        graph = get_inheritance_graph(root_model=self.model)
+        lookup = graph.lookup_for_model(target_model=klass)
+        relations = lookups_to_text(generate_relation_combinations(lookup))
+        for prefetch in self._prefetch_related_lookups:
+            prefetch = rewrite_lookup(prefetch, joins=joins,
+                                      relations=relations)
+            if prefetch is not None:
+                prefetches.append(prefetch)
+        seen = set()
+        unique_prefetches = []
+        for prefetch in prefetches:
+            prefetch_to = getattr(prefetch, 'prefetch_to', prefetch)
+            if prefetch_to not in seen:
+                seen.add(prefetch_to)
+                unique_prefetches.append(prefetch)
+        return tuple(unique_prefetches)
+
+
+class InheritingManager(Manager.from_queryset(InheritingQuerySet)):
+    """
+    Given a type_field, querysets use_type_field() it (with the
+    type_values and untyped_rows) from the start, and given a type_cache,
+    they use_type_cache() it.
+    """
+    def __init__(self, type_field=None, type_values=None, type_cache=None,
+                 untyped_rows=False):
+        super(InheritingManager, self).__init__()
+        self.type_field = type_field
+        self.type_values = type_values
+        self.type_cache = type_cache
+        self.untyped_rows = untyped_rows
+        # (InheritanceGraph, TypeColumn) the column was built for.
+        self._type_column = None
+
+    def get_type_column(self):
+        """
+        The TypeColumn for the type_field, built once rather than for every
+        queryset, and again only if the inheritance graph is.
+        """
+        graph = get_inheritance_graph(root_model=self.model)
+        if self._type_column is None or self._type_column[0] is not graph:
+            type_column = get_type_column(root_model=self.model,
+                                          field_name=self.type_field,
+                                          type_values=self.type_values,
+                                          untyped_rows=self.untyped_rows)
+            self._type_column = (graph, type_column)
+        return self._type_column[1]
+
+    def get_queryset(self):
+        queryset = super(InheritingManager, self).get_queryset()
+        if self.type_field is not None:
+            queryset = queryset._use_type_column(self.get_type_column())
+        if self.type_cache is not None:
+            queryset = queryset.use_type_cache(cache=self.type_cache)
+        return queryset
+
+
+def install_instance_hooks(model):
+    """
+    Replace the model class's refresh_from_db() and save() with the wrappers
+    from install_lazy_refresh() and install_save_changed(), which the LAZY
+    strategy and track_changes() need. Instances which don't come from
+    either go straight through to the originals.
+    This is done for every model below one with an InheritingQuerySet
+    manager as its class is prepared, see install_hooks_when_prepared().
+    """
+    install_lazy_refresh(model)
+    install_save_changed(model)
+
+
+def uses_inheriting_querysets(model):
+    """
+    Whether the model, or any model it inherits from, has a manager whose
+    querysets are InheritingQuerySets.
+    """
+    return any(issubclass(getattr(manager, '_queryset_class', object),
+                          InheritingQuerySet)
+               for klass in model.__mro__ if hasattr(klass, '_meta')
+               for manager in klass._meta.local_managers)
+
+
+def install_hooks_when_prepared(sender, **kwargs):
+    if uses_inheriting_querysets(sender):
+        install_instance_hooks(sender)
+
+
+class_prepared.connect(install_hooks_when_prepared,
+                       dispatch_uid='inheritrix_install_instance_hooks')
+
+# {(root model, field name): pre_save receiver} from maintain_type_field().
+_type_field_receivers = {}
+
+
+def maintain_type_field(root_model, field_name, type_values=None):
+    """
+    Keep the given field on the root_model set to the concrete class of
+    every instance of it (or of any subclass) as it's saved.
+    The receiver is connected to pre_save for each model in the hierarchy
+    and their proxies, and for any subclass prepared later on.
+    """
+    field = root_model._meta.get_field(field_name)
+
+    def set_type_field(sender, instance, raw=False, **kwargs):
+        if raw:
+            return
+        setattr(instance, field.attname,
+                type_value_for_model(field, sender, type_values=type_values))
+    _type_field_receivers[root_model, field_name] = set_type_field
+    graph = get_inheritance_graph(root_model=root_model)
+    for model in graph.models:
+        connect_type_field(root_model, field_name, model)
+        for proxy in get_proxy_descendants(model):
+            connect_type_field(root_model, field_name, proxy)
+    return set_type_field
+
+
+def get_proxy_descendants(model):
+    """
+    The proxies of the model, and their proxies, whose instances are saved
+    with themselves as the pre_save sender.
+    """
+    for subclass in model.__subclasses__():
+        opts = getattr(subclass, '_meta', None)
+        if opts is not None and opts.proxy:
+            yield subclass
+            for proxy in get_proxy_descendants(subclass):
+                yield proxy
+
+
+def connect_type_field(root_model, field_name, model):
+    uid = ('inheritrix_type_field', root_model, field_name, model)
+    # replacing the receiver of an earlier maintain_type_field().
+    pre_save.disconnect(sender=model, dispatch_uid=uid)
+    pre_save.connect(_type_field_receivers[root_model, field_name],
+                     sender=model, weak=False, dispatch_uid=uid)
+
+
+def connect_type_fields(sender, **kwargs):
+    """
+    Connect the maintain_type_field() receivers of every hierarchy the
+    newly prepared model class is part of.
+    """
+    if sender._meta.abstract:
+        return
+    for root_model, field_name in list(_type_field_receivers):
+        if issubclass(sender, root_model):
+            connect_type_field(root_model, field_name, sender)
+
+
+class_prepared.connect(connect_type_fields,
+                       dispatch_uid='inheritrix_connect_type_fields')
+
+
+def backfill_type_field(root_model, field_name, type_values=None, using=None):
+    """
+    Set the given field on every existing row of the root_model to its
+    concrete class, one UPDATE per model, from the root down so that the
+    deepest class wins. Returns {Model: rows updated}
+    """
+    field = root_model._meta.get_field(field_name)
+    graph = get_inheritance_graph(root_model=root_model)
+    manager = root_model._base_manager.db_manager(using)
+    updated = OrderedDict()
+    for model in sorted(graph.models,
+                        key=lambda model: len(graph.lookups[model])):
+        value = type_value_for_model(field, model, type_values=type_values)
+        lookup = graph.lookups[model]
+        queryset = manager.all()
+        if lookup:
+            queryset = queryset.filter(
+                **{'%s__isnull' % LOOKUP_SEP.join(lookup): False})
+        updated[model] = queryset.update(**{field.attname: value})
+    return updated
+
+
+def downcast(instances, using=None, strategy=JOIN):
+    """
+    Given instances of a root model (or of any model with multi-table
+    subclasses), return a list of each one as its concrete subclass, in the
+    same order, with one query per model given (per database, and per batch
+    of primary keys) rather than one per instance per level of subclass.
+    The strategy is as for InheritingQuerySet.strategy(), eg: TWO_PHASE for
+    one narrow query and then one per concrete subclass found.
+    Instances which already are their concrete class, haven't been saved
+    or no longer exist are returned as they are; the others are loaded
+    afresh.
+    """
+    instances = list(instances)
+    pks_by_model = OrderedDict()
+    for instance in instances:
+        if instance.pk is None:
+            continue
+        key = (instance._meta.concrete_model, using or instance._state.db)
+        pks_by_model.setdefault(key, OrderedDict())[instance.pk] = None
+    found = {}
+    for (model, db), pks in pks_by_model.items():
+        if not get_inheritance_graph(root_model=model).descendants:
+            continue
+        queryset = (InheritingQuerySet(model=model, using=db)
+                    .select_subclasses().strategy(strategy))
+        for obj in filter_pk_in(queryset, list(pks)):
+            if obj._meta.concrete_model is not model:
+                found[(model, db, obj.pk)] = obj
+    return [found.get((instance._meta.concrete_model,
+                       using or instance._state.db, instance.pk), instance)
+            for instance in instances]
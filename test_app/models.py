@@ -1,10 +1,11 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import
 from __future__ import unicode_literals
+from django.contrib.contenttypes.models import ContentType
 from django.db.models import Model, IntegerField, ForeignKey, OneToOneField, \
-    ManyToManyField
+    ManyToManyField, CharField, DateTimeField
 from django.utils.six import python_2_unicode_compatible
-from inheritrix import InheritingManager
+from inheritrix import InheritingManager, maintain_type_field
 
 
 class RelatesToJeff(Model):
@@ -80,3 +81,42 @@ class JeffGreatGrandSon2(JeffGrandSon):
 class JeffGreatGrandDaughter(JeffGrandDaughter):
     v3 = IntegerField(default=3)
     fk8 = ForeignKey(RelatesToGreatGrandDaughter, null=True)
+
+
+class Vehicle(Model):
+    wheels = IntegerField(default=4)
+    kind = CharField(max_length=100, null=True, db_index=True)
+    content_type = ForeignKey(ContentType, null=True)
+    polymorphs = InheritingManager()
+    by_kind = InheritingManager(type_field='kind')
+    by_content_type = InheritingManager(type_field='content_type')
+
+
+class Car(Vehicle):
+    doors = IntegerField(default=4)
+
+
+class SportsCar(Car):
+    top_speed = IntegerField(default=200)
+
+
+class Bicycle(Vehicle):
+    gears = IntegerField(default=1)
+
+
+class Post(Model):
+    title = CharField(max_length=100, default='')
+    updated = DateTimeField(auto_now=True)
+    polymorphs = InheritingManager()
+
+
+class Article(Post):
+    body = CharField(max_length=100, default='')
+
+    def save(self, *args, **kwargs):
+        self.saved_by = kwargs.pop('saved_by', None)
+        super(Article, self).save(*args, **kwargs)
+
+
+maintain_type_field(Vehicle, 'kind')
+maintain_type_field(Vehicle, 'content_type')
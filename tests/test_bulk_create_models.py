@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import unicode_literals
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from test_app.models import (Jeff, JeffSon, JeffDaughter, JeffGrandSon,
+                             JeffGrandDaughter, JeffGreatGrandSon1,
+                             JeffGreatGrandSon2, JeffGreatGrandDaughter,
+                             RelatesToJeff, RelatesToJeffSon, Vehicle, Car,
+                             SportsCar, Bicycle)
+
+from conftest import ALL_MODELS
+
+
+def field_values(obj):
+    return [getattr(obj, field.attname) for field in obj._meta.concrete_fields]
+
+
+@pytest.mark.django_db
+def test_mixed_models_one_insert_per_child_table():
+    fk = RelatesToJeff._default_manager.create()
+    objs = [model(v=v, fk=fk) for v, model in enumerate(ALL_MODELS * 2)]
+    objs[1].fk2 = RelatesToJeffSon._default_manager.create()
+    with CaptureQueriesContext(connection) as queries:
+        created = Jeff.polymorphs.bulk_create_models(iter(objs))
+    assert created == objs
+    tables = len(ALL_MODELS) - 1
+    if connection.features.can_return_ids_from_bulk_insert:
+        assert len(queries) == 1 + tables
+    else:
+        # the root rows one by one, to find out their primary keys.
+        assert len(queries) == len(objs) + tables
+    assert all(not obj._state.adding and obj._state.db == 'default' for obj in objs)
+    found = list(Jeff.polymorphs.select_subclasses().order_by('pk'))
+    assert [type(x) for x in found] == [type(x) for x in objs]
+    assert [field_values(x) for x in found] == [field_values(x) for x in objs]
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('batch_size,inserts', [(None, 8), (2, 11)])
+def test_given_primary_keys(batch_size, inserts):
+    objs = [model(pk=pk + 10, v=pk) for pk, model in enumerate(
+        (JeffGreatGrandSon1, JeffGreatGrandSon2, JeffGreatGrandDaughter, JeffSon, Jeff))]
+    with CaptureQueriesContext(connection) as queries:
+        Jeff.polymorphs.bulk_create_models(objs, batch_size=batch_size)
+    # batches of two would be 3 for the root and JeffSon and 2 for JeffGrandSon.
+    assert len(queries) == inserts
+    found = Jeff.polymorphs.select_subclasses().in_bulk([10, 11, 12, 13, 14])
+    assert dict((pk, type(obj)) for pk, obj in found.items()) == dict(
+        (obj.pk, type(obj)) for obj in objs)
+    assert found[12].jeffgranddaughter_ptr_id == 12
+
+
+@pytest.mark.django_db
+def test_from_a_subclass():
+    objs = [JeffGrandSon(v=1), JeffSon(v=2), JeffGreatGrandSon2(v=3)]
+    JeffSon.polymorphs.bulk_create_models(objs)
+    assert [type(x) for x in Jeff.polymorphs.select_subclasses().order_by('pk')] == [
+        JeffGrandSon, JeffSon, JeffGreatGrandSon2]
+    with pytest.raises(ValueError):
+        JeffSon.polymorphs.bulk_create_models([JeffDaughter()])
+    assert Jeff.polymorphs.bulk_create_models([]) == []
+
+
+@pytest.mark.django_db
+def test_sets_type_field():
+    objs = [Vehicle(), Car(doors=2), SportsCar(), Bicycle(kind='bike')]
+    Vehicle.by_kind.bulk_create_models(objs)
+    assert [obj.kind for obj in objs] == [
+        'test_app.vehicle', 'test_app.car', 'test_app.sportscar', 'bike']
+    found = list(Vehicle.by_kind.select_subclasses().order_by('pk'))
+    assert [type(x) for x in found] == [Vehicle, Car, SportsCar, Bicycle]
+    assert found[1].doors == 2
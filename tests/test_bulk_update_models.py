@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import unicode_literals
+import pytest
+from django.core.exceptions import FieldDoesNotExist
+from django.db import connection
+from django.db.models import F
+from django.test.utils import CaptureQueriesContext
+
+from inheritrix import InvalidModel
+from test_app.models import (Jeff, JeffSon, JeffDaughter, JeffGrandSon,
+                             JeffGrandDaughter, JeffGreatGrandSon1,
+                             RelatesToJeff, RelatesToJeffGrandSon)
+
+
+@pytest.fixture
+def blanks():
+    return [model._default_manager.create()
+            for model in (Jeff, JeffSon, JeffDaughter, JeffGrandSon,
+                          JeffGrandDaughter, JeffGreatGrandSon1)]
+
+
+def fetch(objs):
+    found = Jeff.polymorphs.select_subclasses().in_bulk([obj.pk for obj in objs])
+    return [found[obj.pk] for obj in objs]
+
+
+@pytest.mark.django_db
+def test_one_update_per_owning_table(blanks):
+    fk = RelatesToJeff._default_manager.create()
+    for n, obj in enumerate(blanks):
+        obj.v = n + 10
+        obj.fk = fk
+        if hasattr(obj, 'v1'):
+            obj.v1 = n + 20
+    with CaptureQueriesContext(connection) as queries:
+        updated = Jeff.polymorphs.bulk_update_models(blanks, ['v', 'fk', 'v1'])
+    # the root, JeffSon and JeffDaughter, and nothing for the grandchildren.
+    assert len(queries) == 3
+    assert updated == {Jeff: 6, JeffSon: 3, JeffDaughter: 2}
+    found = fetch(blanks)
+    assert [x.v for x in found] == [10, 11, 12, 13, 14, 15]
+    assert all(x.fk == fk for x in found)
+    assert [getattr(x, 'v1', None) for x in found] == [None, 21, 22, 23, 24, 25]
+
+
+@pytest.mark.django_db
+def test_qualified_fields(blanks):
+    for obj in blanks[1:]:
+        obj.v1 = 7
+    blanks[3].fk4 = RelatesToJeffGrandSon._default_manager.create()
+    blanks[5].fk4 = RelatesToJeffGrandSon._default_manager.create()
+    with CaptureQueriesContext(connection) as queries:
+        updated = Jeff.polymorphs.bulk_update_models(
+            reversed(blanks), ['JeffSon.v1', 'JeffGrandSon.fk4'])
+    assert len(queries) == 2
+    assert updated == {JeffSon: 3, JeffGrandSon: 2}
+    found = fetch(blanks)
+    # JeffDaughter's v1 was left alone.
+    assert [getattr(x, 'v1', None) for x in found] == [None, 7, 1, 7, 1, 7]
+    assert [getattr(x, 'fk4_id', None) for x in found] == [
+        None, None, None, blanks[3].fk4_id, None, blanks[5].fk4_id]
+
+
+@pytest.mark.django_db
+def test_batches_and_expressions(blanks):
+    for obj in blanks:
+        obj.v = F('v') + 5
+    with CaptureQueriesContext(connection) as queries:
+        Jeff.polymorphs.bulk_update_models(blanks, ['v'], batch_size=4)
+    assert len(queries) == 2
+    assert [x.v for x in fetch(blanks)] == [5] * 6
+
+
+@pytest.mark.django_db
+def test_skips_tables_not_needed(blanks):
+    blanks[4].v2 = 9
+    with CaptureQueriesContext(connection) as queries:
+        assert Jeff.polymorphs.bulk_update_models(blanks[:4], ['v2']) == {JeffGrandSon: 1}
+    assert len(queries) == 1
+    assert fetch(blanks)[4].v2 == 2
+
+
+@pytest.mark.django_db
+def test_errors(blanks):
+    with pytest.raises(ValueError):
+        Jeff.polymorphs.bulk_update_models(blanks, [])
+    with pytest.raises(ValueError):
+        Jeff.polymorphs.bulk_update_models(blanks, ['JeffSon.jeff_ptr'])
+    with pytest.raises(ValueError):
+        Jeff.polymorphs.bulk_update_models(blanks, ['m2m'])
+    with pytest.raises(ValueError):
+        Jeff.polymorphs.bulk_update_models([Jeff()], ['v'])
+    with pytest.raises(FieldDoesNotExist):
+        Jeff.polymorphs.bulk_update_models(blanks, ['nope'])
+    with pytest.raises(FieldDoesNotExist):
+        Jeff.polymorphs.bulk_update_models(blanks, ['JeffDaughter.v2'])
+    with pytest.raises(InvalidModel):
+        Jeff.polymorphs.bulk_update_models(blanks, ['RelatesToJeff.v'])
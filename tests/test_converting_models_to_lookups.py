@@ -5,7 +5,13 @@ import pytest
 from inheritrix import (discovery_lookup_from_model,
                         walk_from_model_to_root,
                         InvalidModel, generate_relation_combinations,
-                        lookups_to_text, relation_string_for_model)
+                        lookups_to_text, relation_string_for_model,
+                        get_inheritance_graph, get_concrete_descendants,
+                        rewrite_lookup, minimal_lookups,
+                        generate_q_filters, generate_basemodel_q_filters,
+                        build_query_plan, qualified_lookup, model_for_name)
+from django.db.models import Prefetch, Q
+from django.test.utils import isolate_apps
 from test_app.models import Jeff, JeffSon, JeffDaughter, JeffGrandSon, JeffGrandDaughter, JeffGreatGrandSon1, JeffGreatGrandSon2, JeffGreatGrandDaughter
 
 
@@ -92,3 +98,137 @@ def test_generate_relation_combinations(indata, expected):
 def test_relation_tuples_from_root(model, expected):
     result = relation_string_for_model(Jeff, model)
     assert result == expected
+
+
+def test_concrete_descendants():
+    result = tuple(get_concrete_descendants(Jeff))
+    assert result == (JeffSon, JeffGrandSon, JeffGreatGrandSon1,
+                      JeffGreatGrandSon2, JeffDaughter, JeffGrandDaughter,
+                      JeffGreatGrandDaughter)
+
+
+def test_inheritance_graph_is_reused():
+    assert get_inheritance_graph(Jeff) is get_inheritance_graph(Jeff)
+    assert get_inheritance_graph(Jeff) is not get_inheritance_graph(JeffSon)
+
+
+@pytest.mark.parametrize('model', [
+    Jeff, JeffSon, JeffDaughter, JeffGrandSon, JeffGrandDaughter,
+    JeffGreatGrandSon1, JeffGreatGrandSon2, JeffGreatGrandDaughter,
+])
+def test_inheritance_graph_lookups(model):
+    graph = get_inheritance_graph(Jeff)
+    assert graph.lookups[model] == discovery_lookup_from_model(Jeff, model)
+    assert graph.lookup_for_model(model) == discovery_lookup_from_model(Jeff, model)
+
+
+def test_inheritance_graph_descendants_of_child():
+    graph = get_inheritance_graph(JeffSon)
+    assert graph.descendants == (JeffGrandSon, JeffGreatGrandSon1,
+                                 JeffGreatGrandSon2)
+    assert graph.lookup_for_model(JeffGreatGrandSon2) == ('jeffgrandson', 'jeffgreatgrandson2')
+
+
+def test_inheritance_graph_invalid_model():
+    with pytest.raises(InvalidModel):
+        get_inheritance_graph(JeffSon).lookup_for_model(JeffDaughter)
+
+
+@isolate_apps('test_app')
+def test_inheritance_graph_cleared_when_class_prepared():
+    before = get_inheritance_graph(Jeff)
+
+    class JeffProxy(JeffSon):
+        class Meta:
+            app_label = 'test_app'
+            proxy = True
+
+    after = get_inheritance_graph(Jeff)
+    assert before is not after
+    assert after.descendants == before.descendants
+
+
+@pytest.mark.parametrize('lookup,expected', [
+    ('ab__bb__fk', 'fk'),
+    ('ab__fk2', 'fk2'),
+    ('fk3', 'fk3'),
+    ('ac__fk4', None),
+    ('ab__bb__cc__fk5', None),
+])
+def test_rewrite_lookup(lookup, expected):
+    joins = ['ab', 'ab__bb', 'ab__bb__cc', 'ac']
+    relations = ['ab', 'ab__bb']
+    assert rewrite_lookup(lookup, joins=joins, relations=relations) == expected
+
+
+def test_rewrite_lookup_prefetch_object():
+    queryset = Jeff.polymorphs.all()
+    prefetch = Prefetch('ab__bb__fk', queryset=queryset, to_attr='fks')
+    result = rewrite_lookup(prefetch, joins=['ab', 'ab__bb'], relations=['ab', 'ab__bb'])
+    assert result.prefetch_through == 'fk'
+    assert result.prefetch_to == 'fks'
+    assert result.queryset is queryset
+
+
+def test_minimal_lookups_drops_anything_through_another():
+    result = minimal_lookups([('a',), ('a', 'b'), ('c', 'd'), ('c', 'd', 'e'), ()])
+    assert result == (('a',), ('c', 'd'))
+
+
+def test_generate_q_filters_only_checks_leaves():
+    combos = ((('a',), ('a', 'b')), (('a',), ('a', 'c'), ('a', 'c', 'd')))
+    result = generate_q_filters(combos)
+    assert result.connector == Q.OR
+    assert result.children == [('a__b__isnull', False), ('a__c__d__isnull', False)]
+
+
+def test_generate_q_filters_collapses_to_shallowest():
+    combos = ((('a',),), (('a',), ('a', 'b')), (('a',), ('a', 'c')))
+    assert generate_q_filters(combos).children == [('a__isnull', False)]
+
+
+def test_generate_basemodel_q_filters_only_checks_first_level():
+    combos = ((('a',), ('a', 'b')), (('a',), ('a', 'c')), (('d',),))
+    result = generate_basemodel_q_filters(combos)
+    assert result.connector == Q.AND
+    assert result.children == [('a__isnull', True), ('d__isnull', True)]
+
+
+@pytest.mark.parametrize('subclasses', [
+    (Jeff, JeffSon, JeffDaughter, JeffGrandSon, JeffGrandDaughter,
+     JeffGreatGrandSon1, JeffGreatGrandSon2, JeffGreatGrandDaughter),
+    (Jeff, JeffSon, JeffDaughter),
+    (Jeff, JeffSon, JeffGreatGrandSon1, JeffDaughter),
+])
+def test_query_plan_omits_filter_when_everything_matches(subclasses):
+    assert build_query_plan(Jeff, frozenset(subclasses)).q_filter is None
+
+
+def test_query_plan_filter_for_every_descendant():
+    subclasses = frozenset(get_inheritance_graph(Jeff).descendants)
+    result = build_query_plan(Jeff, subclasses).q_filter
+    assert result.connector == Q.OR
+    assert result.children == [('jeffdaughter__isnull', False), ('jeffson__isnull', False)]
+
+
+@pytest.mark.parametrize('name,expected', [
+    ('v', 'v'),
+    ('jeffson__v1', 'jeffson__v1'),
+    ('Jeff.v', 'v'),
+    ('JeffGrandSon.v2', 'jeffson__jeffgrandson__v2'),
+    ('jeffgrandson.v2', 'jeffson__jeffgrandson__v2'),
+    ('test_app.JeffGrandSon.fk4__pk', 'jeffson__jeffgrandson__fk4__pk'),
+    ('JeffGreatGrandSon1.v', 'v'),
+    ('JeffGreatGrandSon1.v1', 'jeffson__v1'),
+    ('JeffGreatGrandSon1.pk', 'jeffson__jeffgrandson__jeffgreatgrandson1__pk'),
+    ('JeffGreatGrandDaughter.o2o', 'jeffdaughter__jeffgranddaughter__o2o'),
+])
+def test_qualified_lookup(name, expected):
+    assert qualified_lookup(Jeff, name) == expected
+
+
+def test_qualified_lookup_outside_the_tree():
+    with pytest.raises(InvalidModel):
+        qualified_lookup(JeffSon, 'JeffDaughter.v1')
+    with pytest.raises(InvalidModel):
+        model_for_name(Jeff, 'test_app.RelatesToJeff')
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import unicode_literals
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from test_app.models import Jeff, JeffSon, JeffGrandSon, JeffGreatGrandSon1, JeffDaughter
+from test_app2.models import (InheritanceManagerTestParent, InheritanceManagerTestChild2,
+                              InheritanceManagerTestGrandChild1)
+
+
+@pytest.fixture
+def one_of_each():
+    return [model._default_manager.create(v=v) for v, model in
+            enumerate((Jeff, JeffSon, JeffGrandSon, JeffGreatGrandSon1, JeffDaughter))]
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('skip_parents', [False, True])
+def test_defer_qualified_fields(one_of_each, skip_parents):
+    queryset = (Jeff.polymorphs.select_subclasses().order_by('pk')
+                .defer('JeffGrandSon.v2', 'JeffDaughter.fk3'))
+    if skip_parents:
+        queryset = queryset.skip_parents()
+    sql = str(queryset.query)
+    assert '"test_app_jeffgrandson"."v2"' not in sql
+    assert '"test_app_jeffdaughter"."fk3_id"' not in sql
+    results = list(queryset)
+    assert [type(x) for x in results] == [type(x) for x in one_of_each]
+    assert [x.get_deferred_fields() for x in results] == [
+        set(), set(), {'v2'}, {'v2'}, {'fk3_id'}]
+
+
+@pytest.mark.django_db
+def test_defer_inherited_field_from_the_root(one_of_each):
+    # JeffSon.v is really Jeff.v
+    queryset = Jeff.polymorphs.select_subclasses().order_by('pk').defer('JeffSon.v')
+    assert '"test_app_jeff"."v"' not in str(queryset.query)
+    results = list(queryset)
+    assert [type(x) for x in results] == [type(x) for x in one_of_each]
+    assert all(x.get_deferred_fields() == {'v'} for x in results)
+    assert [x.v for x in results] == [x.v for x in one_of_each]
+
+
+@pytest.mark.django_db
+def test_only_qualified_fields(one_of_each):
+    queryset = (Jeff.polymorphs.select_subclasses().order_by('pk')
+                .only('Jeff.v', 'JeffSon.v1', 'JeffGrandSon.v2'))
+    results = list(queryset)
+    assert [type(x) for x in results] == [type(x) for x in one_of_each]
+    grandson = results[2]
+    assert grandson.get_deferred_fields() == {'fk_id', 'fk2_id', 'fk4_id'}
+    assert (grandson.v, grandson.v1, grandson.v2) == (2, 1, 2)
+    # the rest can still be loaded, lazily.
+    with CaptureQueriesContext(connection) as queries:
+        assert grandson.fk4_id is None
+    assert len(queries) == 1
+
+
+@pytest.mark.django_db
+def test_defer_wide_child_columns():
+    InheritanceManagerTestParent.objects.create(normal_field='parent')
+    InheritanceManagerTestChild2.objects.create(normal_field='child', normal_field_2='x' * 1000)
+    InheritanceManagerTestGrandChild1.objects.create(normal_field='grandchild',
+                                                     normal_field_2='y' * 1000,
+                                                     text_field='z' * 1000)
+    queryset = (InheritanceManagerTestParent.objects.select_subclasses().order_by('pk')
+                .defer('InheritanceManagerTestChild2.normal_field_2',
+                       'InheritanceManagerTestGrandChild1.text_field'))
+    sql = str(queryset.query)
+    assert '"test_app2_inheritancemanagertestchild2"."normal_field_2"' not in sql
+    assert '"test_app2_inheritancemanagertestgrandchild1"."text_field"' not in sql
+    parent, child, grandchild = queryset
+    assert type(grandchild) is InheritanceManagerTestGrandChild1
+    assert grandchild.get_deferred_fields() == {'text_field'}
+    assert grandchild.normal_field_2 == 'y' * 1000
+    assert grandchild.text_field == 'z' * 1000
+    assert child.normal_field_2 == 'x' * 1000
+
+
+@pytest.mark.django_db
+def test_defer_none_still_clears(one_of_each):
+    queryset = Jeff.polymorphs.select_subclasses().defer('JeffGrandSon.v2').defer(None)
+    assert '"test_app_jeffgrandson"."v2"' in str(queryset.query)
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import unicode_literals
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from inheritrix import downcast, TWO_PHASE
+from test_app.models import (Jeff, JeffSon, JeffDaughter, JeffGrandSon,
+                             JeffGreatGrandSon1, JeffGreatGrandDaughter,
+                             RelatesToJeff, Vehicle, Car, SportsCar)
+
+
+@pytest.fixture
+def shuffled():
+    return [model._default_manager.create(v=v)
+            for v, model in enumerate((JeffGreatGrandSon1, Jeff, JeffSon, JeffDaughter,
+                                       JeffGreatGrandDaughter, JeffGrandSon))]
+
+
+@pytest.mark.django_db
+def test_downcast_keeps_order(shuffled):
+    roots = list(Jeff._base_manager.order_by('-pk'))
+    with CaptureQueriesContext(connection) as queries:
+        results = downcast(roots)
+    assert len(queries) == 1
+    assert [x.pk for x in results] == [x.pk for x in roots]
+    assert [type(x) for x in results] == [type(x) for x in reversed(shuffled)]
+    # nothing to do for the root rows, so they're given back untouched.
+    assert results[4] is roots[4]
+
+
+@pytest.mark.django_db
+def test_downcast_two_phase(shuffled):
+    roots = list(Jeff._base_manager.order_by('pk'))
+    with CaptureQueriesContext(connection) as queries:
+        results = downcast(roots, strategy=TWO_PHASE)
+    assert len(queries) == 1 + len(set(type(x) for x in shuffled))
+    assert [type(x) for x in results] == [type(x) for x in shuffled]
+
+
+@pytest.mark.django_db
+def test_downcast_mixed_models(shuffled):
+    car = SportsCar.objects.create()
+    given = [Vehicle._base_manager.get(pk=car.pk),
+             JeffSon.objects.get(pk=shuffled[0].pk),
+             Jeff(v=1), RelatesToJeff._default_manager.create(),
+             Jeff._base_manager.get(pk=shuffled[3].pk),
+             Car.objects.get(pk=car.pk)]
+    with CaptureQueriesContext(connection) as queries:
+        results = downcast(iter(given))
+    # one each for Vehicle, JeffSon, Jeff and Car.
+    assert len(queries) == 4
+    assert [type(x) for x in results] == [SportsCar, JeffGreatGrandSon1, Jeff,
+                                         RelatesToJeff, JeffDaughter, SportsCar]
+    assert results[2] is given[2]
+    assert results[3] is given[3]
+
+
+@pytest.mark.django_db
+def test_downcast_deleted(shuffled):
+    roots = list(Jeff._base_manager.order_by('pk'))
+    Jeff._base_manager.filter(pk=roots[0].pk).delete()
+    results = downcast(roots)
+    assert results[0] is roots[0]
+    assert type(results[2]) is JeffSon
+
+
+def test_downcast_nothing():
+    assert downcast([]) == []
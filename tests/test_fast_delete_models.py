@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import unicode_literals
+import pytest
+from django.db import connection
+from django.db.models.signals import post_delete
+from django.test.utils import CaptureQueriesContext
+
+from inheritrix import LocalTypeCache
+from test_app.models import (Jeff, JeffSon, JeffDaughter, JeffGrandSon,
+                             JeffGrandDaughter, JeffGreatGrandSon1,
+                             JeffGreatGrandDaughter, RelatesToJeffMany,
+                             Vehicle, Car, SportsCar, Bicycle)
+
+
+MODELS = (Jeff, JeffSon, JeffDaughter, JeffGrandSon, JeffGrandDaughter,
+          JeffGreatGrandSon1, JeffGreatGrandDaughter)
+
+
+@pytest.fixture
+def linked_jeffs():
+    return create_jeffs()
+
+
+def create_jeffs():
+    many = RelatesToJeffMany._default_manager.create()
+    objs = [model._default_manager.create(v=v)
+            for v, model in enumerate(MODELS)]
+    for obj in objs:
+        obj.m2m.add(many)
+    return objs
+
+
+def row_counts(models):
+    return [model._base_manager.count() for model in models]
+
+
+@pytest.mark.django_db
+def test_one_delete_per_table(linked_jeffs):
+    with CaptureQueriesContext(connection) as queries:
+        queryset = Jeff.polymorphs.models(JeffSon, JeffGrandDaughter)
+        deleted = queryset.fast_delete_models()
+    assert deleted == (21, {
+        'test_app.Jeff_m2m': 5,
+        'test_app.JeffGreatGrandSon1': 1,
+        'test_app.JeffGreatGrandDaughter': 1,
+        'test_app.JeffGrandSon': 2,
+        'test_app.JeffGrandDaughter': 2,
+        'test_app.JeffSon': 3,
+        'test_app.JeffDaughter': 2,
+        'test_app.Jeff': 5,
+    })
+    # the primary keys, then the m2m table and every table in the hierarchy.
+    assert len(queries) == 2 + len(MODELS) + 1
+    assert row_counts(MODELS) == [2, 0, 1, 0, 0, 0, 0]
+    assert Jeff.m2m.through._base_manager.count() == 2
+    assert RelatesToJeffMany._base_manager.count() == 1
+
+
+@pytest.mark.django_db
+def test_same_as_delete(linked_jeffs):
+    fast = Jeff.polymorphs.filter(v__gte=3).fast_delete_models()
+    for obj in Jeff.polymorphs.select_subclasses():
+        obj.v += 10
+        obj.save()
+    create_jeffs()
+    assert Jeff.polymorphs.filter(v__gte=3, v__lt=10).delete() == fast
+    assert row_counts(MODELS) == [6, 2, 2, 0, 0, 0, 0]
+
+
+@pytest.mark.django_db
+def test_from_a_subclass(linked_jeffs):
+    assert JeffDaughter.polymorphs.all().fast_delete_models()[0] == 12
+    assert row_counts(MODELS) == [4, 3, 0, 2, 0, 1, 0]
+    assert Jeff.polymorphs.none().fast_delete_models() == (0, {})
+
+
+@pytest.mark.django_db
+def test_falls_back_for_receivers(linked_jeffs):
+    seen = []
+
+    def receiver(sender, instance, **kwargs):
+        seen.append(instance.pk)
+    post_delete.connect(receiver, sender=JeffGrandSon)
+    try:
+        queryset = Jeff.polymorphs.filter(pk=linked_jeffs[5].pk)
+        assert queryset.fast_delete_models()[0] == 5
+    finally:
+        post_delete.disconnect(receiver, sender=JeffGrandSon)
+    assert seen == [linked_jeffs[5].pk]
+
+
+@pytest.mark.django_db
+def test_type_field_hierarchy():
+    for model in (Vehicle, Car, SportsCar, Bicycle):
+        model._default_manager.create()
+    with CaptureQueriesContext(connection) as queries:
+        assert Vehicle.by_kind.models(Car).fast_delete_models()[0] == 5
+    assert len(queries) == 1 + 4
+    assert row_counts((Vehicle, Car, SportsCar, Bicycle)) == [2, 0, 0, 1]
+
+
+def test_not_on_the_manager():
+    # or Jeff.polymorphs.fast_delete_models() would delete every row.
+    assert not hasattr(Jeff.polymorphs, 'fast_delete_models')
+
+
+@pytest.mark.django_db
+def test_type_cache_receivers_are_not_a_reason_to_fall_back(linked_jeffs):
+    type_cache = LocalTypeCache()
+    Jeff.polymorphs.use_type_cache(type_cache)
+    try:
+        keys = [('default', Jeff, obj.pk) for obj in linked_jeffs]
+        type_cache.set_many({key: Jeff for key in keys})
+        with CaptureQueriesContext(connection) as queries:
+            queryset = Jeff.polymorphs.filter(pk=linked_jeffs[5].pk)
+            assert queryset.fast_delete_models()[0] == 5
+        # as many queries as without a type cache.
+        assert len(queries) == 2 + len(MODELS) + 1
+        assert set(type_cache.get_many(keys)) == set(keys) - {keys[5]}
+    finally:
+        type_cache.disconnect(Jeff)
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import unicode_literals
+import pytest
+from django.db import connection
+from django.db.models import F
+from django.test.utils import CaptureQueriesContext
+
+import inheritrix
+from inheritrix import JOIN, SPLIT, TWO_PHASE
+from test_app.models import Jeff
+
+from conftest import ALL_MODELS
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('strategy', [JOIN, SPLIT, TWO_PHASE])
+@pytest.mark.parametrize('skip_parents', [False, True])
+def test_iterator_matches_list(jeffs, strategy, skip_parents):
+    queryset = (Jeff.polymorphs.select_subclasses().select_related('fk')
+                .order_by('-v', 'pk').strategy(strategy))
+    if skip_parents:
+        queryset = queryset.skip_parents()
+    streamed = list(queryset.iterator())
+    assert queryset._result_cache is None
+    assert streamed == list(queryset)
+    assert [type(x) for x in streamed] == [type(x) for x in queryset]
+
+
+@pytest.mark.django_db
+def test_iterator_keeps_annotations(jeffs):
+    queryset = Jeff.polymorphs.select_subclasses().annotate(w=F('v') + 1).order_by('pk')
+    assert [x.w for x in queryset.iterator()] == [x.v + 1 for x in jeffs]
+
+
+@pytest.mark.django_db
+def test_iterator_is_lazy(jeffs):
+    queryset = Jeff.polymorphs.select_subclasses().order_by('pk')
+    with CaptureQueriesContext(connection) as queries:
+        results = queryset.iterator()
+        assert len(queries) == 0
+        assert next(results) == jeffs[0]
+        assert len(queries) == 1
+        assert len(list(results)) == len(jeffs) - 1
+    assert len(queries) == 1
+
+
+@pytest.mark.django_db
+def test_iterator_hydrates_two_phase_in_chunks(jeffs, monkeypatch):
+    monkeypatch.setattr(inheritrix, 'GET_ITERATOR_CHUNK_SIZE', 4)
+    queryset = Jeff.polymorphs.select_subclasses().order_by('pk').strategy(TWO_PHASE)
+    with CaptureQueriesContext(connection) as queries:
+        results = queryset.iterator()
+        assert next(results) == jeffs[0]
+        # the keys, and each of the 4 models in the first chunk.
+        assert len(queries) == 5
+        assert list(results) == jeffs[1:]
+    assert len(queries) == 1 + len(jeffs)
+    # without iterator(), everything is hydrated at once.
+    with CaptureQueriesContext(connection) as queries:
+        list(queryset.all())
+    assert len(queries) == 1 + len(ALL_MODELS)
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import unicode_literals
+import copy
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from inheritrix import LAZY, JOIN
+from test_app.models import (Jeff, JeffSon, JeffDaughter, JeffGrandSon,
+                             JeffGreatGrandSon2, JeffGreatGrandDaughter,
+                             RelatesToJeffSon, Vehicle, Car, SportsCar, Bicycle)
+
+from conftest import ALL_MODELS
+
+
+def field_values(obj):
+    return [getattr(obj, field.attname) for field in obj._meta.concrete_fields]
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('models,options', [
+    ((JeffSon,), {}),
+    ((JeffGrandSon,), {'include_self': True}),
+    ((JeffDaughter, JeffGreatGrandDaughter, JeffGreatGrandSon2), {'include_self': True}),
+    (ALL_MODELS[1:], {}),
+    (ALL_MODELS[1:], {'include_self': True}),
+])
+def test_lazy_matches_join(jeffs, models, options):
+    queryset = Jeff.polymorphs.models(*models, **options).order_by('-v', 'pk')
+    joined = list(queryset.strategy(JOIN))
+    with CaptureQueriesContext(connection) as queries:
+        lazy = list(queryset.strategy(LAZY))
+    assert len(queries) == 1
+    assert '"v1"' not in queries[0]['sql'].split('FROM')[0]
+    assert lazy == joined
+    assert [type(x) for x in lazy] == [type(x) for x in joined]
+    with CaptureQueriesContext(connection) as queries:
+        assert [field_values(x) for x in lazy] == [field_values(x) for x in joined]
+    # one query for each model which had anything deferred.
+    assert len(queries) == len(set(type(x) for x in lazy) - {Jeff})
+
+
+@pytest.mark.django_db
+def test_lazy_root_fields_need_no_queries(jeffs):
+    queryset = Jeff.polymorphs.select_subclasses().order_by('pk').strategy(LAZY)
+    with CaptureQueriesContext(connection) as queries:
+        results = list(queryset)
+        assert [(x.pk, x.v, x.fk_id) for x in results] == [(x.pk, x.v, x.fk_id) for x in jeffs]
+    assert len(queries) == 1
+    son = next(x for x in results if type(x) is JeffSon)
+    assert son.get_deferred_fields() == {'v1', 'fk2_id'}
+    with CaptureQueriesContext(connection) as queries:
+        son.v1
+        for obj in results:
+            if isinstance(obj, JeffSon):
+                obj.v1
+                obj.fk2_id
+    # every JeffSon and its subclasses loaded together, one model at a time.
+    assert len(queries) == len(set(type(x) for x in results if isinstance(x, JeffSon)))
+    assert son.get_deferred_fields() == set()
+
+
+@pytest.mark.django_db
+def test_lazy_select_related(jeffs):
+    son = JeffSon.objects.get(pk=jeffs[1].pk)
+    son.fk2 = RelatesToJeffSon._default_manager.create()
+    son.save()
+    queryset = (Jeff.polymorphs.select_subclasses().select_related('fk', 'jeffson__fk2')
+                .order_by('pk').strategy(LAZY))
+    with CaptureQueriesContext(connection) as queries:
+        results = list(queryset)
+        assert [x.fk for x in results] == [x.fk for x in jeffs]
+    assert len(queries) == 1
+    assert results[1].fk2 == son.fk2
+
+
+@pytest.mark.django_db
+def test_lazy_save_only_touches_loaded_fields(jeffs):
+    obj = Jeff.polymorphs.models(JeffGrandSon).strategy(LAZY).get(pk=jeffs[3].pk)
+    assert type(obj) is JeffGrandSon
+    JeffGrandSon.objects.filter(pk=obj.pk).update(v2=10)
+    obj.v = 4
+    obj.save()
+    obj = JeffGrandSon.objects.get(pk=obj.pk)
+    assert (obj.v, obj.v2) == (4, 10)
+
+
+@pytest.mark.django_db
+def test_lazy_deleted_child_raises(jeffs):
+    results = list(Jeff.polymorphs.models(JeffSon).order_by('pk').strategy(LAZY))
+    JeffSon.objects.filter(pk=results[0].pk).delete()
+    results[1].v1
+    with pytest.raises(JeffSon.DoesNotExist):
+        results[0].v1
+
+
+@pytest.mark.django_db
+def test_lazy_full_refresh_leaves_others_deferred(jeffs):
+    results = list(Jeff.polymorphs.models(JeffSon).order_by('pk').strategy(LAZY))
+    results[0].refresh_from_db()
+    assert 'v1' in results[0].get_deferred_fields()
+    with CaptureQueriesContext(connection) as queries:
+        results[1].v1
+        results[0].v1
+    assert len(queries) == 2
+
+
+@pytest.mark.django_db
+def test_lazy_keeps_assigned_values(jeffs):
+    queryset = Jeff.polymorphs.models(JeffGreatGrandDaughter).order_by('pk').strategy(LAZY)
+    first, second = queryset
+    first.v3 = 99
+    assert second.v3 == 3
+    assert first.v3 == 99
+    first.save()
+    assert JeffGreatGrandDaughter.objects.get(pk=first.pk).v3 == 99
+
+
+@pytest.mark.django_db
+def test_lazy_copies_load_for_themselves(jeffs):
+    first, second = Jeff.polymorphs.models(JeffSon).order_by('pk').strategy(LAZY)[:2]
+    duplicate = copy.copy(first)
+    with CaptureQueriesContext(connection) as queries:
+        assert duplicate.v1 == 1
+    assert len(queries) == 1
+    assert 'v1' in first.get_deferred_fields()
+    with CaptureQueriesContext(connection) as queries:
+        assert (first.v1, second.v1) == (1, 1)
+    assert len(queries) == 1
+
+
+@pytest.mark.django_db
+def test_lazy_iterator_groups_by_chunk(jeffs):
+    queryset = Jeff.polymorphs.models(JeffSon).order_by('pk').strategy(LAZY)
+    results = list(queryset.iterator())
+    assert results == list(queryset.strategy(JOIN))
+
+
+@pytest.mark.django_db
+def test_lazy_type_field():
+    vehicles = [Vehicle.by_kind.create(), Car.objects.create(),
+                SportsCar.objects.create(top_speed=300), Bicycle.objects.create(gears=3)]
+    Vehicle._base_manager.filter(pk=vehicles[3].pk).update(kind='unknown')
+    queryset = Vehicle.by_kind.select_subclasses().order_by('pk').strategy(LAZY)
+    with CaptureQueriesContext(connection) as queries:
+        results = list(queryset)
+    # the rows with a bad type field have to be looked up.
+    assert len(queries) == 2
+    assert 'JOIN' not in queries[0]['sql']
+    assert [type(x) for x in results] == [Vehicle, Car, SportsCar, Bicycle]
+    assert (results[2].top_speed, results[3].gears) == (300, 3)
+
+
+@pytest.mark.django_db
+def test_lazy_falls_back_to_join(jeffs):
+    queryset = (Jeff.polymorphs.select_subclasses().order_by('pk')
+                .only('v', 'jeffson__v1').strategy(LAZY))
+    with CaptureQueriesContext(connection) as queries:
+        results = list(queryset)
+    assert len(queries) == 1
+    assert 'JOIN' in queries[0]['sql']
+    assert [type(x) for x in results] == [type(x) for x in jeffs]
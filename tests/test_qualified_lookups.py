@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import unicode_literals
+import pytest
+from django.db.models import Q
+
+from inheritrix import InvalidModel, qualified_q, qualified_ordering
+from test_app.models import (Jeff, JeffSon, JeffDaughter, JeffGrandSon,
+                             JeffGrandDaughter, JeffGreatGrandDaughter)
+
+
+@pytest.fixture
+def v2_jeffs():
+    return [model._default_manager.create(v=v, v2=v2)
+            for model, v, v2 in ((JeffGrandSon, 1, 5), (JeffGrandDaughter, 2, 5),
+                                 (JeffGrandDaughter, 3, 6),
+                                 (JeffGreatGrandDaughter, 4, 5))] + [
+        JeffSon._default_manager.create(v=5), Jeff._default_manager.create(v=6)]
+
+
+def joins(queryset):
+    return str(queryset.query).count(' JOIN ')
+
+
+@pytest.mark.django_db
+def test_filter_reuses_the_models_joins(v2_jeffs):
+    queryset = Jeff.polymorphs.models(JeffGrandDaughter, JeffSon)
+    filtered = queryset.filter(**{'JeffGrandDaughter.v2': 5})
+    assert joins(filtered) == joins(queryset) == 3
+    assert [x.pk for x in filtered.order_by('pk')] == [v2_jeffs[1].pk,
+                                                       v2_jeffs[3].pk]
+    assert filtered.filter_model(JeffDaughter, v1=1).count() == 2
+
+
+@pytest.mark.django_db
+def test_filter_model(v2_jeffs):
+    queryset = Jeff.polymorphs.select_subclasses()
+    found = queryset.filter_model(JeffGrandDaughter, Q(v2=6) | Q(v=4))
+    assert sorted(x.pk for x in found) == [v2_jeffs[2].pk, v2_jeffs[3].pk]
+    assert type(queryset.filter_model(JeffGrandSon, v2=5, v=1).get()) is JeffGrandSon
+    # v is on Jeff, so it doesn't take being a JeffSon, models() does that.
+    found = queryset.filter_model(JeffSon, v=6)
+    assert [x.pk for x in found] == [v2_jeffs[5].pk]
+    with pytest.raises(InvalidModel):
+        JeffSon.polymorphs.filter_model(JeffDaughter, v1=1)
+
+
+@pytest.mark.django_db
+def test_exclude_and_get(v2_jeffs):
+    queryset = Jeff.polymorphs.models(JeffGrandDaughter)
+    assert [x.pk for x in queryset.exclude(Q(**{'JeffGrandDaughter.v2': 5}))] == [
+        v2_jeffs[2].pk]
+    assert queryset.get(**{'test_app.JeffGrandDaughter.v2': 6}) == v2_jeffs[2]
+
+
+@pytest.mark.django_db
+def test_order_by(v2_jeffs):
+    queryset = Jeff.polymorphs.select_subclasses()
+    ordered = queryset.order_by('-JeffGrandDaughter.v2', '-v')
+    assert joins(ordered) == joins(queryset)
+    # the NULLs sort first or last depending on the database.
+    pks = [x.pk for x in ordered if isinstance(x, JeffGrandDaughter)]
+    assert pks == [v2_jeffs[2].pk, v2_jeffs[3].pk, v2_jeffs[1].pk]
+
+
+def test_qualified_q():
+    q = Q(Q(**{'JeffSon.v1': 1}) | ~Q(v=2), **{'JeffGrandSon.v': 3})
+    assert str(qualified_q(Jeff, q)) == str(
+        Q(Q(jeffson__v1=1) | ~Q(v=2), v=3))
+    unchanged = Q(v=1)
+    assert qualified_q(Jeff, unchanged) is unchanged
+    assert str(qualified_q(Jeff, Q(v1=1, v=2), model=JeffDaughter)) == str(
+        Q(jeffdaughter__v1=1, v=2))
+
+
+@pytest.mark.parametrize('name,expected', [
+    ('-JeffGrandSon.v2', '-jeffson__jeffgrandson__v2'),
+    ('JeffSon.v', 'v'),
+    ('-v', '-v'),
+    ('?', '?'),
+    # the extra() form of table.column
+    ('test_app_jeff.v', 'test_app_jeff.v'),
+])
+def test_qualified_ordering(name, expected):
+    assert qualified_ordering(Jeff, name) == expected
@@ -1,7 +1,6 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import
 from __future__ import unicode_literals
-from unittest import expectedFailure
 from django.db.models import Prefetch
 from django.test import TestCase
 
@@ -230,7 +229,52 @@ class RelationQueryCounts(TestCase):
         self.assertIsInstance(only, JeffGreatGrandSon1)
 
 
-    @expectedFailure
+    def test_select_related_models(self):
+        fk = RelatesToJeff.objects.create()
+        fk2 = RelatesToJeffSon.objects.create()
+        fk4 = RelatesToJeffGrandSon.objects.create()
+        fk6 = RelatesToGreatGrandSon1.objects.create()
+        fk8 = RelatesToGreatGrandDaughter.objects.create()
+        Jeff._default_manager.create(fk=fk)
+        JeffGrandSon._default_manager.create(fk=fk, fk2=fk2, fk4=fk4)
+        JeffGreatGrandSon1._default_manager.create(fk2=fk2, fk4=fk4, fk6=fk6)
+        JeffGreatGrandDaughter._default_manager.create(fk8=fk8)
+        related = {
+            Jeff: ('fk',),
+            JeffSon: ('fk2',),
+            JeffGrandSon: ('fk4',),
+            JeffGreatGrandSon1: ('fk6',),
+            JeffGreatGrandDaughter: ('fk8',),
+        }
+        for queryset in (Jeff.polymorphs.select_subclasses(),
+                         Jeff.polymorphs.select_subclasses().skip_parents()):
+            with self.assertNumQueries(1):
+                a, ba, ca, cc = queryset.select_related_models(related).order_by('pk')
+                self.assertEqual(a.fk, fk)
+                self.assertEqual((ba.fk, ba.fk2, ba.fk4), (fk, fk2, fk4))
+                self.assertEqual((ca.fk, ca.fk2, ca.fk4, ca.fk6), (None, fk2, fk4, fk6))
+                self.assertEqual((cc.fk, cc.fk8), (None, fk8))
+
+    def test_prefetch_models_only_applies_to_that_model(self):
+        fk5 = RelatesToJeffGrandDaughter.objects.create()
+        fk8 = RelatesToGreatGrandDaughter.objects.create()
+        Jeff._default_manager.create()
+        JeffSon._default_manager.create()
+        JeffGreatGrandDaughter._default_manager.create(fk5=fk5, fk8=fk8)
+        JeffGreatGrandDaughter._default_manager.create(fk5=fk5, fk8=fk8)
+        # 1 for the results, 1 for fk8, and 1 for fk5 which is rewritten
+        # from a prefetch_related() against the root.
+        with self.assertNumQueries(3):
+            results = list(
+                Jeff.polymorphs.select_subclasses().order_by('pk')
+                .prefetch_related('jeffdaughter__jeffgranddaughter__fk5')
+                .prefetch_models({JeffGreatGrandDaughter: ('fk8',)}))
+            self.assertEqual([type(x) for x in results],
+                             [Jeff, JeffSon, JeffGreatGrandDaughter, JeffGreatGrandDaughter])
+            for cc in results[2:]:
+                assert cc.fk8 == fk8
+                assert cc.fk5 == fk5
+
     def test_prefetch_related(self):
         """
         one query for all A children, then 1 each for each of the FKs.
@@ -2,8 +2,16 @@
 from __future__ import absolute_import
 from __future__ import unicode_literals
 import pytest
+from operator import and_, or_
+from django.db import connection
+from django.db.models import Q
+from django.db.models.signals import pre_init
+from django.test.utils import CaptureQueriesContext
 
-from inheritrix import InvalidModel
+import inheritrix
+from inheritrix import (InvalidModel, PlanCache, query_plans, resolve_from_row,
+                        generate_relation_combinations, discovery_lookup_from_model,
+                        reduce)
 from test_app.models import Jeff, JeffSon, JeffDaughter, JeffGrandSon, JeffGrandDaughter, JeffGreatGrandSon1, JeffGreatGrandSon2, JeffGreatGrandDaughter, RelatesToJeff
 
 
@@ -124,3 +132,183 @@ def test_values_list():
     ba = JeffGrandSon._default_manager.create()
     results = list(Jeff.polymorphs.models(Jeff, JeffSon, JeffGrandSon).values_list('pk', 'v'))
     assert results == [(1, 0), (2, 0), (3, 0)]
+
+
+def test_plan_cache_hits_and_misses():
+    cache = PlanCache(maxsize=2)
+    first = cache.get(Jeff, {JeffSon, Jeff})
+    assert cache.info() == (0, 1, 2, 1)
+    second = cache.get(Jeff, [Jeff, JeffSon])
+    assert second is first
+    assert cache.info() == (1, 1, 2, 1)
+
+
+def test_plan_cache_evicts_least_recently_used():
+    cache = PlanCache(maxsize=2)
+    son = cache.get(Jeff, {JeffSon})
+    daughter = cache.get(Jeff, {JeffDaughter})
+    cache.get(Jeff, {JeffSon})
+    cache.get(Jeff, {JeffGrandSon})
+    assert cache.info().currsize == 2
+    assert cache.get(Jeff, {JeffSon}) is son
+    assert cache.get(Jeff, {JeffDaughter}) is not daughter
+
+
+def test_plan_contents():
+    plan = PlanCache().get(Jeff, {JeffGrandSon})
+    assert plan.joins == (('jeffson', 'jeffgrandson'), ('jeffson',))
+    assert sorted(plan.select_related) == ['jeffson', 'jeffson__jeffgrandson']
+    assert len(plan.attrgetters) == 2
+    assert plan.q_filter is not None
+    assert PlanCache().get(Jeff, {Jeff}).q_filter is None
+
+
+def test_models_uses_plan_cache():
+    query_plans.clear()
+    Jeff.polymorphs.models(JeffSon, JeffDaughter)
+    Jeff.polymorphs.models(JeffDaughter, JeffSon)
+    Jeff.polymorphs.models(JeffDaughter, JeffSon, include_self=True)
+    info = query_plans.info()
+    assert info.hits == 1
+    assert info.misses == 2
+
+
+@pytest.mark.django_db
+def test_models_does_not_mutate_cached_plan():
+    a = Jeff._default_manager.create()
+    aa = JeffSon._default_manager.create()
+    first = Jeff.polymorphs.models(JeffSon)
+    second = Jeff.polymorphs.models(JeffSon).filter(pk=aa.pk)
+    assert first._our_plan is second._our_plan
+    assert list(first) == [aa]
+    assert list(second) == [aa]
+    assert list(Jeff.polymorphs.models(JeffSon)) == [aa]
+
+
+def test_resolve_from_row_picks_first_present_column():
+    type_columns = ((2, 'grandchild'), (1, 'child'))
+    assert resolve_from_row((1, 1, 1), type_columns) == 'grandchild'
+    assert resolve_from_row((1, 1, None), type_columns) == 'child'
+    assert resolve_from_row((1, None, None), type_columns) is None
+
+
+@pytest.mark.django_db
+def test_children_resolved_without_digging(monkeypatch):
+    def dig_for_obj(*args, **kwargs):
+        raise AssertionError("Should've been resolved from the row")
+    monkeypatch.setattr(inheritrix, 'dig_for_obj', dig_for_obj)
+    a = Jeff._default_manager.create()
+    aa = JeffSon._default_manager.create()
+    ba = JeffGrandSon._default_manager.create()
+    cc = JeffGreatGrandDaughter._default_manager.create()
+    results = list(Jeff.polymorphs.select_subclasses().order_by('pk'))
+    assert results == [a, aa, ba, cc]
+    assert [type(x) for x in results] == [Jeff, JeffSon, JeffGrandSon, JeffGreatGrandDaughter]
+
+
+@pytest.mark.django_db
+def test_children_resolved_when_select_related_is_cleared():
+    a = Jeff._default_manager.create()
+    ba = JeffGrandSon._default_manager.create()
+    results = list(Jeff.polymorphs.select_subclasses().select_related(None).order_by('pk'))
+    assert [type(x) for x in results] == [Jeff, JeffGrandSon]
+
+
+class CountInits(object):
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, **kwargs):
+        self.count += 1
+
+    def __enter__(self):
+        pre_init.connect(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        pre_init.disconnect(self)
+
+
+@pytest.mark.django_db
+def test_skip_parents_builds_one_instance_per_row():
+    Jeff._default_manager.create(v=10)
+    JeffSon._default_manager.create(v=11, v1=12)
+    JeffGreatGrandSon1._default_manager.create(v=13, v1=14, v2=15, v3=16)
+    JeffGreatGrandDaughter._default_manager.create(v=17, v1=18, v2=19, v3=20)
+    queryset = Jeff.polymorphs.select_subclasses().order_by('pk')
+    with CountInits() as inits:
+        expected = list(queryset)
+    assert inits.count > 4
+    with CountInits() as inits:
+        results = list(queryset.skip_parents())
+    assert inits.count == 4
+    assert results == expected
+    assert [type(x) for x in results] == [type(x) for x in expected]
+    ggd = results[3]
+    assert (ggd.v, ggd.v1, ggd.v2, ggd.v3) == (17, 18, 19, 20)
+    assert ggd.get_deferred_fields() == set()
+    assert results[2].v3 == 16
+
+
+@pytest.mark.django_db
+def test_skip_parents_keeps_select_related_and_annotations():
+    fk = RelatesToJeff._default_manager.create()
+    JeffGreatGrandSon1._default_manager.create(fk=fk, v=3)
+    queryset = (Jeff.polymorphs.models(JeffGreatGrandSon1).select_related('fk')
+                .extra(select={'foo': 'v + 1'}).skip_parents())
+    with CaptureQueriesContext(connection) as queries:
+        only = queryset[0]
+        assert only.fk == fk
+    assert len(queries) == 1
+    assert only.foo == 4
+    assert isinstance(only, JeffGreatGrandSon1)
+
+
+def verbose_q_filter(combos, include_self):
+    # the predicate models() used to build, checking every intermediate.
+    has = [reduce(and_, (Q(**{'%s__isnull' % '__'.join(part): False}) for part in combo))
+           for combo in combos]
+    q_filter = reduce(or_, has)
+    if include_self:
+        q_filter |= reduce(and_, (Q(**{'%s__isnull' % '__'.join(part): True})
+                                  for combo in combos for part in combo))
+    return q_filter
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('models,include_self', [
+    ((JeffSon,), False),
+    ((JeffGreatGrandSon1, JeffGreatGrandDaughter), False),
+    ((JeffGreatGrandSon1, JeffGreatGrandDaughter), True),
+    ((JeffSon, JeffGrandSon, JeffGreatGrandSon2), True),
+    ((JeffGrandSon, JeffGreatGrandSon1, JeffGreatGrandSon2, JeffDaughter), False),
+    ((JeffSon, JeffDaughter, JeffGrandSon, JeffGrandDaughter, JeffGreatGrandSon1,
+      JeffGreatGrandSon2, JeffGreatGrandDaughter), True),
+])
+def test_filter_is_minimal_but_equivalent(models, include_self):
+    for model in (Jeff, JeffSon, JeffDaughter, JeffGrandSon, JeffGrandDaughter,
+                  JeffGreatGrandSon1, JeffGreatGrandSon2, JeffGreatGrandDaughter):
+        model._default_manager.create()
+    queryset = Jeff.polymorphs.models(*models, include_self=include_self).order_by('pk')
+    combos = tuple(generate_relation_combinations(discovery_lookup_from_model(Jeff, model))
+                   for model in models)
+    verbose = Jeff._base_manager.filter(verbose_q_filter(combos, include_self)).order_by('pk')
+    assert [x.pk for x in queryset] == [x.pk for x in verbose]
+    where = str(queryset.query).partition(' WHERE ')[2]
+    verbose_where = str(verbose.query).partition(' WHERE ')[2]
+    assert where.count('NULL') <= verbose_where.count('NULL')
+    if len(models) > 1:
+        assert len(where) < len(verbose_where)
+
+
+def test_clones_share_state():
+    base = Jeff.polymorphs.models(JeffSon).prefetch_models({JeffSon: ['fk2']})
+    clone = base.filter(v=1).order_by('pk')[:5]
+    assert clone._our_state is base._our_state
+    more = base.prefetch_models({JeffSon: ['fk'], JeffDaughter: ['fk3']})
+    assert base._our_prefetches == {JeffSon: ('fk2',)}
+    assert more._our_prefetches == {JeffSon: ('fk2', 'fk'), JeffDaughter: ('fk3',)}
+    widened = base.models(JeffDaughter)
+    assert base._subclasses == {JeffSon}
+    assert widened._subclasses == {JeffSon, JeffDaughter}
+    assert widened._our_joins == query_plans.get(Jeff, {JeffSon, JeffDaughter}).joins
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import unicode_literals
+import pytest
+from django.db import connection
+from django.db.models import F
+from django.test.utils import CaptureQueriesContext
+
+from inheritrix import SPLIT, split_querysets, ordering_key_getter
+from test_app.models import (Jeff, JeffSon, JeffDaughter, JeffGrandSon,
+                             JeffGreatGrandSon1, JeffGreatGrandSon2,
+                             JeffGreatGrandDaughter, Vehicle, Car, Bicycle)
+
+from conftest import ALL_MODELS, assert_same
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('models,options', [
+    ((), {'include_self': True}),
+    ((JeffSon,), {}),
+    ((JeffSon,), {'include_self': True}),
+    ((JeffGrandSon,), {'include_self': True}),
+    ((JeffSon, JeffGreatGrandSon1), {}),
+    ((JeffDaughter, JeffGreatGrandDaughter, JeffGreatGrandSon2), {'include_self': True}),
+    (ALL_MODELS[1:], {}),
+    (ALL_MODELS[1:], {'include_self': True}),
+])
+@pytest.mark.parametrize('ordering', [('pk',), ('-pk',), ('v', '-pk'), ('-v', 'id')])
+def test_split_matches_join(jeffs, models, options, ordering):
+    queryset = Jeff.polymorphs.models(*models, **options).order_by(*ordering)
+    queries = assert_same(queryset, SPLIT)
+    parts = split_querysets(queryset) or (queryset,)
+    assert len(queries) == len(parts)
+
+
+@pytest.mark.django_db
+def test_split_keeps_other_filters_and_select_related(jeffs):
+    queryset = (Jeff.polymorphs.filter(v__gte=1).select_subclasses()
+                .exclude(v=3).select_related('fk').order_by('-v', 'pk'))
+    queries = assert_same(queryset, SPLIT)
+    with CaptureQueriesContext(connection) as fk_queries:
+        for obj in queryset.strategy(SPLIT):
+            obj.fk
+    assert len(fk_queries) == len(queries)
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('start,stop', [(None, 3), (2, 7), (5, None)])
+def test_split_slicing(jeffs, start, stop):
+    queryset = Jeff.polymorphs.select_subclasses().order_by('-v', 'pk')[start:stop]
+    assert_same(queryset, SPLIT)
+
+
+@pytest.mark.django_db
+def test_split_only_joins_own_chain(jeffs):
+    queryset = Jeff.polymorphs.models(JeffGreatGrandSon1, JeffGreatGrandDaughter)
+    parts = split_querysets(queryset)
+    assert len(parts) == 2
+    for part in parts:
+        sql = str(part.query)
+        assert 'LEFT OUTER JOIN' not in sql
+        assert sql.count('INNER JOIN') == 3
+
+
+@pytest.mark.django_db
+def test_split_falls_back_to_join(jeffs):
+    queryset = Jeff.polymorphs.select_subclasses().order_by('fk__id', 'pk')
+    queries = assert_same(queryset, SPLIT)
+    assert len(queries) == 1
+    queryset = Jeff.polymorphs.select_subclasses().distinct()
+    assert len(assert_same(queryset, SPLIT)) == 1
+    # a single model is never worth splitting.
+    assert split_querysets(Jeff.polymorphs.models(JeffSon)) is None
+    # chained models() calls each filter, which one plan can't reproduce.
+    queryset = Jeff.polymorphs.models(JeffSon).models(JeffDaughter)
+    assert split_querysets(queryset) is None
+    assert_same(queryset, SPLIT)
+    assert not any(isinstance(x, JeffDaughter) for x in queryset.strategy(SPLIT))
+
+
+@pytest.mark.django_db
+def test_split_leaves_text_ordering_to_the_database():
+    for model, kind in ((Car, 'b'), (Bicycle, 'A'), (Car, 'a')):
+        model._default_manager.create(kind=kind)
+    queryset = Vehicle.polymorphs.models(Car, Bicycle).order_by('kind')
+    assert ordering_key_getter(queryset) is False
+    assert len(assert_same(queryset, SPLIT)) == 1
+    queryset = queryset.annotate(label=F('kind')).order_by('label')
+    assert ordering_key_getter(queryset) is False
+
+
+@pytest.mark.django_db
+def test_split_prefetches(jeffs):
+    queryset = (Jeff.polymorphs.select_subclasses().order_by('pk')
+                .prefetch_related('m2m').strategy(SPLIT))
+    results = list(queryset)
+    assert len(results) == len(jeffs)
+    with CaptureQueriesContext(connection) as queries:
+        for obj in results:
+            list(obj.m2m.all())
+    assert len(queries) == 0
+
+
+def test_unknown_strategy():
+    with pytest.raises(ValueError):
+        Jeff.polymorphs.strategy('union')
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import unicode_literals
+import copy
+import pickle
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from inheritrix import changed_fields, LAZY, SPLIT, TWO_PHASE
+from test_app.models import (Jeff, JeffSon, JeffDaughter, JeffGrandDaughter,
+                             JeffGreatGrandDaughter, RelatesToJeff, Post,
+                             Article)
+
+
+@pytest.fixture
+def daughter():
+    return JeffGreatGrandDaughter._default_manager.create(v=1)
+
+
+def fetch(pk, strategy=None):
+    queryset = Jeff.polymorphs.select_subclasses().track_changes()
+    if strategy is not None:
+        queryset = queryset.strategy(strategy)
+    return queryset.get(pk=pk)
+
+
+def saved_tables(obj):
+    with CaptureQueriesContext(connection) as queries:
+        obj.save()
+    return [query['sql'].split()[1].strip('"') for query in queries]
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('strategy', [None, SPLIT, TWO_PHASE, LAZY])
+def test_only_changed_tables_are_written(daughter, strategy):
+    obj = fetch(daughter.pk, strategy=strategy)
+    assert changed_fields(obj) == []
+    obj.v2 = 9
+    assert changed_fields(obj) == ['v2']
+    assert saved_tables(obj) == ['test_app_jeffgranddaughter']
+    assert changed_fields(obj) == []
+    assert saved_tables(obj) == []
+    obj.v = 7
+    obj.fk = RelatesToJeff._default_manager.create()
+    assert saved_tables(obj) == ['test_app_jeff']
+    found = JeffGreatGrandDaughter._default_manager.get(pk=daughter.pk)
+    assert (found.v, found.v2, found.fk_id) == (7, 9, obj.fk_id)
+
+
+@pytest.mark.django_db
+def test_update_fields_given(daughter):
+    obj = fetch(daughter.pk)
+    obj.v = 5
+    obj.v1 = 6
+    obj.save(update_fields=['v1'])
+    # v still hasn't been saved.
+    assert changed_fields(obj) == ['v']
+    assert saved_tables(obj) == ['test_app_jeff']
+
+
+@pytest.mark.django_db
+def test_full_save_when_copying(daughter):
+    obj = fetch(daughter.pk)
+    obj.pk = obj.id = obj.jeff_ptr_id = obj.jeffdaughter_ptr_id = None
+    obj.jeffgranddaughter_ptr_id = None
+    obj.v3 = 4
+    obj.save()
+    assert JeffGreatGrandDaughter._default_manager.count() == 2
+    assert JeffGreatGrandDaughter._default_manager.get(pk=obj.pk).v3 == 4
+
+
+@pytest.mark.django_db
+def test_deferred_fields_count_as_changed(daughter):
+    obj = (JeffDaughter.polymorphs.select_subclasses().track_changes()
+           .defer('v1').get(pk=daughter.pk))
+    assert changed_fields(obj) == []
+    assert obj.v1 == 1
+    assert changed_fields(obj) == ['v1']
+
+
+@pytest.mark.django_db
+def test_untracked_by_default(daughter):
+    obj = Jeff.polymorphs.select_subclasses().get(pk=daughter.pk)
+    assert changed_fields(obj) is None
+    assert len(saved_tables(obj)) == 4
+    queryset = Jeff.polymorphs.models(JeffSon, JeffGrandDaughter)
+    tracked = list(queryset.track_changes())
+    assert [changed_fields(x) for x in tracked] == [[]]
+    assert changed_fields(pickle.loads(pickle.dumps(tracked[0]))) == []
+
+
+@pytest.mark.django_db
+def test_copies_save_their_own_changes(daughter):
+    obj = fetch(daughter.pk)
+    dup = copy.copy(obj)
+    dup.v3 = 8
+    assert saved_tables(dup) == ['test_app_jeffgreatgranddaughter']
+    obj.v = 6
+    # the copy's save left the original's values as they were.
+    assert changed_fields(obj) == ['v']
+    assert saved_tables(obj) == ['test_app_jeff']
+    found = JeffGreatGrandDaughter._default_manager.get(pk=daughter.pk)
+    assert (found.v, found.v3) == (6, 8)
+
+
+@pytest.mark.django_db
+def test_pre_save_changes_are_saved():
+    article = Article._default_manager.create()
+    obj = Post.polymorphs.select_subclasses().track_changes().get()
+    updated = obj.updated
+    obj.body = 'text'
+    assert saved_tables(obj) == ['test_app_post', 'test_app_article']
+    assert obj.updated > updated
+    assert Post._default_manager.get(pk=article.pk).updated == obj.updated
+
+
+@pytest.mark.django_db
+def test_custom_save_arguments_are_passed_on():
+    Article._default_manager.create()
+    obj = Post.polymorphs.select_subclasses().track_changes().get()
+    obj.body = 'text'
+    obj.save(saved_by='me')
+    assert obj.saved_by == 'me'
+    assert changed_fields(obj) == []
+
+
+@pytest.mark.parametrize('model', [Jeff, JeffSon, JeffDaughter,
+                                   JeffGreatGrandDaughter, Post, Article])
+def test_hooks_are_installed_when_models_are_prepared(model):
+    assert model.__dict__['save'].inheritrix_tracked
+    assert model.__dict__['refresh_from_db'].inheritrix_lazy
+
+
+def test_hooks_are_left_out_without_inheriting_querysets():
+    assert 'save' not in RelatesToJeff.__dict__
+    assert 'refresh_from_db' not in RelatesToJeff.__dict__
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import unicode_literals
+import pytest
+from django.db import connection
+from django.db.models import F
+from django.test.utils import CaptureQueriesContext
+
+from inheritrix import TWO_PHASE
+from test_app.models import (Jeff, JeffSon, JeffDaughter, JeffGrandSon,
+                             JeffGreatGrandSon2, JeffGreatGrandDaughter)
+
+from conftest import ALL_MODELS, assert_same
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('models,options', [
+    ((), {'include_self': True}),
+    ((JeffSon,), {}),
+    ((JeffGrandSon,), {'include_self': True}),
+    ((JeffDaughter, JeffGreatGrandDaughter, JeffGreatGrandSon2), {'include_self': True}),
+    (ALL_MODELS[1:], {}),
+    (ALL_MODELS[1:], {'include_self': True}),
+])
+@pytest.mark.parametrize('ordering', [('pk',), ('-v', 'pk'), ('fk__id', '-pk')])
+def test_two_phase_matches_join(jeffs, models, options, ordering):
+    queryset = Jeff.polymorphs.models(*models, **options).order_by(*ordering)
+    queries = assert_same(queryset, TWO_PHASE)
+    # the keys, then one query per model found.
+    assert len(queries) == 1 + len(set(type(x) for x in queryset))
+
+
+@pytest.mark.django_db
+def test_two_phase_key_query_is_narrow(jeffs):
+    queryset = Jeff.polymorphs.select_subclasses().order_by('pk').strategy(TWO_PHASE)
+    with CaptureQueriesContext(connection) as queries:
+        list(queryset)
+    keys = queries[0]['sql']
+    assert '"v"' not in keys
+    assert '"fk_id"' not in keys
+    for query in queries.captured_queries[1:]:
+        assert 'LEFT OUTER JOIN' not in query['sql']
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('start,stop', [(None, 3), (2, 7), (5, None)])
+def test_two_phase_slicing(jeffs, start, stop):
+    queryset = Jeff.polymorphs.select_subclasses().order_by('-v', 'pk')[start:stop]
+    assert_same(queryset, TWO_PHASE)
+
+
+@pytest.mark.django_db
+def test_two_phase_keeps_filters_and_select_related(jeffs):
+    queryset = (Jeff.polymorphs.filter(v__gte=1).select_subclasses()
+                .exclude(v=3).select_related('fk').order_by('-v', 'pk'))
+    queries = assert_same(queryset, TWO_PHASE)
+    with CaptureQueriesContext(connection) as fk_queries:
+        for obj in queryset.strategy(TWO_PHASE):
+            obj.fk
+    assert len(fk_queries) == len(queries)
+
+
+@pytest.mark.django_db
+def test_two_phase_skip_parents(jeffs):
+    queryset = Jeff.polymorphs.select_subclasses().order_by('pk').skip_parents()
+    assert_same(queryset, TWO_PHASE)
+
+
+@pytest.mark.django_db
+def test_two_phase_prefetches(jeffs):
+    queryset = (Jeff.polymorphs.select_subclasses().order_by('pk')
+                .prefetch_related('m2m').strategy(TWO_PHASE))
+    results = list(queryset)
+    assert len(results) == len(jeffs)
+    with CaptureQueriesContext(connection) as queries:
+        for obj in results:
+            list(obj.m2m.all())
+    assert len(queries) == 0
+
+
+@pytest.mark.django_db
+def test_two_phase_falls_back_to_join(jeffs):
+    queryset = Jeff.polymorphs.select_subclasses().annotate(w=F('v')).order_by('pk')
+    assert len(assert_same(queryset, TWO_PHASE)) == 1
+    queryset = Jeff.polymorphs.select_subclasses().only('v').order_by('pk')
+    assert len(assert_same(queryset, TWO_PHASE)) == 1
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import unicode_literals
+import pickle
+import pytest
+from django.core.cache import caches
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from inheritrix import (TypeCache, LocalTypeCache, DjangoTypeCache,
+                        InheritingManager)
+from test_app.models import (Jeff, JeffSon, JeffDaughter, JeffGrandSon,
+                             JeffGreatGrandSon1, JeffGreatGrandDaughter)
+
+
+local_cache = LocalTypeCache(maxsize=100)
+django_cache = DjangoTypeCache()
+MODELS = (Jeff, JeffSon, JeffDaughter, JeffGrandSon, JeffGreatGrandSon1,
+          JeffGreatGrandDaughter)
+
+
+@pytest.fixture(params=['local', 'django'])
+def type_cache(request):
+    local_cache.clear()
+    caches['default'].clear()
+    return local_cache if request.param == 'local' else django_cache
+
+
+@pytest.fixture
+def cached(type_cache):
+    # connect before creating anything, to check that creating sets the types.
+    Jeff.polymorphs.use_type_cache(type_cache)
+    yield [model._default_manager.create(v=v) for v, model in enumerate(MODELS)]
+    type_cache.disconnect(Jeff)
+
+
+def cached_types(type_cache, objs):
+    keys = [('default', Jeff, obj.pk) for obj in objs]
+    found = type_cache.get_many(keys)
+    return [found.get(key) for key in keys]
+
+
+@pytest.mark.django_db
+def test_created_types_are_cached(type_cache, cached):
+    assert cached_types(type_cache, cached) == list(MODELS)
+
+
+@pytest.mark.django_db
+def test_get_goes_straight_to_the_model(type_cache, cached):
+    queryset = Jeff.polymorphs.select_subclasses().use_type_cache(type_cache)
+    for obj in cached:
+        with CaptureQueriesContext(connection) as queries:
+            found = queryset.get(pk=obj.pk)
+        assert found == obj
+        assert type(found) is type(obj)
+        assert len(queries) == 1
+        assert 'LEFT OUTER JOIN' not in queries[0]['sql']
+
+
+@pytest.mark.django_db
+def test_get_miss_remembers(type_cache, cached):
+    type_cache.delete_many([('default', Jeff, obj.pk) for obj in cached])
+    queryset = Jeff.polymorphs.select_subclasses().use_type_cache(type_cache)
+    with CaptureQueriesContext(connection) as queries:
+        assert type(queryset.get(id=cached[4].pk)) is JeffGreatGrandSon1
+    assert 'LEFT OUTER JOIN' in queries[0]['sql']
+    assert cached_types(type_cache, cached) == [None] * 4 + [JeffGreatGrandSon1, None]
+
+
+@pytest.mark.django_db
+def test_get_respects_models(type_cache, cached):
+    queryset = Jeff.polymorphs.models(JeffSon).use_type_cache(type_cache)
+    assert type(queryset.get(pk=cached[4].pk)) is JeffSon
+    with pytest.raises(Jeff.DoesNotExist):
+        queryset.get(pk=cached[2].pk)
+    # only JeffSon was joined, so it can't know what else they are.
+    type_cache.delete_many([('default', Jeff, obj.pk) for obj in cached])
+    queryset.get(pk=cached[4].pk)
+    assert cached_types(type_cache, cached) == [None] * 6
+
+
+@pytest.mark.django_db
+def test_get_with_other_filters(type_cache, cached):
+    queryset = Jeff.polymorphs.select_subclasses().use_type_cache(type_cache)
+    with pytest.raises(Jeff.DoesNotExist):
+        queryset.filter(v=0).get(pk=cached[1].pk)
+    with CaptureQueriesContext(connection) as queries:
+        assert type(queryset.exclude(v=0).get(pk=cached[1].pk)) is JeffSon
+    assert 'LEFT OUTER JOIN' in queries[0]['sql']
+
+
+@pytest.mark.django_db
+def test_stale_types_are_corrected(type_cache, cached):
+    type_cache.set_many({('default', Jeff, cached[0].pk): JeffDaughter})
+    queryset = Jeff.polymorphs.select_subclasses().use_type_cache(type_cache)
+    assert type(queryset.get(pk=cached[0].pk)) is Jeff
+    assert cached_types(type_cache, cached[0:1]) == [Jeff]
+
+
+@pytest.mark.django_db
+def test_saving_and_deleting_forget(type_cache, cached):
+    cached[1].save()
+    cached[2].delete()
+    assert cached_types(type_cache, cached[0:3]) == [Jeff, None, None]
+
+
+@pytest.mark.django_db
+def test_in_bulk_groups_by_type(type_cache, cached):
+    queryset = Jeff.polymorphs.select_subclasses().use_type_cache(type_cache)
+    type_cache.delete_many([('default', Jeff, cached[0].pk)])
+    pks = [obj.pk for obj in cached] + [0]
+    with CaptureQueriesContext(connection) as queries:
+        found = queryset.in_bulk(pks)
+    # one per cached model, and one to look up the rest.
+    assert len(queries) == len(MODELS)
+    assert found == dict((obj.pk, obj) for obj in cached)
+    assert dict((pk, type(obj)) for pk, obj in found.items()) == dict(
+        (obj.pk, type(obj)) for obj in cached)
+    with CaptureQueriesContext(connection) as queries:
+        found = queryset.in_bulk([str(cached[0].pk)])
+    assert found == {cached[0].pk: cached[0]}
+    assert 'LEFT OUTER JOIN' not in queries[0]['sql']
+
+
+@pytest.mark.django_db
+def test_manager_type_cache(type_cache, cached):
+    manager = InheritingManager(type_cache=type_cache)
+    manager.model = Jeff
+    found = manager.select_subclasses().get(pk=cached[3].pk)
+    assert type(found) is JeffGrandSon
+
+
+def test_django_cache_keys():
+    assert django_cache.make_key(('default', Jeff, 1)) == 'inheritrix:default:test_app.jeff:1'
+
+
+@pytest.mark.django_db
+def test_disconnect(type_cache, cached):
+    type_cache.disconnect(Jeff)
+    obj = JeffSon._default_manager.create()
+    assert cached_types(type_cache, [obj]) == [None]
+    Jeff.polymorphs.use_type_cache(type_cache)
+    obj = JeffSon._default_manager.create()
+    assert cached_types(type_cache, [obj]) == [JeffSon]
+
+
+@pytest.mark.django_db
+def test_pickled_querysets_keep_the_cache(type_cache, cached):
+    queryset = Jeff.polymorphs.select_subclasses().use_type_cache(type_cache)
+    unpickled = pickle.loads(pickle.dumps(queryset))
+    cache = unpickled._our_type_cache
+    try:
+        assert type(cache) is type(type_cache) and cache is not type_cache
+        assert type(unpickled.get(pk=cached[4].pk)) is JeffGreatGrandSon1
+        # the copy is connected, so creating records the type in it too.
+        obj = JeffSon._default_manager.create()
+        assert cached_types(cache, [obj]) == [JeffSon]
+    finally:
+        cache.disconnect(Jeff)
+
+
+def test_type_caches_must_implement_storage():
+    with pytest.raises(TypeError):
+        TypeCache()
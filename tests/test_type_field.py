@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import unicode_literals
+import pytest
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection
+from django.db.models.signals import pre_save
+from django.test.utils import CaptureQueriesContext, isolate_apps
+
+from inheritrix import (JOIN, TWO_PHASE, backfill_type_field, matching_models,
+                        maintain_type_field)
+from test_app.models import Jeff, Vehicle, Car, SportsCar, Bicycle
+
+
+ALL_MODELS = (Vehicle, Car, SportsCar, Bicycle)
+FIELDS = {'by_kind': 'kind', 'by_content_type': 'content_type'}
+# selections which filter on the type field, and which would otherwise need
+# the children joining.
+FILTERED = [
+    ((Car,), {}),
+    ((SportsCar,), {'include_self': True}),
+    ((SportsCar, Bicycle), {}),
+]
+
+
+@pytest.fixture
+def vehicles():
+    return [model._default_manager.create(wheels=v)
+            for v, model in enumerate(ALL_MODELS * 3)]
+
+
+def where(queryset):
+    return str(queryset.query).partition(' WHERE ')[2]
+
+
+@pytest.mark.django_db
+def test_maintained_on_save(vehicles):
+    sports_car = Vehicle._base_manager.get(pk=vehicles[2].pk)
+    assert sports_car.kind == 'test_app.sportscar'
+    content_type = ContentType.objects.get_for_model(SportsCar)
+    assert sports_car.content_type == content_type
+
+
+def test_maintained_only_for_the_hierarchy():
+    receiver = maintain_type_field(Vehicle, 'kind')
+    for model in ALL_MODELS:
+        assert receiver in pre_save._live_receivers(model)
+    assert receiver not in pre_save._live_receivers(Jeff)
+
+
+@pytest.mark.django_db
+@isolate_apps('test_app')
+def test_maintained_for_classes_prepared_later():
+    class CarProxy(Car):
+        class Meta:
+            app_label = 'test_app'
+            proxy = True
+
+    assert CarProxy._default_manager.create().kind == 'test_app.car'
+
+
+@pytest.mark.parametrize('models,options,expected', [
+    ((Car,), {}, (Car, SportsCar)),
+    ((SportsCar,), {'include_self': True}, (Vehicle, SportsCar, Bicycle)),
+    ((SportsCar, Bicycle), {}, (SportsCar, Bicycle)),
+    ((Car, Bicycle), {'include_self': True}, ALL_MODELS),
+])
+def test_matching_models(models, options, expected):
+    subclasses = set(models) | ({Vehicle} if options else set())
+    assert set(matching_models(Vehicle, subclasses)) == set(expected)
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('manager', ['by_kind', 'by_content_type'])
+@pytest.mark.parametrize('strategy', [JOIN, TWO_PHASE])
+@pytest.mark.parametrize('models,options', [
+    ((), {'include_self': True}),
+    ((Car,), {}),
+    ((SportsCar,), {'include_self': True}),
+    ((SportsCar, Bicycle), {}),
+    ((Car, Bicycle), {'include_self': True}),
+])
+def test_type_field_matches_joins(vehicles, manager, strategy, models, options):
+    expected = list(Vehicle.polymorphs.models(*models, **options)
+                    .order_by('pk'))
+    queryset = (getattr(Vehicle, manager).models(*models, **options)
+                .order_by('pk'))
+    # filtered by the field alone, when filtered at all.
+    clause = where(queryset)
+    assert not clause or clause.startswith(
+        ('"test_app_vehicle"."kind" IN (',
+         '"test_app_vehicle"."content_type_id" IN ('))
+    assert ' OR ' not in clause
+    results = list(queryset.strategy(strategy))
+    assert results == expected
+    assert [type(x) for x in results] == [type(x) for x in expected]
+    # with untyped_rows, rows from before the type field was maintained are
+    # still found.
+    Vehicle._base_manager.update(kind=None, content_type=None)
+    untyped = (Vehicle.polymorphs
+               .use_type_field(FIELDS[manager], untyped_rows=True)
+               .models(*models, **options).order_by('pk'))
+    results = list(untyped.strategy(strategy))
+    assert results == expected
+    assert [type(x) for x in results] == [type(x) for x in expected]
+    assert untyped.count_by_model() == Vehicle.polymorphs.models(
+        *models, **options).count_by_model()
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('models,options', FILTERED)
+def test_untyped_rows_are_left_out_by_default(vehicles, models, options):
+    queryset = Vehicle.by_kind.models(*models, **options)
+    Vehicle._base_manager.filter(pk=vehicles[2].pk).update(kind=None)
+    assert vehicles[2].pk not in [x.pk for x in queryset]
+
+
+@pytest.mark.django_db
+def test_type_field_filters_by_equality(vehicles):
+    queryset = Vehicle.by_kind.models(SportsCar, Bicycle)
+    clause = where(queryset)
+    assert clause.startswith('"test_app_vehicle"."kind" IN (')
+    values = clause.partition(' IN (')[2].partition(')')[0]
+    assert sorted(values.split(', ')) == ['test_app.bicycle',
+                                          'test_app.sportscar']
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('models,options,wheels,expected', [
+    ((Car, SportsCar, Bicycle), {'include_self': True}, (1, 5), [Car, Car]),
+    ((Car,), {}, (1, 5), [Car, Car]),
+    ((SportsCar,), {'include_self': True}, (2, 6), [SportsCar, SportsCar]),
+    ((SportsCar, Bicycle), {}, (2, 6), [SportsCar, SportsCar]),
+])
+def test_type_field_only_joins_for_the_page(vehicles, models, options,
+                                            wheels, expected):
+    queryset = (Vehicle.by_kind.models(*models, **options)
+                .filter(wheels__in=wheels).order_by('pk'))
+    assert queryset._our_strategy == TWO_PHASE
+    with CaptureQueriesContext(connection) as queries:
+        results = list(queryset)
+    assert [type(x) for x in results] == expected
+    keys, page = [query['sql'] for query in queries.captured_queries]
+    assert 'JOIN' not in keys
+    assert 'test_app_bicycle' not in page
+    if SportsCar not in expected:
+        assert 'test_app_sportscar' not in page
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('strategy', [JOIN, TWO_PHASE])
+def test_type_field_unknown_values_fall_back(vehicles, strategy):
+    Vehicle._base_manager.filter(
+        pk__in=[x.pk for x in vehicles[0:6]]).update(kind=None)
+    Vehicle._base_manager.filter(pk=vehicles[7].pk).update(kind='who.knows')
+    results = list(Vehicle.by_kind.select_subclasses().order_by('pk')
+                   .strategy(strategy))
+    assert [type(x) for x in results] == [type(x) for x in vehicles]
+
+
+@pytest.mark.django_db
+def test_backfill(vehicles):
+    Vehicle._base_manager.update(kind=None, content_type=None)
+    updated = backfill_type_field(Vehicle, 'kind')
+    assert updated == {Vehicle: 12, Car: 6, SportsCar: 3, Bicycle: 3}
+    backfill_type_field(Vehicle, 'content_type')
+    for vehicle in vehicles:
+        row = Vehicle._base_manager.get(pk=vehicle.pk)
+        assert row.kind == type(vehicle)._meta.label_lower
+        content_type = ContentType.objects.get_for_model(type(vehicle))
+        assert row.content_type == content_type
+
+
+@pytest.mark.django_db
+def test_backfill_with_type_values(vehicles):
+    values = {Vehicle: 'v', Car: 'c', SportsCar: 's', Bicycle: 'b'}
+    backfill_type_field(Vehicle, 'kind', type_values=values)
+    kinds = Vehicle._base_manager.order_by('pk').values_list('kind', flat=True)
+    assert list(kinds) == ['v', 'c', 's', 'b'] * 3
+    queryset = Vehicle.polymorphs.use_type_field('kind', type_values=values)
+    results = queryset.models(Car, SportsCar).order_by('pk')
+    assert [type(x) for x in results] == [Car, SportsCar] * 3
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('models,options', [
+    ((Car, Bicycle), {'include_self': True}),
+] + FILTERED)
+def test_count_by_model_without_joins(vehicles, models, options):
+    queryset = Vehicle.by_kind.models(*models, **options)
+    with CaptureQueriesContext(connection) as queries:
+        counts = queryset.count_by_model()
+    assert len(queries) == 1
+    assert 'JOIN' not in queries[0]['sql']
+    assert counts == Vehicle.polymorphs.models(
+        *models, **options).count_by_model()
+
+
+@pytest.mark.django_db
+def test_type_field_keeps_the_chosen_strategy():
+    assert Vehicle.by_kind.all()._our_strategy == TWO_PHASE
+    assert Vehicle.by_kind.strategy(JOIN)._our_strategy == JOIN
+    queryset = Vehicle.polymorphs.strategy(JOIN).use_type_field('kind')
+    assert queryset._our_strategy == JOIN
+    assert Vehicle.polymorphs.use_type_field('kind')._our_strategy == TWO_PHASE
+
+
+def test_manager_builds_the_type_column_once():
+    type_column = Vehicle.by_kind.all()._our_type_column
+    assert Vehicle.by_kind.all()._our_type_column is type_column
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import unicode_literals
+import pytest
+from django.db import connection
+from django.db.models import Count
+from django.test.utils import CaptureQueriesContext
+
+import inheritrix
+from inheritrix import get_inheritance_graph
+from test_app.models import (Jeff, JeffSon, JeffDaughter, JeffGrandSon,
+                             JeffGrandDaughter, JeffGreatGrandSon1,
+                             JeffGreatGrandSon2, JeffGreatGrandDaughter)
+
+from conftest import ALL_MODELS
+
+
+@pytest.fixture
+def no_probing(monkeypatch):
+    def resolve_from_row(row, type_columns):
+        raise AssertionError("resolved from the children's columns")
+    monkeypatch.setattr(inheritrix, 'resolve_from_row', resolve_from_row)
+
+
+def test_graph_models_and_indexes():
+    graph = get_inheritance_graph(Jeff)
+    assert graph.models[0] is Jeff
+    assert set(graph.models) == set(ALL_MODELS)
+    assert all(graph.models[graph.type_indexes[model]] is model for model in ALL_MODELS)
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('skip_parents', [False, True])
+def test_type_index_dispatch(jeffs, no_probing, skip_parents):
+    queryset = Jeff.polymorphs.select_subclasses().annotate_type_index().order_by('pk')
+    if skip_parents:
+        queryset = queryset.skip_parents()
+    results = list(queryset)
+    assert [type(x) for x in results] == [type(x) for x in jeffs]
+    type_indexes = get_inheritance_graph(Jeff).type_indexes
+    assert [x.type_index for x in results] == [type_indexes[type(x)] for x in jeffs]
+
+
+@pytest.mark.django_db
+def test_type_index_maps_unselected_to_nearest_selected(jeffs, request):
+    expected = list(Jeff.polymorphs.models(JeffSon, JeffGreatGrandDaughter,
+                                           include_self=True).order_by('pk'))
+    request.getfixturevalue('no_probing')
+    queryset = (Jeff.polymorphs.annotate_type_index()
+                .models(JeffSon, JeffGreatGrandDaughter, include_self=True).order_by('pk'))
+    results = list(queryset)
+    assert results == expected
+    assert [type(x) for x in results] == [type(x) for x in expected]
+
+
+@pytest.mark.django_db
+def test_type_index_without_every_join_falls_back(jeffs):
+    queryset = (Jeff.polymorphs.models(JeffSon).annotate_type_index()
+                .models(JeffGreatGrandSon1).order_by('pk'))
+    expected = list(Jeff.polymorphs.models(JeffSon, JeffGreatGrandSon1).order_by('pk'))
+    assert [type(x) for x in queryset] == [type(x) for x in expected]
+
+
+@pytest.mark.django_db
+def test_type_index_filter_and_order_by(jeffs):
+    type_indexes = get_inheritance_graph(Jeff).type_indexes
+    queryset = Jeff.polymorphs.select_subclasses().annotate_type_index()
+    daughters = queryset.filter(type_index=type_indexes[JeffGrandDaughter])
+    assert [type(x) for x in daughters] == [JeffGrandDaughter, JeffGrandDaughter]
+    ordered = list(queryset.order_by('-type_index', 'pk'))
+    assert [x.type_index for x in ordered] == sorted((x.type_index for x in ordered), reverse=True)
+
+
+@pytest.mark.django_db
+def test_type_index_counts_in_one_query(jeffs):
+    queryset = (Jeff.polymorphs.select_subclasses().annotate_type_index()
+                .values('type_index').annotate(n=Count('pk')).order_by('type_index'))
+    with CaptureQueriesContext(connection) as queries:
+        counts = dict((row['type_index'], row['n']) for row in queryset)
+    assert len(queries) == 1
+    graph = get_inheritance_graph(Jeff)
+    assert counts == dict((graph.type_indexes[model], 2) for model in ALL_MODELS)
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('models,options', [
+    ((), {'include_self': True}),
+    ((JeffSon,), {}),
+    ((JeffSon, JeffGreatGrandSon1), {'include_self': True}),
+    ((JeffDaughter, JeffGreatGrandDaughter, JeffGreatGrandSon2), {}),
+])
+def test_count_by_model_matches_iterating(jeffs, models, options):
+    queryset = Jeff.polymorphs.models(*models, **options).filter(v__gte=3)
+    with CaptureQueriesContext(connection) as queries:
+        counts = queryset.count_by_model()
+    assert len(queries) == 1
+    expected = {}
+    for obj in queryset:
+        expected[type(obj)] = expected.get(type(obj), 0) + 1
+    assert dict((model, n) for model, n in counts.items() if n) == expected
+    assert sum(counts.values()) == queryset.count()
+
+
+@pytest.mark.django_db
+def test_count_by_model_includes_selected_models_without_rows(jeffs):
+    JeffGreatGrandSon1._default_manager.all().delete()
+    counts = (Jeff.polymorphs.models(JeffSon, JeffGreatGrandSon1)
+              .prefetch_models({JeffSon: ['m2m']}).count_by_model())
+    # JeffGrandSon isn't selected, but it's joined on the way to
+    # JeffGreatGrandSon1, and so that's what its rows come back as.
+    assert counts == {JeffSon: 2, JeffGrandSon: 4, JeffGreatGrandSon1: 0}
+
+
+@pytest.mark.django_db
+def test_count_by_model_without_models(jeffs):
+    counts = Jeff.polymorphs.filter(v__lt=4).count_by_model()
+    assert counts == {Jeff: len([x for x in jeffs if x.v < 4])}
+    assert type(counts) is type(Jeff.polymorphs.select_subclasses().count_by_model())
+
+
+def test_count_by_model_after_slicing():
+    with pytest.raises(AssertionError):
+        Jeff.polymorphs.select_subclasses()[:5].count_by_model()
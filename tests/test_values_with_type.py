@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import unicode_literals
+import pytest
+from django.db import connection
+from django.db.models import F
+from django.db.models.signals import pre_init
+from django.test.utils import CaptureQueriesContext
+
+from test_app.models import (Jeff, JeffSon, JeffDaughter, JeffGrandSon,
+                             JeffGreatGrandSon1, JeffGreatGrandDaughter)
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('models,options', [
+    ((), {'include_self': True}),
+    ((JeffSon,), {'include_self': True}),
+    ((JeffGreatGrandSon1, JeffGreatGrandDaughter), {}),
+    ((JeffDaughter, JeffGrandSon), {'include_self': True}),
+])
+def test_values_with_type_matches_instances(jeffs, models, options):
+    queryset = Jeff.polymorphs.models(*models, **options).order_by('pk')
+    expected = [(x.pk, x._meta.label) for x in queryset]
+    assert [(x['pk'], x['model']) for x in queryset.values('pk', with_type=True)] == expected
+    assert list(queryset.values_list('pk', with_type=True)) == expected
+
+
+@pytest.mark.django_db
+def test_values_with_type_builds_no_instances(jeffs):
+    built = []
+
+    def counter(sender, **kwargs):
+        built.append(sender)
+    pre_init.connect(counter)
+    try:
+        with CaptureQueriesContext(connection) as queries:
+            results = list(Jeff.polymorphs.select_subclasses().values_list('pk', with_type=True))
+    finally:
+        pre_init.disconnect(counter)
+    assert len(results) == len(jeffs)
+    assert len(queries) == 1
+    assert built == []
+
+
+@pytest.mark.django_db
+def test_values_with_type_without_models(jeffs):
+    results = Jeff.polymorphs.order_by('pk').values_list('v', with_type=True)
+    assert list(results) == [(x.v, x._meta.label) for x in jeffs]
+
+
+@pytest.mark.django_db
+def test_values_with_type_named(jeffs):
+    queryset = Jeff.polymorphs.models(JeffDaughter).filter(pk=jeffs[4].pk)
+    # JeffGrandDaughter wasn't selected, so is a JeffDaughter, as instances would be.
+    assert queryset.values('v', with_type='kind').get() == {'v': 4, 'kind': 'test_app.JeffDaughter'}
+    assert type(queryset.get()) is JeffDaughter
+
+
+@pytest.mark.django_db
+def test_values_with_type_and_no_fields(jeffs):
+    queryset = Jeff.polymorphs.models(JeffSon).filter(pk=jeffs[1].pk)
+    result = queryset.annotate(w=F('v') * 2).values(with_type=True).get()
+    assert result == {'id': jeffs[1].pk, 'v': 1, 'fk_id': jeffs[1].fk_id,
+                      'w': 2, 'model': 'test_app.JeffSon'}
+    result = queryset.values_list(with_type=True).get()
+    assert result == (jeffs[1].pk, 1, jeffs[1].fk_id,
+                      'test_app.JeffSon')
+
+
+@pytest.mark.django_db
+def test_values_without_type_unchanged(jeffs):
+    assert list(Jeff.polymorphs.order_by('pk').values_list('pk', flat=True)) == [x.pk for x in jeffs]
+    with pytest.raises(TypeError):
+        Jeff.polymorphs.values_list('pk', flat=True, with_type=True)